@@ -10,7 +10,10 @@ from ..auth import req_admin
 from ..version import MOLIOR_VERSION
 from ..molior.backend import Backend
 from ..molior.configuration import Configuration
-from ..aptly import get_aptly_connection
+from ..molior.fairshare import fair_share
+from ..molior.queues import buildtasks, buildlog_writer
+from ..molior.subscriptions import event_dispatcher
+from ..aptly import get_aptly_connection, aptly_connections
 
 
 @app.http_get("/api/status")
@@ -226,8 +229,91 @@ async def get_node(request):
     machine_id = request.match_info["machineID"]
     b = Backend()
     backend = b.get_backend()
-    build_nodes = backend.get_nodes_info()
-    for node in build_nodes:
-        if machine_id == node["id"]:
-            return web.json_response(node)
+    node = backend.get_node_info(machine_id)
+    if node:
+        return web.json_response(node)
     return web.Response(text="Node not found", status=404)
+
+
+@app.http_get("/api/buildqueue")
+async def get_buildqueue(request):
+    """
+    Returns the fair share of the build nodes and
+    the backlog per project for each architecture
+
+    ---
+    description: Returns the fair share of the build nodes and the backlog per project
+    tags:
+        - Status
+    produces:
+        - text/json
+    responses:
+        "200":
+            description: successful
+        "500":
+            description: internal server error
+    """
+    return web.json_response(fair_share.status(buildtasks))
+
+
+@app.http_get("/api/buildlogs")
+async def get_buildlogs(request):
+    """
+    Returns the open build log files and
+    the buffered bytes per build
+
+    ---
+    description: Returns the open build log files and the buffered bytes per build
+    tags:
+        - Status
+    produces:
+        - text/json
+    responses:
+        "200":
+            description: successful
+        "500":
+            description: internal server error
+    """
+    return web.json_response(buildlog_writer.status())
+
+
+@app.http_get("/api/websockets")
+async def get_websockets(request):
+    """
+    Returns the send queue length and the dropped
+    notifications of each websocket client
+
+    ---
+    description: Returns the send queue length and the dropped notifications of each websocket client
+    tags:
+        - Status
+    produces:
+        - text/json
+    responses:
+        "200":
+            description: successful
+        "500":
+            description: internal server error
+    """
+    return web.json_response(event_dispatcher.status())
+
+
+@app.http_get("/api/aptlyconnections")
+async def get_aptly_connections(request):
+    """
+    Returns the requests, opened and reused
+    connections per aptly api url
+
+    ---
+    description: Returns the requests, opened and reused connections per aptly api url
+    tags:
+        - Status
+    produces:
+        - text/json
+    responses:
+        "200":
+            description: successful
+        "500":
+            description: internal server error
+    """
+    return web.json_response(aptly_connections.status())
@@ -2,12 +2,14 @@ import asyncio
 import json
 
 from pathlib import Path
-from aiofile import AIOFile, Reader
 
 from ..app import app, logger
 from ..molior.notifier import Subject, Event, Action
+from ..molior.queues import buildlog_writer
+from ..molior.logwriter import read_log
+from ..molior.subscriptions import event_dispatcher
 from ..model.database import Session
-from ..model.build import Build
+from ..model.build import Build, FINISHED_STATES
 
 BUILD_OUT_PATH = Path("/var/lib/molior/buildout")
 
@@ -15,13 +17,18 @@ BUILD_OUT_PATH = Path("/var/lib/molior/buildout")
 class BuildLogger:
     """
     Provides helper functions for livelogging on molior.
+
+    The log file is read once, further log chunks are pushed
+    by the build log writer until the build is finished.
     """
 
-    def __init__(self, sender, build_id):
+    def __init__(self, sender, build_id, offset=0):
         self.__sender = sender
         self.build_id = build_id
+        self.offset = offset
         self.__up = False
         self.__filepath = BUILD_OUT_PATH / str(build_id) / "build.log"
+        self.__subscription = None
 
     def stop(self):
         """
@@ -29,6 +36,8 @@ class BuildLogger:
         """
         logger.debug("build-{}: stopping buildlogger".format(self.build_id))
         self.__up = False
+        if self.__subscription:
+            self.__subscription.close()
 
     def check_abort(self):
         with Session() as session:
@@ -36,49 +45,62 @@ class BuildLogger:
             if not build:
                 logger.error("build: build %d not found", self.build_id)
                 return True
-            if build.buildstate == "build_failed" or \
-               build.buildstate == "publish_failed" or \
-               build.buildstate == "successful" or \
-               build.buildstate == "already_exists" or \
-               build.buildstate == "already_failed" or \
-               build.buildstate == "nothing_done":
+            if build.buildstate in FINISHED_STATES:
                 return True
         return False
 
+    async def send(self, data, offset):
+        """
+        Sends log data, offset is the byte offset following the
+        data, to be used for resuming the log.
+        """
+        message = {"event": Event.added.value,
+                   "subject": Subject.buildlog.value,
+                   "data": str(data, 'utf-8', errors="ignore"),
+                   "offset": offset}
+        await self.__sender(json.dumps(message))
+
     async def start(self):
         """
         Starts the livelogging
         """
         logger.debug("build-{}: starting buildlogger".format(self.build_id))
         self.__up = True
-        while self.__up:
+        # subscribe before reading the file, so no chunk is missed
+        self.__subscription = buildlog_writer.subscribe(self.build_id)
+        try:
+            position = self.offset
             try:
-                async with AIOFile(str(self.__filepath), "rb") as log_file:
-                    reader = Reader(log_file, chunk_size=16384)
-                    retries = 0
-                    while self.__up:
-                        async for data in reader:
-                            message = {"event": Event.added.value,
-                                       "subject": Subject.buildlog.value,
-                                       "data": str(data, 'utf-8', errors="ignore")}
-                            await self.__sender(json.dumps(message))
-
-                        # EOF
-                        if retries % 100 == 0:
-                            retries = 0
-                            if self.check_abort():
-                                self.stop()
-                                break
-                        retries += 1
-                        await asyncio.sleep(.1)
+                async for data in read_log(self.__filepath, offset=position, chunk_size=16384):
+                    position += len(data)
+                    await self.send(data, position)
             except FileNotFoundError:
-                await asyncio.sleep(1)
-                self.check_abort()
-            except Exception as exc:
-                logger.error("buildlogger: error sending buildlogs")
-                logger.exception(exc)
+                pass
+
+            if not buildlog_writer.is_active(self.build_id) and self.check_abort():
                 self.stop()
 
+            while self.__up:
+                item = await self.__subscription.get()
+                if item is None:
+                    break
+                offset, data = item
+                if offset == 0 and position > 0:
+                    # log was recreated by a rebuild
+                    position = 0
+                end = offset + len(data)
+                if end <= position:
+                    continue  # already read from the file
+                if offset < position:
+                    data = data[position - offset:]
+                await self.send(data, end)
+                position = end
+
+        except Exception as exc:
+            logger.error("buildlogger: error sending buildlogs")
+            logger.exception(exc)
+        self.stop()
+
         message = {"subject": Subject.buildlog.value, "event": Event.done.value}
         await self.__sender(json.dumps(message))
 
@@ -90,16 +112,23 @@ async def start_buildlogger(ws, data):
 
     Args:
         websocket: The websocket instance.
-        data (dict): The received data.
+        data (dict): The received data, the build_id and optionally
+                     the byte offset to resume the log from.
     """
     if "build_id" not in data:
         logger.error("buildlogger: no build ID found")
         return False
 
+    try:
+        offset = max(int(data.get("offset", 0)), 0)
+    except (ValueError, TypeError):
+        logger.error("buildlogger: invalid offset")
+        return False
+
     if hasattr(ws, "molior_buildlogger") and ws.molior_buildlogger:
         await stop_buildlogger(ws)
 
-    molior_buildlogger = BuildLogger(ws.send_str, data.get("build_id"))
+    molior_buildlogger = BuildLogger(ws.send_str, data.get("build_id"), offset)
     ws.molior_buildlogger = molior_buildlogger
     loop = asyncio.get_event_loop()
     loop.create_task(molior_buildlogger.start())
@@ -114,12 +143,35 @@ async def stop_buildlogger(ws):
         delattr(ws, "molior_buildlogger")
 
 
+async def watch_events(ws, data):
+    """
+    Subscribes the websocket client to topics, or unsubscribes it.
+
+    Args:
+        websocket: The websocket instance.
+        data (dict): The received data, the action and
+                     the topics in data["data"]["topics"].
+    """
+    topics = (data.get("data") or {}).get("topics")
+    if not isinstance(topics, list):
+        logger.error("websocket: no topics to watch found")
+        return
+
+    if data.get("action") == Action.add.value:
+        event_dispatcher.subscribe(ws, topics)
+    elif data.get("action") == Action.remove.value:
+        event_dispatcher.unsubscribe(ws, topics)
+    else:
+        logger.error("unknown websocket message recieved: {}".format(data))
+
+
 @app.websocket_connect()
 async def websocket_connected(ws):
     """
     Sends a 'connected' message to the websocket client on connect.
     """
     await ws.send_str(json.dumps({"subject": Subject.websocket.value, "event": Event.connected.value}))
+    event_dispatcher.add_client(ws)
     logger.debug("websocket: new connection from user %s", ws.cirrina.web_session.get("username"))
 
 
@@ -137,6 +189,10 @@ async def websocket_message(ws, msg):
         logger.error("unknown websocket message recieved: {}".format(data))
         return
 
+    if data.get("subject") == Subject.eventwatch.value:
+        await watch_events(ws, data)
+        return
+
     if data.get("subject") != Subject.buildlog.value:
         logger.error("unknown websocket message recieved: {}".format(data))
         return
@@ -156,5 +212,6 @@ async def websocket_closed(ws):
     On websocket disconnect handler.
     """
     logger.debug("websocket connection closed")
+    event_dispatcher.remove_client(ws)
     if hasattr(ws, "molior_buildlogger"):
         delattr(ws, "molior_buildlogger")
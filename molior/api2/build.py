@@ -1,8 +1,32 @@
+import asyncio
+
+from aiohttp import web
+from aiofile import AIOFile, Reader
+from pathlib import Path
+
 from ..app import app, logger
-from ..model.build import Build
-from ..molior.queues import enqueue_aptly
+from ..model.build import Build, FINISHED_STATES
+from ..molior.configuration import Configuration
+from ..molior.logwriter import find_log_file, find_tail_offset, get_log_size, read_log
+from ..molior.logindex import ENTRY_TYPES, read_log_index
+from ..molior.queues import enqueue_aptly, buildlog_writer
 from ..tools import OKResponse, ErrorResponse
 
+LOG_CHUNK_SIZE = 65536
+
+
+def get_accepted_encodings(request):
+    """
+    Returns the content encodings accepted by the client.
+    """
+    encodings = []
+    for value in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = value.partition(";")
+        if params.replace(" ", "") in ["q=0", "q=0.0", "q=0.00", "q=0.000"]:
+            continue
+        encodings.append(encoding.strip().lower())
+    return encodings
+
 
 @app.http_delete("/api2/build/{build_id}")
 @app.authenticated
@@ -145,3 +169,181 @@ async def abort_build(request):
     args = {"abort": [topbuild.id]}
     await enqueue_aptly(args)
     return OKResponse("Abort initiated")
+
+
+@app.http_get("/api2/build/{build_id}/log")
+@app.authenticated
+async def get_build_log(request):
+    """
+    Returns the build log from a byte offset, the last lines,
+    or the byte range requested by the Range header.
+
+    The response headers contain the current log size (X-Log-Size)
+    and whether the log is complete (X-Log-Complete), so clients
+    can resume at the size they received. Sizes and offsets refer
+    to the uncompressed log, complete compressed logs are sent with
+    Content-Encoding to clients accepting it.
+
+    ---
+    description: Returns the build log
+    tags:
+        - Builds
+    parameters:
+        - name: build_id
+          in: path
+          required: true
+          type: integer
+        - name: offset
+          in: query
+          required: false
+          type: integer
+          description: byte offset to start from
+        - name: tail
+          in: query
+          required: false
+          type: integer
+          description: return the last lines only
+    produces:
+        - text/plain
+    responses:
+        "200":
+            description: successful
+        "206":
+            description: partial content for Range requests
+        "404":
+            description: build or log not found
+        "416":
+            description: range not satisfiable
+    """
+    build_id = request.match_info["build_id"]
+    try:
+        build_id = int(build_id)
+    except (ValueError, TypeError):
+        return ErrorResponse(400, "Incorrect value for build_id")
+
+    build = request.cirrina.db_session.query(Build).filter(Build.id == build_id).first()
+    if not build:
+        return ErrorResponse(404, "Build not found")
+
+    path = Path(Configuration().working_dir) / "buildout" / str(build_id) / "build.log"
+    filename, encoding = find_log_file(path)
+    if not filename:
+        return ErrorResponse(404, "Build log not found")
+    loop = asyncio.get_event_loop()
+    size = await loop.run_in_executor(None, get_log_size, filename, encoding)
+    complete = build.buildstate in FINISHED_STATES and not buildlog_writer.is_active(build_id)
+
+    status = 200
+    try:
+        offset = int(request.GET.getone("offset", 0))
+        tail = request.GET.getone("tail", None)
+        tail = int(tail) if tail is not None else None
+        http_range = request.http_range
+    except ValueError:
+        return ErrorResponse(400, "Invalid offset, tail or range")
+
+    end = size
+    if request.headers.get("Range"):
+        start, stop, _ = http_range.indices(size)
+        if start >= size or stop <= start:
+            return web.Response(status=416, headers={"Content-Range": "bytes */%d" % size})
+        offset, end = start, stop
+        status = 206
+    elif tail is not None:
+        offset = await find_tail_offset(str(path), tail)
+    offset = min(max(offset, 0), size)
+
+    headers = {"X-Log-Size": str(size),
+               "X-Log-Offset": str(offset),
+               "X-Log-Complete": "true" if complete else "false",
+               "Accept-Ranges": "bytes",
+               "Vary": "Accept-Encoding"}
+    if status == 206:
+        headers["Content-Range"] = "bytes %d-%d/%d" % (offset, end - 1, size)
+
+    # the whole compressed log is sent as is to clients accepting its encoding
+    passthrough = encoding and status == 200 and offset == 0 and encoding in get_accepted_encodings(request)
+    if passthrough:
+        headers["Content-Encoding"] = encoding
+
+    response = web.StreamResponse(status=status, headers=headers)
+    response.content_type = "text/plain"
+    response.charset = "utf-8"
+    if passthrough:
+        response.content_length = filename.stat().st_size
+        await response.prepare(request)
+        async with AIOFile(str(filename), "rb") as afp:
+            async for data in Reader(afp, chunk_size=LOG_CHUNK_SIZE):
+                await response.write(data)
+        await response.write_eof()
+        return response
+
+    response.content_length = end - offset
+    await response.prepare(request)
+    position = offset
+    async for data in read_log(str(path), offset=offset, chunk_size=LOG_CHUNK_SIZE):
+        data = data[:end - position]
+        if not data:
+            break
+        await response.write(data)
+        position += len(data)
+    await response.write_eof()
+    return response
+
+
+@app.http_get("/api2/build/{build_id}/log/index")
+@app.authenticated
+async def get_build_log_index(request):
+    """
+    Returns the index of the build log: the byte offsets of
+    error and warning lines, molior log sections and sbuild phases.
+
+    The offsets can be used with /api2/build/{build_id}/log.
+
+    ---
+    description: Returns the index of the build log
+    tags:
+        - Builds
+    parameters:
+        - name: build_id
+          in: path
+          required: true
+          type: integer
+        - name: type
+          in: query
+          required: false
+          type: string
+          description: comma separated entry types (error, warning, section, phase)
+    produces:
+        - text/json
+    responses:
+        "200":
+            description: successful
+        "400":
+            description: invalid entry type
+        "404":
+            description: build not found
+    """
+    build_id = request.match_info["build_id"]
+    try:
+        build_id = int(build_id)
+    except (ValueError, TypeError):
+        return ErrorResponse(400, "Incorrect value for build_id")
+
+    entry_types = request.GET.getone("type", None)
+    if entry_types is not None:
+        entry_types = entry_types.split(",")
+        for entry_type in entry_types:
+            if entry_type not in ENTRY_TYPES:
+                return ErrorResponse(400, "Invalid entry type '%s'" % entry_type)
+
+    build = request.cirrina.db_session.query(Build).filter(Build.id == build_id).first()
+    if not build:
+        return ErrorResponse(404, "Build not found")
+
+    path = Path(Configuration().working_dir) / "buildout" / str(build_id) / "build.log"
+    entries = await asyncio.get_event_loop().run_in_executor(None, read_log_index, str(path), entry_types)
+    data = {"total_result_count": len(entries),
+            "complete": build.buildstate in FINISHED_STATES and not buildlog_writer.is_active(build_id),
+            "results": entries}
+    return OKResponse(data)
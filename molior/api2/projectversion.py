@@ -11,6 +11,7 @@ from ..auth import req_role
 from ..tools import ErrorResponse, OKResponse, is_name_valid, db2array, array2db, escape_for_like
 from ..api.projectversion import do_lock, do_unlock, do_overlay
 from ..molior.queues import enqueue_aptly
+from ..molior.buildindex import build_index
 from ..molior.configuration import Configuration
 
 from ..model.projectversion import (
@@ -720,7 +721,11 @@ async def delete_projectversion(request):
         if sourcebuild and sourcebuild not in todelete:
             todelete.append(sourcebuild)
 
+    deleted_ids = []
+
     def deletebuild(build):
+        if build.buildtype == "deb":
+            deleted_ids.append(build.id)
         buildtasks = db.query(BuildTask).filter(BuildTask.build == build).all()
         for buildtask in buildtasks:
             db.delete(buildtask)
@@ -767,6 +772,9 @@ async def delete_projectversion(request):
     db.delete(projectversion)
     db.commit()
 
+    for deleted_id in deleted_ids:
+        build_index.remove(deleted_id)
+
     await enqueue_aptly(
         {
             "delete_repository": [
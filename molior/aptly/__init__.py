@@ -1,2 +1,3 @@
 from .api import AptlyApi, get_aptly_connection, get_snapshot_name  # noqa: F401
 from .taskstate import TaskState  # noqa: F401
+from .connection import aptly_connections  # noqa: F401
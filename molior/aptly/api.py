@@ -1,3 +1,4 @@
+import os
 import uuid
 import json
 import asyncio
@@ -8,6 +9,10 @@ from ..molior.configuration import Configuration
 
 from .taskstate import TaskState
 from .errors import AptlyError
+from .connection import aptly_connections
+from .tasks import AptlyTaskPoller
+from .catalog import AptlyCatalog, SNAPSHOT, REPO
+from .upload import get_upload_parallel, read_file_chunks, split_uploads
 
 
 class AptlyApi:
@@ -33,6 +38,8 @@ class AptlyApi:
             self.auth = aiohttp.BasicAuth(username, password=password)
         else:
             self.auth = None
+        self.tasks = AptlyTaskPoller(self)
+        self.catalog = AptlyCatalog(self)
 
     @staticmethod
     def __raise_aptly_error(response):
@@ -112,38 +119,38 @@ class AptlyApi:
         return data, headers
 
     async def GET(self, apipath, params=None):
-        async with aiohttp.ClientSession() as http:
-            async with http.get(self.url + apipath, auth=self.auth, params=params) as resp:
-                if not self.__check_status_code(resp.status):
-                    self.__raise_aptly_error(resp)
-                return json.loads(await resp.text())
+        http = aptly_connections.get_session(self.url)
+        async with http.get(self.url + apipath, auth=self.auth, params=params) as resp:
+            if not self.__check_status_code(resp.status):
+                self.__raise_aptly_error(resp)
+            return json.loads(await resp.text())
 
     async def POST(self, apipath, data=None):
         params = {"_async": "true"}
         data, headers = self.__prepare_content(data)
-        async with aiohttp.ClientSession() as http:
-            async with http.post(self.url + apipath, auth=self.auth, headers=headers, params=params, data=data) as resp:
-                if not self.__check_status_code(resp.status):
-                    self.__raise_aptly_error(resp)
-                return json.loads(await resp.text())
+        http = aptly_connections.get_session(self.url)
+        async with http.post(self.url + apipath, auth=self.auth, headers=headers, params=params, data=data) as resp:
+            if not self.__check_status_code(resp.status):
+                self.__raise_aptly_error(resp)
+            return json.loads(await resp.text())
 
     async def DELETE(self, apipath, headers=None, data=None):
         params = {"_async": "true"}
         data, headers = self.__prepare_content(data, headers)
-        async with aiohttp.ClientSession() as http:
-            async with http.delete(self.url + apipath, auth=self.auth, headers=headers, params=params, data=data) as resp:
-                if not self.__check_status_code(resp.status):
-                    self.__raise_aptly_error(resp)
-                return json.loads(await resp.text())
+        http = aptly_connections.get_session(self.url)
+        async with http.delete(self.url + apipath, auth=self.auth, headers=headers, params=params, data=data) as resp:
+            if not self.__check_status_code(resp.status):
+                self.__raise_aptly_error(resp)
+            return json.loads(await resp.text())
 
     async def PUT(self, apipath, data=None):
         params = {"_async": "true"}
         data, headers = self.__prepare_content(data)
-        async with aiohttp.ClientSession() as http:
-            async with http.put(self.url + apipath, auth=self.auth, headers=headers, params=params, data=data) as resp:
-                if not self.__check_status_code(resp.status):
-                    self.__raise_aptly_error(resp)
-                return json.loads(await resp.text())
+        http = aptly_connections.get_session(self.url)
+        async with http.put(self.url + apipath, auth=self.auth, headers=headers, params=params, data=data) as resp:
+            if not self.__check_status_code(resp.status):
+                self.__raise_aptly_error(resp)
+            return json.loads(await resp.text())
 
     async def get_tasks(self):
         """
@@ -331,7 +338,9 @@ class AptlyApi:
         name, _ = self.get_aptly_names(base_mirror, base_mirror_version, mirror, version, is_mirror=True)
 
         for component in components:
-            task = await self.DELETE(f"/snapshots/{name}-{component}")
+            with self.catalog.checked():
+                task = await self.DELETE(f"/snapshots/{name}-{component}")
+            self.catalog.removed(SNAPSHOT, f"{name}-{component}")
             await self.wait_task(task["ID"])
         return True
 
@@ -351,7 +360,9 @@ class AptlyApi:
         tasks = []
         for component in components:
             data = {"Name": "{}-{}".format(name, component)}
-            task = await self.POST(f"/mirrors/{name}-{component}/snapshots", data=data)
+            with self.catalog.checked():
+                task = await self.POST(f"/mirrors/{name}-{component}/snapshots", data=data)
+            self.catalog.added(SNAPSHOT, data["Name"])
             tasks.append(task["ID"])
         return tasks
 
@@ -429,12 +440,14 @@ class AptlyApi:
             package_refs (list): Packages to create snapshot from.
                 e.g. ["Pamd64 my-package 1.0.3 863efd9e94da9fbc"]
         """
-        if package_refs:
-            data = {"Name": snapshot_name, "PackageRefs": package_refs}
-            task = await self.POST("/snapshots", data=data)
-        else:
-            data = {"Name": snapshot_name}
-            task = await self.POST(f"/repos/{repo_name}/snapshots", data=data)
+        with self.catalog.checked():
+            if package_refs:
+                data = {"Name": snapshot_name, "PackageRefs": package_refs}
+                task = await self.POST("/snapshots", data=data)
+            else:
+                data = {"Name": snapshot_name}
+                task = await self.POST(f"/repos/{repo_name}/snapshots", data=data)
+        self.catalog.added(SNAPSHOT, snapshot_name)
         return task["ID"]
 
     async def snapshot_delete(self, name):
@@ -447,7 +460,9 @@ class AptlyApi:
         Returns:
             int: Aptly's task id.
         """
-        task = await self.DELETE(f"/snapshots/{name}")
+        with self.catalog.checked():
+            task = await self.DELETE(f"/snapshots/{name}")
+        self.catalog.removed(SNAPSHOT, name)
         return task["ID"]
 
     async def snapshot_get(self):
@@ -523,7 +538,9 @@ class AptlyApi:
             new_name (str): New name
         """
         data = {"Name": new_name}
-        task = await self.PUT(f"/snapshots/{name}", data=data)
+        with self.catalog.checked():
+            task = await self.PUT(f"/snapshots/{name}", data=data)
+        self.catalog.renamed(SNAPSHOT, name, new_name)
         return task["ID"]
 
     async def repo_packages_get(self, repo_name, search=None):
@@ -568,6 +585,10 @@ class AptlyApi:
         """
         Adds the given files to a local aptly repository.
 
+        The files are uploaded with up to aptly.upload_parallel
+        multipart requests in parallel. If any file is not
+        stored by aptly, nothing is added.
+
         Args:
             repo_name (str): The repository's name.
             files (list): List of file_paths to be added.
@@ -577,21 +598,66 @@ class AptlyApi:
 
         Raises:
             molior.aptly.errors.AptlyError: If a known error occurs while
-                communicating with the aptly api.
+                communicating with the aptly api, or a file was not uploaded.
         """
         # FIXME: use secret
         upload_dir = str(uuid.uuid4())
-        for filename in files:
+        sizes = {filename: os.path.getsize(filename) for filename in files}
+        batches = split_uploads(files, sizes, get_upload_parallel())
+        results = await asyncio.gather(*[self.upload_files(upload_dir, batch) for batch in batches],
+                                       return_exceptions=True)
+
+        errors = []
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                logger.exception(result)
+                errors.extend(["{}: {}".format(os.path.basename(f), str(result)) for f in batch])
+
+        if errors:
             try:
-                with open(filename, "rb") as _file:
-                    post_files = {"file": _file}
-                    await self.POST(f"/files/{upload_dir}", data=post_files)
+                await self.delete_directory(upload_dir)
             except Exception as exc:
                 logger.exception(exc)
+            raise AptlyError("UploadError", "; ".join(errors))
 
         task = await self.POST(f"/repos/{repo_name}/file/{upload_dir}")
         return task["ID"], upload_dir
 
+    async def upload_files(self, upload_dir, files):
+        """
+        Streams files to an aptly upload directory in one multipart request.
+
+        Args:
+            upload_dir (str): The upload directory.
+            files (list): List of file_paths to be uploaded.
+
+        Raises:
+            molior.aptly.errors.AptlyError: If aptly did not store all files.
+        """
+        form = aiohttp.FormData()
+        for filename in files:
+            form.add_field("file", read_file_chunks(filename),
+                           filename=os.path.basename(filename),
+                           content_type="application/octet-stream")
+
+        stored = await self.POST(f"/files/{upload_dir}", data=form)
+        for filename in files:
+            if f"{upload_dir}/{os.path.basename(filename)}" not in stored:
+                raise AptlyError("UploadError", "file not stored: {}".format(os.path.basename(filename)))
+
+    async def get_directory_files(self, directory_name):
+        """
+        Returns the files in an upload directory on the aptly server,
+        an empty list if the directory does not exist.
+
+        Args:
+            directory_name (str): The directory's name.
+        """
+        try:
+            return await self.GET(f"/files/{directory_name}")
+        except AptlyError:
+            return []
+
     async def repo_create(self, name):
         """
         Creates an aptly repository.
@@ -607,7 +673,10 @@ class AptlyApi:
                 communicating with the aptly api.
         """
         data = {"Name": name}
-        return await self.POST("/repos", data=data)
+        with self.catalog.checked():
+            ret = await self.POST("/repos", data=data)
+        self.catalog.added(REPO, name)
+        return ret
 
     async def repo_delete(self, name):
         """
@@ -623,7 +692,9 @@ class AptlyApi:
             molior.aptly.errors.AptlyError: If a known error occurs while
                 communicating with the aptly api.
         """
-        task = await self.DELETE(f"/repos/{name}")
+        with self.catalog.checked():
+            task = await self.DELETE(f"/repos/{name}")
+        self.catalog.removed(REPO, name)
         return task["ID"]
 
     async def repo_rename(self, name, new_name):
@@ -641,7 +712,9 @@ class AptlyApi:
                 communicating with the aptly api.
         """
         data = {"Name": new_name}
-        task = await self.PUT(f"/repos/{name}", data=data)
+        with self.catalog.checked():
+            task = await self.PUT(f"/repos/{name}", data=data)
+        self.catalog.renamed(REPO, name, new_name)
         return task
 
     async def delete_directory(self, directory_name):
@@ -705,34 +778,34 @@ class AptlyApi:
         # logger.warning("creating snapshot with name '%s' and the packages: '%s'", snapshot_name_tmp, str(package_refs))
 
         try:
-            snapshots = await self.GET("/snapshots")
+            tmp_exists = await self.catalog.has_snapshot(snapshot_name_tmp)
         except Exception as exc:
             logger.error("Error loading snapshots")
             logger.exception(exc)
             return
 
-        for snapshot in snapshots:
-            if snapshot["Name"] == snapshot_name_tmp:
-                # delete leftover tmp snapshot
-                logger.warning("deleting existing tmp snapshot")
-                try:
-                    task_id = await self.snapshot_delete(snapshot_name_tmp)
-                except Exception:
-                    logger.error(f"Error deleting existing tmp snapshot, trying to republish non-tmp: {snapshot_name_tmp}")
+        if tmp_exists:
+            # delete leftover tmp snapshot
+            logger.warning("deleting existing tmp snapshot")
+            try:
+                task_id = await self.snapshot_delete(snapshot_name_tmp)
+            except Exception:
+                logger.error(f"Error deleting existing tmp snapshot: {snapshot_name_tmp}")
+                return False
+            if not await self.wait_task(task_id):
+                logger.warning("republishing non-tmp snapshot")
+                task_id = await self.snapshot_publish_update(snapshot_name, "main", dist, publish_name)
                 if not await self.wait_task(task_id):
-                    logger.warning("republishing non-tmp snapshot")
-                    task_id = await self.snapshot_publish_update(snapshot_name, "main", dist, publish_name)
-                    if not await self.wait_task(task_id):
-                        logger.error(f"Error republishing non-tmp snapshot: {snapshot_name}")
-                    else:
-                        logger.warning("retrying to delete tmp snapshot")
-                        try:
-                            task_id = await self.snapshot_delete(snapshot_name_tmp)
-                        except Exception:
-                            logger.error(f"Error deleting existing tmp snapshot after republish: {snapshot_name_tmp}")
-                        if not await self.wait_task(task_id):
-                            return False
-                break
+                    logger.error(f"Error republishing non-tmp snapshot: {snapshot_name}")
+                else:
+                    logger.warning("retrying to delete tmp snapshot")
+                    task_id = None
+                    try:
+                        task_id = await self.snapshot_delete(snapshot_name_tmp)
+                    except Exception:
+                        logger.error(f"Error deleting existing tmp snapshot after republish: {snapshot_name_tmp}")
+                    if task_id is None or not await self.wait_task(task_id):
+                        return False
 
         task_id = await self.snapshot_create(repo_name, snapshot_name_tmp)
         if not await self.wait_task(task_id):
@@ -762,7 +835,7 @@ class AptlyApi:
 
     async def wait_task(self, task_id):
         """
-        Waits for an aptly task to finish.
+        Waits for an aptly task to finish, see AptlyTaskPoller.
 
         Args:
             task_id(int): The task's id.
@@ -773,23 +846,21 @@ class AptlyApi:
         if type(task_id) is not int:
             raise Exception("task_id '%s' must be int" % str(task_id))
 
-        while True:
-            await asyncio.sleep(2)
-            try:
-                task_state = await self.get_task_state(task_id)
-            except Exception as exc:
-                logger.exception(exc)
-                return False
+        state = await self.tasks.wait(task_id)
+        if state is None:
+            self.catalog.invalidate()
+            return False
 
-            if task_state.get("State") == TaskState.SUCCESSFUL.value:
-                await self.delete_task(task_id)
-                return True
+        if state == TaskState.SUCCESSFUL.value:
+            await self.delete_task(task_id)
+            return True
 
-            if task_state.get("State") == TaskState.FAILED.value:
-                output = await self.GET(f"/tasks/{task_id}/output")
-                logger.error(f"aptly task failed: {output}")
-                await self.delete_task(task_id)
-                return False
+        # the catalog might not match anymore
+        self.catalog.invalidate()
+        output = await self.GET(f"/tasks/{task_id}/output")
+        logger.error(f"aptly task failed: {output}")
+        await self.delete_task(task_id)
+        return False
 
     async def version(self):
         """
@@ -798,20 +869,19 @@ class AptlyApi:
         Returns:
             string: version
         """
-        version = "unknown"
-        async with aiohttp.ClientSession() as http:
-            async with http.get(self.url + "/version", auth=self.auth) as resp:
-                if not self.__check_status_code(resp.status):
-                    self.__raise_aptly_error(resp)
-                data = json.loads(await resp.text())
-                version = data.get("Version", "unknown")
+        data = await self.GET("/version")
+        version = data.get("Version", "unknown")
         return version
 
 
+# aptly settings: AptlyApi
+aptly_apis = {}
+
+
 def get_aptly_connection():
     """
-    Connects to aptly server and returns aptly
-    object.
+    Returns the aptly api object of the configured
+    aptly server, sharing its http connections.
 
     Returns:
         AptlyApi: The connected aptly api instance.
@@ -821,7 +891,11 @@ def get_aptly_connection():
     gpg_key = cfg.aptly.get("gpg_key")
     aptly_user = cfg.aptly.get("user")
     aptly_passwd = cfg.aptly.get("pass")
-    aptly = AptlyApi(api_url, gpg_key, username=aptly_user, password=aptly_passwd)
+    key = (api_url, gpg_key, aptly_user, aptly_passwd)
+    aptly = aptly_apis.get(key)
+    if not aptly:
+        aptly = AptlyApi(api_url, gpg_key, username=aptly_user, password=aptly_passwd)
+        aptly_apis[key] = aptly
     return aptly
 
 
@@ -0,0 +1,95 @@
+import asyncio
+
+from contextlib import contextmanager
+from time import monotonic
+
+from ..app import logger
+from .connection import get_aptly_setting
+from .errors import AptlyError
+
+SNAPSHOT = "snapshot"
+REPO = "repo"
+
+
+class AptlyCatalog:
+    """
+    Caches the names of the aptly snapshots and repos.
+
+    The names are listed from aptly when first needed and after
+    aptly.catalog_refresh seconds, and are kept up to date by the
+    AptlyApi calls creating, renaming and deleting them. When such a
+    request or an aptly task fails, the catalog is reloaded on the
+    next lookup.
+    """
+
+    def __init__(self, aptly):
+        self.aptly = aptly
+        self.names = {SNAPSHOT: set(), REPO: set()}
+        self.loaded = None    # monotonic time of the last listing
+        self.changes = None   # changes while listing: (kind, name, exists)
+        self.lock = asyncio.Lock()
+
+    async def load(self):
+        async with self.lock:
+            if self.loaded is not None and monotonic() - self.loaded < get_aptly_setting("catalog_refresh", 600):
+                return
+            self.changes = []
+            try:
+                snapshots = await self.aptly.snapshot_get()
+                repos = await self.aptly.repo_get()
+            finally:
+                changes = self.changes
+                self.changes = None
+            self.names = {SNAPSHOT: set([s.get("Name") for s in snapshots]),
+                          REPO: set([r.get("Name") for r in repos])}
+            for kind, name, exists in changes:
+                self.update(kind, name, exists)
+            self.loaded = monotonic()
+            logger.debug("aptly: catalog loaded %d snapshots and %d repos",
+                         len(self.names[SNAPSHOT]), len(self.names[REPO]))
+
+    def invalidate(self):
+        self.loaded = None
+
+    @contextmanager
+    def checked(self):
+        """
+        Invalidates the catalog if aptly rejects a request, the
+        snapshot or repo might exist or be missing unexpectedly.
+        """
+        try:
+            yield
+        except AptlyError:
+            self.invalidate()
+            raise
+
+    def update(self, kind, name, exists):
+        if self.changes is not None:
+            self.changes.append((kind, name, exists))
+        if exists:
+            self.names[kind].add(name)
+        else:
+            self.names[kind].discard(name)
+
+    def added(self, kind, name):
+        self.update(kind, name, True)
+
+    def removed(self, kind, name):
+        self.update(kind, name, False)
+
+    def renamed(self, kind, name, new_name):
+        self.update(kind, name, False)
+        self.update(kind, new_name, True)
+
+    async def has_snapshot(self, name):
+        await self.load()
+        return name in self.names[SNAPSHOT]
+
+    async def has_repo(self, name):
+        await self.load()
+        return name in self.names[REPO]
+
+    def status(self):
+        return {"snapshots": len(self.names[SNAPSHOT]),
+                "repos": len(self.names[REPO]),
+                "age": int(monotonic() - self.loaded) if self.loaded is not None else None}
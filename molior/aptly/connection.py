@@ -0,0 +1,82 @@
+import asyncio
+import aiohttp
+
+from ..app import logger
+from ..molior.configuration import Configuration
+
+
+def get_aptly_setting(name, default):
+    value = Configuration().aptly.get(name)
+    if type(value) not in [int, float] or value <= 0:
+        value = default
+    return value
+
+
+class AptlyConnections:
+    """
+    Keeps one http session with keep-alive connections per aptly api url.
+
+    The sessions are created on first use and closed on server shutdown,
+    see aptly.max_connections, aptly.keepalive_timeout,
+    aptly.connect_timeout and aptly.request_timeout.
+    """
+
+    def __init__(self):
+        self.sessions = {}  # api url: (session, loop)
+        self.stats = {}     # api url: request and connection counters
+
+    def get_session(self, url):
+        """
+        Returns the http session of an aptly api url.
+        """
+        loop = asyncio.get_event_loop()
+        session, session_loop = self.sessions.get(url, (None, None))
+        if session and not session.closed and session_loop is loop:
+            return session
+
+        stats = self.stats.setdefault(url, {"requests": 0, "connections": 0, "reused": 0})
+
+        async def on_request_start(session, context, params):
+            stats["requests"] += 1
+
+        async def on_connection_create_end(session, context, params):
+            stats["connections"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            stats["reused"] += 1
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+
+        max_connections = get_aptly_setting("max_connections", 10)
+        connector = aiohttp.TCPConnector(limit=max_connections,
+                                         limit_per_host=max_connections,
+                                         keepalive_timeout=get_aptly_setting("keepalive_timeout", 30))
+        timeout = aiohttp.ClientTimeout(total=get_aptly_setting("request_timeout", 300),
+                                        connect=get_aptly_setting("connect_timeout", 10))
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace])
+        self.sessions[url] = (session, loop)
+        logger.info("aptly: connecting to %s with up to %d connections", url, max_connections)
+        return session
+
+    async def close(self):
+        sessions = self.sessions
+        self.sessions = {}
+        for session, _ in sessions.values():
+            if not session.closed:
+                await session.close()
+
+    def status(self):
+        """
+        Returns the request and connection counters per aptly api url.
+        """
+        results = []
+        for url, stats in self.stats.items():
+            session, _ = self.sessions.get(url, (None, None))
+            results.append(dict(stats, url=url, open=bool(session and not session.closed)))
+        return {"results": results}
+
+
+aptly_connections = AptlyConnections()
@@ -0,0 +1,113 @@
+import asyncio
+
+from ..app import logger
+from .taskstate import TaskState
+
+# seconds between polls, doubled while no task finishes
+MIN_POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2.0
+# failed listings of the tasks before checking each task on its own,
+# with the seconds between them doubled after each failure
+MAX_POLL_ERRORS = 5
+ERROR_POLL_INTERVAL = 2.0
+
+FINISHED_STATES = [TaskState.SUCCESSFUL.value, TaskState.FAILED.value]
+
+
+class AptlyTaskPoller:
+    """
+    Waits for aptly tasks with a single polling loop per aptly api.
+
+    All waited tasks are checked with one GET /tasks, fast after a
+    task was added and backing off while no task finishes.
+    """
+
+    def __init__(self, aptly):
+        self.aptly = aptly
+        self.waiting = {}  # task id: list of futures
+        self.task = None
+        self.wakeup = asyncio.Event()
+        self.polls = 0
+        self.errors = 0  # failed listings in a row
+
+    async def wait(self, task_id):
+        """
+        Waits for an aptly task to finish.
+
+        Args:
+            task_id (int): The task's id.
+
+        Returns:
+            int: The TaskState value, or None if the state could not be fetched.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.waiting.setdefault(task_id, []).append(future)
+        self.wakeup.set()
+        if not self.task or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return await future
+
+    async def run(self):
+        interval = MIN_POLL_INTERVAL
+        while self.waiting:
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), interval)
+                interval = MIN_POLL_INTERVAL
+            except asyncio.TimeoutError:
+                pass
+
+            finished = await self.poll()
+            if self.errors:
+                interval = ERROR_POLL_INTERVAL * 2 ** (self.errors - 1)
+            elif finished:
+                interval = MIN_POLL_INTERVAL
+            else:
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    async def poll(self):
+        """
+        Resolves the finished tasks.
+
+        When listing the tasks fails, the next polls back off, and after
+        MAX_POLL_ERRORS failures in a row the tasks are checked one by one.
+
+        Returns:
+            bool: True if a task finished.
+        """
+        self.polls += 1
+        try:
+            tasks = await self.aptly.get_tasks()
+            self.errors = 0
+        except Exception as exc:
+            self.errors += 1
+            logger.warning("aptly: error listing tasks (%d/%d): %s", self.errors, MAX_POLL_ERRORS, str(exc))
+            if self.errors < MAX_POLL_ERRORS:
+                return False
+            self.errors = 0
+            tasks = []
+
+        states = {task.get("ID"): task.get("State") for task in tasks or []}
+        finished = False
+        for task_id in list(self.waiting):
+            if task_id in states:
+                state = states[task_id]
+            else:
+                # not listed, e.g. deleted by another waiter
+                try:
+                    state = (await self.aptly.get_task_state(task_id)).get("State")
+                except Exception as exc:
+                    logger.exception(exc)
+                    state = None
+            if state is None or state in FINISHED_STATES:
+                self.resolve(task_id, state)
+                finished = True
+        return finished
+
+    def resolve(self, task_id, state):
+        for future in self.waiting.pop(task_id, []):
+            if not future.done():
+                future.set_result(state)
+
+    def status(self):
+        return {"waiting": len(self.waiting), "polls": self.polls}
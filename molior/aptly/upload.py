@@ -0,0 +1,49 @@
+import asyncio
+
+from ..molior.configuration import Configuration
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
+def get_upload_parallel():
+    """
+    Returns the number of upload requests sent to aptly in parallel.
+    """
+    parallel = Configuration().aptly.get("upload_parallel")
+    if type(parallel) is not int or parallel < 1:
+        parallel = 4
+    return parallel
+
+
+async def read_file_chunks(filename):
+    """
+    Yields the content of a file for streaming.
+    """
+    loop = asyncio.get_event_loop()
+    with open(filename, "rb") as f:
+        while True:
+            data = await loop.run_in_executor(None, f.read, UPLOAD_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+
+def split_uploads(files, sizes, count):
+    """
+    Distributes files over upload requests of about the same size.
+
+    Args:
+        files (list): The file paths.
+        sizes (dict): The size of each file.
+        count (int): The maximum number of requests.
+
+    Returns:
+        list: A list of file paths per request.
+    """
+    batches = [[] for _ in range(min(count, len(files)))]
+    totals = [0] * len(batches)
+    for filename in sorted(files, key=lambda f: sizes[f], reverse=True):
+        index = totals.index(min(totals))
+        batches[index].append(filename)
+        totals[index] += sizes[filename]
+    return batches
@@ -0,0 +1,80 @@
+import asyncio
+
+from ...app import logger
+
+
+class HeartbeatWheel:
+    """
+    Pings all nodes from a single task.
+
+    The nodes are spread over one bucket per tick of the ping timeout,
+    every tick the nodes of the next bucket are checked together: nodes
+    which did not answer the previous ping time out, the others are
+    pinged again. So every node is pinged once per timeout, and the
+    pings of many nodes are spread over the timeout.
+    """
+
+    def __init__(self, timeout, ping, expired, tick=1.0):
+        """
+        Args:
+            timeout (int): Seconds between pings, and to wait for a pong.
+            ping (coroutine function): Called with a list of nodes to ping.
+            expired (coroutine function): Called with a node which timed out.
+        """
+        self.tick = tick
+        self.buckets = [set() for _ in range(max(1, int(timeout / tick)))]
+        self.position = 0
+        self.slots = {}  # node: bucket index
+        self.pending = set()
+        self.ping = ping
+        self.expired = expired
+
+    def add(self, node):
+        """
+        Adds a node to the bucket with the fewest nodes.
+        """
+        if node in self.slots:
+            return
+        index = min(range(len(self.buckets)), key=lambda i: len(self.buckets[i]))
+        self.buckets[index].add(node)
+        self.slots[node] = index
+
+    def remove(self, node):
+        index = self.slots.pop(node, None)
+        if index is not None:
+            self.buckets[index].discard(node)
+        self.pending.discard(node)
+
+    def pong(self, node):
+        self.pending.discard(node)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.sleep(self.tick)
+            except asyncio.CancelledError:
+                break
+            try:
+                await self.check()
+            except Exception as exc:
+                logger.exception(exc)
+
+    async def check(self):
+        """
+        Checks the nodes of the next bucket.
+        """
+        bucket = self.buckets[self.position]
+        self.position = (self.position + 1) % len(self.buckets)
+        expired = [node for node in bucket if node in self.pending]
+        alive = [node for node in bucket if node not in self.pending]
+        for node in expired:
+            self.remove(node)
+            await self.expired(node)
+        if alive:
+            self.pending.update(alive)
+            await self.ping(alive)
+
+    def status(self):
+        return {"nodes": len(self.slots),
+                "pending": len(self.pending),
+                "buckets": [len(bucket) for bucket in self.buckets]}
@@ -1,16 +1,24 @@
 import asyncio
 import json
+import re
 
 from concurrent.futures._base import CancelledError
 
 from ...app import app, logger
+from ...molior.backend import Backend
 from ...molior.configuration import Configuration
-from ...molior.queues import enqueue_backend, enqueue_buildtask, dequeue_buildtask
+from ...molior.queues import enqueue_backend, enqueue_buildtask, dequeue_buildtask, move_buildtasks, get_buildtask_archs
 from ...molior.notifier import Subject, Event, notify
+from ...molior.fairshare import fair_share, get_share_group
+from .policy import get_node_policy, GB
+from .registry import NodeRegistry
+from .heartbeat import HeartbeatWheel
 
 
-registry = {"amd64": [], "arm64": []}
-running_nodes = {"amd64": [], "arm64": []}
+# the connected nodes, node pools are added by HTTPBackend.add_pool()
+registry = NodeRegistry()
+node_events = {}
+node_skipped = {}
 
 cfg = Configuration()
 pt = cfg.backend_http.get("ping_timeout")
@@ -19,39 +27,251 @@ if pt:
 else:
     PING_TIMEOUT = 5
 
+node_policy = get_node_policy(cfg.backend_http)
 
-async def watchdog(ws_client):
-    try:
-        arch = ws_client.molior_node_arch
-        while True:
-            # stop if disconnected
-            if ws_client not in registry[arch] and ws_client not in running_nodes[arch]:
-                break
+VALID_ARCH = re.compile(r"^[a-z0-9]+$")
 
-            # was pong recieved ?
-            if hasattr(ws_client, "molior_pong_pending") and ws_client.molior_pong_pending == 1:
-                logger.warning("backend: ping timeout after %ds on %s/%s",
-                               PING_TIMEOUT, ws_client.molior_node_arch, ws_client.molior_node_name)
-                await deregister_node(ws_client)
-                # await ws_client.close()
-                break
+# seconds between node status updates, and between full node lists for resyncing
+NODE_STATUS_INTERVAL = 4
+NODE_SNAPSHOT_INTERVAL = 60
+# telemetry changes sent in node status updates
+NODE_LOAD_DELTA = 0.25
+NODE_RAM_DELTA = GB / 4
+NODE_DISK_DELTA = GB
+# topic of the single node added, changed and removed notifications
+NODE_DELTA_TOPIC = "node:delta"
 
-            # send ping
-            ws_client.molior_pong_pending = 1
-            if asyncio.iscoroutinefunction(ws_client.send_str):
-                await ws_client.send_str(json.dumps({"ping": 1}))
-            else:
-                ws_client.send_str(json.dumps({"ping": 1}))
 
-            # wait for pong
-            try:
-                await asyncio.sleep(PING_TIMEOUT)
-            except CancelledError:
-                break
+def get_pools_config():
+    """
+    Returns the configured node pools: the node arch
+    and the build archs its nodes are compatible with.
+    """
+    pools = cfg.backend_http.get("pools")
+    if not pools or type(pools) is not dict:
+        pools = {"amd64": ["i386"], "arm64": ["armhf"]}
+    return {arch: list(compatible or []) for arch, compatible in pools.items()}
 
-    except Exception as exc:
-        logger.exception(exc)
-        # await ws_client.close()
+
+POOLS = get_pools_config()
+
+
+def get_pool(build_arch):
+    """
+    Returns the node pool for building an arch.
+
+    Builds go to the pool of their own arch if it is configured or
+    has nodes, otherwise to a pool of nodes compatible with the arch.
+
+    Args:
+        build_arch (str): The build architecture, e.g. "i386".
+
+    Returns:
+        str: The pool arch or None.
+    """
+    if build_arch in POOLS or registry.has_nodes(build_arch):
+        return build_arch
+    return get_compatible_pool(build_arch)
+
+
+def get_compatible_pool(build_arch):
+    """
+    Returns the configured node pool whose nodes can
+    build an arch of another pool, or None.
+    """
+    for arch, compatible in POOLS.items():
+        if build_arch in compatible:
+            return arch
+    return None
+
+
+def move_stranded_buildtasks(arch):
+    """
+    Moves the build tasks of a node pool without nodes to the
+    pool of compatible nodes, so they do not wait for nodes
+    which might never come back.
+
+    Args:
+        arch (str): The node pool arch, e.g. "i386".
+    """
+    if registry.has_nodes(arch):
+        return
+    pool = get_compatible_pool(arch)
+    if not pool:
+        return
+    count = move_buildtasks(arch, pool)
+    if count:
+        logger.info("backend: no %s nodes left, moved %d build task(s) to the %s node pool", arch, count, pool)
+
+
+def get_node_event(arch):
+    if arch not in node_events:
+        node_events[arch] = asyncio.Event()
+    return node_events[arch]
+
+
+def get_node_slots(ws_client):
+    """
+    Returns the number of builds a node runs in parallel, configured
+    per node or derived from the cpu cores and RAM of the node.
+    """
+    slots = cfg.backend_http.get("node_slots")
+    if isinstance(slots, dict):
+        slots = slots.get(ws_client.molior_node_name)
+    if slots:
+        return max(1, int(slots))
+
+    cores_per_slot = max(1, int(cfg.backend_http.get("cores_per_slot", 8)))
+    ram_per_slot = float(cfg.backend_http.get("ram_per_slot", 8)) * GB
+    slots = (ws_client.molior_cpu_cores or 0) // cores_per_slot
+    if ws_client.molior_ram_total and ram_per_slot > 0:
+        slots = min(slots, int(ws_client.molior_ram_total // ram_per_slot))
+    return max(1, slots)
+
+
+def update_node_source(ws_client):
+    """
+    Shows the most recently started build of a node in the node info.
+    """
+    build = {}
+    if ws_client.molior_builds:
+        build = list(ws_client.molior_builds.values())[-1]
+    ws_client.molior_sourcename = build.get("sourcename", "")
+    ws_client.molior_sourceversion = build.get("sourceversion", "")
+    ws_client.molior_sourcearch = build.get("sourcearch", "")
+
+
+def start_node_build(ws_client, task):
+    """
+    Takes a build slot of a node.
+
+    The node stays idle while it has free slots, as the
+    most recently used so other nodes are preferred.
+    """
+    registry.start_build(ws_client, task["build_id"], {"sourcename": task.get("repository_name"),
+                                                       "sourceversion": task.get("version"),
+                                                       "sourcearch": task.get("architecture")})
+    update_node_source(ws_client)
+
+
+def finish_node_build(ws_client, build_id):
+    """
+    Frees the build slot of a node and wakes up
+    the scheduler waiting for a node of this arch.
+    """
+    registry.finish_build(ws_client, build_id)
+    update_node_source(ws_client)
+    get_node_event(ws_client.molior_node_arch).set()
+
+
+def get_nodes():
+    """
+    Returns (arch, node) of all connected nodes.
+    """
+    return registry.get_nodes()
+
+
+def get_node_status(node):
+    """
+    Returns the status of a node sent to the web clients.
+    """
+    return {
+        "id": node.molior_nodeid,
+        "state": "busy" if node.molior_builds else "idle",
+        "uptime_seconds": node.molior_uptime_seconds,
+        "load": node.molior_load,
+        "ram_used": node.molior_ram_used,
+        "disk_used": node.molior_disk_used,
+        "sourcename": node.molior_sourcename,
+        "sourceversion": node.molior_sourceversion,
+        "sourcearch": node.molior_sourcearch
+        }
+
+
+def get_load(status):
+    load = status["load"]
+    if isinstance(load, (list, tuple)):
+        load = load[0] if load else 0
+    return load or 0
+
+
+def node_status_changed(old, new):
+    """
+    Returns True if the state or the build of a node changed,
+    or its telemetry changed more than the NODE_*_DELTA thresholds.
+    """
+    for key in ["state", "sourcename", "sourceversion", "sourcearch"]:
+        if old[key] != new[key]:
+            return True
+    if abs(get_load(new) - get_load(old)) >= NODE_LOAD_DELTA:
+        return True
+    if abs((new["ram_used"] or 0) - (old["ram_used"] or 0)) >= NODE_RAM_DELTA:
+        return True
+    if abs((new["disk_used"] or 0) - (old["disk_used"] or 0)) >= NODE_DISK_DELTA:
+        return True
+    return False
+
+
+def select_node(arch):
+    """
+    Selects an idle node of the given arch with the node policy.
+
+    Nodes skipped by the policy are logged whenever the
+    reasons change, so a waiting scheduler does not flood the log.
+
+    Returns:
+        tuple: The websocket client of the node or None, and the reason.
+    """
+    node, reason, skipped = node_policy.select(registry.get_idle(arch))
+    skipped = ["{} ({})".format(n.molior_node_name, r) for n, r in skipped]
+    if skipped != node_skipped.get(arch, []):
+        if skipped:
+            logger.info("backend: skipping %s nodes: %s", arch, ", ".join(skipped))
+        node_skipped[arch] = skipped
+    return node, reason
+
+
+async def wait_idle_node(arch):
+    """
+    Waits until the node policy selects a node
+    of the given arch with a free build slot.
+
+    Returns:
+        tuple: The websocket client of the node, and the reason.
+    """
+    event = get_node_event(arch)
+    while True:
+        node, reason = select_node(arch)
+        if node:
+            return node, reason
+        event.clear()
+        await event.wait()
+
+
+async def send_ping(ws_client, msg):
+    if asyncio.iscoroutinefunction(ws_client.send_str):
+        await ws_client.send_str(msg)
+    else:
+        ws_client.send_str(msg)
+
+
+async def ping_nodes(nodes):
+    msg = json.dumps({"ping": 1})
+    results = await asyncio.gather(*[send_ping(node, msg) for node in nodes], return_exceptions=True)
+    for node, result in zip(nodes, results):
+        if isinstance(result, Exception):
+            logger.warning("backend: error sending ping to %s/%s: %s",
+                           node.molior_node_arch, node.molior_node_name, str(result))
+
+
+async def ping_timeout(ws_client):
+    logger.warning("backend: ping timeout after %ds on %s/%s",
+                   PING_TIMEOUT, ws_client.molior_node_arch, ws_client.molior_node_name)
+    await deregister_node(ws_client)
+    # await ws_client.close()
+
+
+heartbeat = HeartbeatWheel(PING_TIMEOUT, ping_nodes, ping_timeout)
 
 
 @app.websocket_connect(group="registry")
@@ -60,9 +280,11 @@ async def node_register(ws_client):
     arch = ws_client.cirrina.request.match_info["arch"]
 
     if arch not in registry:
-        logger.error("backend: invalid architecture received: '%s'", arch)
-        # await ws_client.close()
-        return ws_client
+        if not VALID_ARCH.match(arch):
+            logger.error("backend: invalid architecture received: '%s'", arch)
+            # await ws_client.close()
+            return ws_client
+        Backend().get_backend().add_pool(arch)
 
     # initialize
     ws_client.molior_node_name = node
@@ -80,10 +302,13 @@ async def node_register(ws_client):
     ws_client.molior_sourceversion = ""
     ws_client.molior_sourcearch = ""
     ws_client.molior_uptime_seconds = 0
+    ws_client.molior_builds = {}
+    ws_client.molior_slots = get_node_slots(ws_client)
 
-    registry[arch].insert(0, ws_client)
+    registry.add(ws_client, arch)
+    get_node_event(arch).set()
+    heartbeat.add(ws_client)
     logger.info("backend: %s node registered: %s", arch, node)
-    ws_client.molior_watchdog = asyncio.ensure_future(watchdog(ws_client))
     await enqueue_backend({"node_registered": 1})
 
 
@@ -96,45 +321,46 @@ async def node_message(ws_client, msg):
             ws_client.molior_cpu_cores = status["register"].get("cpu_cores")
             ws_client.molior_ram_total = status["register"].get("ram_total")
             ws_client.molior_disk_total = status["register"].get("disk_total")
-            ws_client.molior_nodeid = status["register"].get("id")
+            registry.set_node_id(ws_client, status["register"].get("id"))
             ws_client.molior_ip = status["register"].get("ip")
             ws_client.molior_client_ver = status["register"].get("client_ver")
+            ws_client.molior_slots = get_node_slots(ws_client)
+            logger.info("backend: %s node %s has %d build slots", ws_client.molior_node_arch,
+                        ws_client.molior_node_name, ws_client.molior_slots)
+            if registry.is_idle(ws_client):
+                get_node_event(ws_client.molior_node_arch).set()
             return
 
         if "pong" in status:
-            ws_client.molior_pong_pending = 0
+            heartbeat.pong(ws_client)
             ws_client.molior_uptime_seconds = status["pong"]["uptime_seconds"]
             ws_client.molior_load = status["pong"]["load"]
             ws_client.molior_ram_used = status["pong"].get("ram_used")
             ws_client.molior_disk_used = status["pong"].get("disk_used")
+            if registry.is_idle(ws_client):
+                # telemetry changed, the node policy might select the node now
+                get_node_event(ws_client.molior_node_arch).set()
             return
 
-        arch = ws_client.molior_node_arch
-        build_id = ws_client.molior_build_id
+        build_id = status.get("build_id")
+        if build_id not in ws_client.molior_builds:
+            logger.error("backend: status '%s' for unknown build %s received from %s/%s", status.get("status"),
+                         build_id, ws_client.molior_node_arch, ws_client.molior_node_name)
+            return
 
         if status["status"] == "building":
             await enqueue_backend({"started": build_id})
 
         elif status["status"] == "failed":
+            fair_share.finished(build_id)
             await enqueue_backend({"failed": build_id})
-            if ws_client in running_nodes[arch]:
-                running_nodes[arch].remove(ws_client)
-                registry[arch].insert(0, ws_client)
-            ws_client.molior_build_id = None
-            ws_client.molior_sourcename = ""
-            ws_client.molior_sourceversion = ""
-            ws_client.molior_sourcearch = ""
+            finish_node_build(ws_client, build_id)
 
         elif status["status"] == "success":
             logger.debug("node: finished build {}".format(build_id))
+            fair_share.finished(build_id)
             await enqueue_backend({"succeeded": build_id})
-            if ws_client in running_nodes[arch]:
-                running_nodes[arch].remove(ws_client)
-                registry[arch].insert(0, ws_client)
-            ws_client.molior_build_id = None
-            ws_client.molior_sourcename = ""
-            ws_client.molior_sourceversion = ""
-            ws_client.molior_sourcearch = ""
+            finish_node_build(ws_client, build_id)
 
         else:
             logger.error("backend: invalid message received: '%s'", status["status"])
@@ -152,20 +378,24 @@ async def deregister_node(ws_client):
     node = ws_client.molior_node_name
     arch = ws_client.molior_node_arch
 
-    if ws_client in registry[arch]:
-        registry[arch].remove(ws_client)
-        logger.warning("backend: node disconnected: %s/%s", arch, node)
+    connected, _, build_ids = registry.remove(ws_client)
+    heartbeat.remove(ws_client)
+
+    if build_ids:
+        ws_client.molior_builds = {}
+        for build_id in build_ids:
+            logger.error("backend: lost build_%d on %s/%s", build_id, arch, node)
+            fair_share.finished(build_id)
+            await enqueue_backend({"failed": build_id})
 
-    elif ws_client in running_nodes[arch]:
-        running_nodes[arch].remove(ws_client)
-        build_id = ws_client.molior_build_id
-        logger.error("backend: lost build_%d on %s/%s", build_id, arch, node)
-        await enqueue_backend({"failed": build_id})
+    elif connected:
+        logger.warning("backend: node disconnected: %s/%s", arch, node)
 
     else:
         logger.warning("backend: unknown node disconnect: %s/%s", arch, node)
 
-    await ws_client.molior_watchdog
+    if connected:
+        move_stranded_buildtasks(arch)
 
 
 class HTTPBackend:
@@ -175,21 +405,37 @@ class HTTPBackend:
 
     def __init__(self, loop):
         self.loop = loop
-        self.task_scheduler_amd64 = asyncio.ensure_future(self.scheduler("amd64"), loop=self.loop)
-        self.task_scheduler_arm64 = asyncio.ensure_future(self.scheduler("arm64"), loop=self.loop)
+        self.schedulers = {}
+        for arch in POOLS:
+            self.add_pool(arch)
+        # no node is connected yet, move the tasks of pools with compatible nodes
+        for arch in get_buildtask_archs():
+            move_stranded_buildtasks(arch)
+        self.node_status = {}  # node id: status last sent to the web clients
         self.task_notifier = asyncio.ensure_future(self.notifier(), loop=self.loop)
+        self.task_heartbeat = asyncio.ensure_future(heartbeat.run(), loop=self.loop)
         self.aborted_builds = []
 
+    def add_pool(self, arch):
+        """
+        Creates the node pool of an arch with its
+        node lists, build task queue and scheduler.
+        """
+        if arch in self.schedulers:
+            return
+        logger.info("backend: adding %s node pool", arch)
+        registry.add_pool(arch)
+        self.schedulers[arch] = asyncio.ensure_future(self.scheduler(arch), loop=self.loop)
+
     async def build(self, build_id, token, build_version, apt_server, arch, arch_any_only, distrelease_name, distrelease_version,
-                    project_dist, sourcename, project_name, project_version, apt_urls, apt_keys, run_lintian=True):
+                    project_dist, sourcename, project_name, project_version, apt_urls, apt_keys, run_lintian=True,
+                    priority="release"):
         task_id = "build_%d" % build_id
-        if arch == "i386" or arch == "amd64":
-            queue_arch = "amd64"
-        elif arch == "armhf" or arch == "arm64":
-            queue_arch = "arm64"
-        else:
-            logger.error("backend: invalid build architecture '%s'", arch)
+        queue_arch = get_pool(arch)
+        if not queue_arch:
+            logger.error("backend: no node pool for build architecture '%s'", arch)
             return False
+        self.add_pool(queue_arch)
 
         await enqueue_buildtask(queue_arch, {"build_id": build_id,
                                              "token": token,
@@ -206,144 +452,152 @@ class HTTPBackend:
                                              "apt_urls": apt_urls,
                                              "apt_keys": apt_keys,
                                              "task_id": task_id,
-                                             "run_lintian": run_lintian})
+                                             "run_lintian": run_lintian},
+                                priority=priority, group=get_share_group(project_name, project_version))
 
     async def abort(self, build_id):
         logger.error(f"aborting build {build_id}")
-        for arch in running_nodes:
-            for node in running_nodes[arch]:
-                if node.molior_build_id == build_id:
-                    logger.error(f"aborting build {build_id} on node {node.molior_node_name}")
-                    await node.send_str(json.dumps({"abort": build_id}))
-                    return
+        # the node might not report the aborted build
+        fair_share.finished(build_id)
+        node = registry.find_build(build_id)
+        if node:
+            logger.error(f"aborting build {build_id} on node {node.molior_node_name}")
+            await node.send_str(json.dumps({"abort": build_id}))
+            return
         self.aborted_builds.append(build_id)
 
     def get_nodes_info(self):
-        # FIXME: lock both dicts on every access
-        build_nodes = []
-        for arch in registry:
-            for node in registry[arch]:
-                build_nodes.append({
-                    "name": node.molior_node_name,
-                    "arch": arch,
-                    "state": "idle",
-                    "uptime_seconds": node.molior_uptime_seconds,
-                    "load": node.molior_load,
-                    "cpu_cores": node.molior_cpu_cores,
-                    "ram_used": node.molior_ram_used,
-                    "ram_total": node.molior_ram_total,
-                    "disk_used": node.molior_disk_used,
-                    "disk_total": node.molior_disk_total,
-                    "id": node.molior_nodeid,
-                    "ip": node.molior_ip,
-                    "client_ver": node.molior_client_ver,
-                    "sourcename": node.molior_sourcename,
-                    "sourceversion": node.molior_sourceversion,
-                    "sourcearch": node.molior_sourcearch
-                })
-        for arch in running_nodes:
-            for node in running_nodes[arch]:
-                build_nodes.append({
-                    "name": node.molior_node_name,
-                    "arch": arch,
-                    "state": "busy",
-                    "uptime_seconds": node.molior_uptime_seconds,
-                    "load": node.molior_load,
-                    "cpu_cores": node.molior_cpu_cores,
-                    "ram_used": node.molior_ram_used,
-                    "ram_total": node.molior_ram_total,
-                    "disk_used": node.molior_disk_used,
-                    "disk_total": node.molior_disk_total,
-                    "id": node.molior_nodeid,
-                    "ip": node.molior_ip,
-                    "client_ver": node.molior_client_ver,
-                    "sourcename": node.molior_sourcename,
-                    "sourceversion": node.molior_sourceversion,
-                    "sourcearch": node.molior_sourcearch
-                })
-        return build_nodes
+        return [self.get_node_info_data(arch, node) for arch, node in get_nodes()]
+
+    def get_node_info(self, node_id):
+        """
+        Returns the info of a connected node by its machine id, or None.
+        """
+        node = registry.get(node_id)
+        if not node:
+            return None
+        return self.get_node_info_data(node.molior_node_arch, node)
+
+    @staticmethod
+    def get_node_info_data(arch, node):
+        return {
+            "name": node.molior_node_name,
+            "arch": arch,
+            "state": "busy" if node.molior_builds else "idle",
+            "uptime_seconds": node.molior_uptime_seconds,
+            "load": node.molior_load,
+            "cpu_cores": node.molior_cpu_cores,
+            "ram_used": node.molior_ram_used,
+            "ram_total": node.molior_ram_total,
+            "disk_used": node.molior_disk_used,
+            "disk_total": node.molior_disk_total,
+            "id": node.molior_nodeid,
+            "ip": node.molior_ip,
+            "client_ver": node.molior_client_ver,
+            "sourcename": node.molior_sourcename,
+            "sourceversion": node.molior_sourceversion,
+            "sourcearch": node.molior_sourcearch,
+            "slots": node.molior_slots,
+            "builds": list(node.molior_builds.keys())
+        }
 
     async def stop(self):
-        self.task_scheduler_amd64.cancel()
-        await self.task_scheduler_amd64
-        self.task_scheduler_arm64.cancel()
-        await self.task_scheduler_arm64
+        for scheduler in self.schedulers.values():
+            scheduler.cancel()
+            await scheduler
         self.task_notifier.cancel()
         await self.task_notifier
+        self.task_heartbeat.cancel()
+        await self.task_heartbeat
 
-        for arch in registry.keys():
-            for node in registry[arch]:
+        for arch in registry.get_pools():
+            for node in registry.get_idle(arch):
                 await deregister_node(node)
 
     async def scheduler(self, arch):
-        up = True
-        while up:
+        while True:
             try:
+                # pick the next build only when a node is idle
+                try:
+                    await wait_idle_node(arch)
+                except CancelledError:
+                    break
+
                 task = await dequeue_buildtask(arch)
                 if task is None:
                     break
 
                 build_id = task["build_id"]
+                if build_id in self.aborted_builds:
+                    logger.info("build-%d: build aborted", build_id)
+                    self.aborted_builds.remove(build_id)
+                    fair_share.finished(build_id)
+                    continue
 
-                while up:
-                    try:
-                        node = registry[arch].pop()
-                    except IndexError:
-                        # FIXME: put task to top of the queue / pending queue
-                        try:
-                            await asyncio.sleep(1)
-                        except CancelledError:
-                            up = False
-                            break
-                        continue
+                try:
+                    node, reason = await wait_idle_node(arch)
+                except CancelledError:
                     break
 
                 # check if build was aborted
                 if build_id in self.aborted_builds:
                     logger.info("build-%d: build aborted", build_id)
                     self.aborted_builds.remove(build_id)
-                    registry[arch].append(node)
+                    fair_share.finished(build_id)
                     continue
 
-                logger.info("build-%d: building for %s on %s ", build_id, arch, node.molior_node_name)
-                running_nodes[arch].append(node)
-                node.molior_build_id = build_id
-                node.molior_sourcename = task.get("repository_name")
-                node.molior_sourceversion = task.get("version")
-                node.molior_sourcearch = task.get("architecture")
+                logger.info("build-%d: building for %s on %s (%s)", build_id, arch, node.molior_node_name, reason)
+                start_node_build(node, task)
                 await node.send_str(json.dumps({"task": task}))
 
             except Exception as exc:
                 logger.exception(exc)
 
-            await asyncio.sleep(1)
-
         logger.info("scheduler %s task terminated", arch)
 
     async def notifier(self):
+        """
+        Sends the node list when nodes were added, removed or changed,
+        see node_status_changed(), and periodically.
+
+        Clients subscribed to "node:delta" receive the periodic list,
+        and otherwise only the added, changed and removed nodes.
+        """
+        last_snapshot = None
         while True:
-            nodes = []
-            for arch in registry:
-                nodes.extend(registry[arch])
-            for arch in running_nodes:
-                nodes.extend(running_nodes[arch])
-
-            data = []
-            for node in nodes:
-                data.append({
-                    "id": node.molior_nodeid,
-                    "state": "busy" if node in running_nodes["amd64"] or node in running_nodes["arm64"] else "idle",
-                    "uptime_seconds": node.molior_uptime_seconds,
-                    "load": node.molior_load,
-                    "ram_used": node.molior_ram_used,
-                    "disk_used": node.molior_disk_used,
-                    "sourcename": node.molior_sourcename,
-                    "sourceversion": node.molior_sourceversion,
-                    "sourcearch": node.molior_sourcearch
-                    })
-            await notify(Subject.node.value, Event.changed.value, data)
+            now = self.loop.time()
+            statuses = {}
+            for _, node in get_nodes():
+                status = get_node_status(node)
+                statuses[status["id"]] = status
+
+            if last_snapshot is None or now - last_snapshot >= NODE_SNAPSHOT_INTERVAL:
+                await notify(Subject.node.value, Event.changed.value, list(statuses.values()), [NODE_DELTA_TOPIC])
+                self.node_status = statuses
+                last_snapshot = now
+            else:
+                changed = False
+                for node_id, status in statuses.items():
+                    old = self.node_status.get(node_id)
+                    if not old:
+                        await notify(Subject.node.value, Event.added.value, status, [NODE_DELTA_TOPIC], opt_in=True)
+                    elif node_status_changed(old, status):
+                        await notify(Subject.node.value, Event.changed.value, status, [NODE_DELTA_TOPIC], opt_in=True)
+                    else:
+                        continue
+                    self.node_status[node_id] = status
+                    changed = True
+                for node_id in list(self.node_status.keys()):
+                    if node_id not in statuses:
+                        await notify(Subject.node.value, Event.removed.value, {"id": node_id}, [NODE_DELTA_TOPIC],
+                                     opt_in=True)
+                        del self.node_status[node_id]
+                        changed = True
+                if changed:
+                    # clients not subscribed to the deltas keep receiving the list
+                    await notify(Subject.node.value, Event.changed.value, list(statuses.values()))
             try:
-                await asyncio.sleep(4)
+                await asyncio.sleep(NODE_STATUS_INTERVAL)
             except Exception:
                 break
         logger.info("notifier task terminated")
@@ -0,0 +1,156 @@
+import importlib
+
+from ...app import logger
+
+GB = 1024 ** 3
+
+
+def get_node_stats(node):
+    """
+    Returns the load per core and the free RAM and disk
+    of a node as reported in the last pong.
+    """
+    load = node.molior_load
+    if isinstance(load, (list, tuple)):
+        load = load[0] if load else 0
+    cores = node.molior_cpu_cores or 1
+    ram_free = None
+    if node.molior_ram_total:
+        ram_free = node.molior_ram_total - (node.molior_ram_used or 0)
+    disk_free = None
+    if node.molior_disk_total:
+        disk_free = node.molior_disk_total - (node.molior_disk_used or 0)
+    return (load or 0) / cores, ram_free, disk_free
+
+
+def get_free_slots(node):
+    """
+    Returns the free and the total build slots of a node.
+    """
+    slots = node.molior_slots or 1
+    return slots - len(node.molior_builds), slots
+
+
+class NodePolicy:
+    """
+    Base class for selecting the build node out of the idle nodes.
+
+    Policies implement check() to skip unsuitable nodes and
+    rank() to order the remaining ones.
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    def check(self, node):
+        """
+        Returns the reason for skipping the node, or None if usable.
+        """
+        return None
+
+    def rank(self, node, position):
+        """
+        Returns the sort key of a usable node, the highest is selected.
+        """
+        return position
+
+    def describe(self, node):
+        """
+        Returns the reason why a node was selected.
+        """
+        return "longest idle"
+
+    def select(self, nodes):
+        """
+        Selects a node.
+
+        Args:
+            nodes (list): The idle nodes, the longest idle last.
+
+        Returns:
+            tuple: The node or None, the reason, and a list of (node, reason)
+                   of the skipped nodes.
+        """
+        candidates = []
+        skipped = []
+        for position, node in enumerate(nodes):
+            reason = self.check(node)
+            if reason:
+                skipped.append((node, reason))
+            else:
+                candidates.append((self.rank(node, position), position, node))
+        if not candidates:
+            return None, None, skipped
+        _, _, node = max(candidates, key=lambda c: (c[0], c[1]))
+        return node, self.describe(node), skipped
+
+
+class ResourcePolicy(NodePolicy):
+    """
+    Skips nodes above the load or below the free RAM and disk
+    thresholds, and prefers nodes with low load, free resources
+    and free build slots.
+    """
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.max_load = float(cfg.get("max_load", 1.5))
+        self.min_free_ram = float(cfg.get("min_free_ram", 1)) * GB
+        self.min_free_disk = float(cfg.get("min_free_disk", 10)) * GB
+
+    def check(self, node):
+        load, ram_free, disk_free = get_node_stats(node)
+        if load > self.max_load:
+            return "load {:.2f} per core above {:.2f}".format(load, self.max_load)
+        if ram_free is not None and ram_free < self.min_free_ram:
+            return "{:.1f} GB RAM free".format(ram_free / GB)
+        if disk_free is not None and disk_free < self.min_free_disk:
+            return "{:.1f} GB disk free".format(disk_free / GB)
+        return None
+
+    def rank(self, node, position):
+        load, ram_free, disk_free = get_node_stats(node)
+        free_slots, slots = get_free_slots(node)
+        score = free_slots / slots - load
+        if ram_free is not None:
+            score += ram_free / node.molior_ram_total
+        if disk_free is not None:
+            score += disk_free / node.molior_disk_total
+        return score
+
+    def describe(self, node):
+        load, ram_free, disk_free = get_node_stats(node)
+        reason = "load {:.2f} per core".format(load)
+        if ram_free is not None:
+            reason += ", {:.1f} GB RAM free".format(ram_free / GB)
+        if disk_free is not None:
+            reason += ", {:.1f} GB disk free".format(disk_free / GB)
+        free_slots, slots = get_free_slots(node)
+        if slots > 1:
+            reason += ", {} of {} slots free".format(free_slots, slots)
+        return reason
+
+
+POLICIES = {
+    "idle": NodePolicy,
+    "resources": ResourcePolicy,
+}
+
+
+def get_node_policy(cfg):
+    """
+    Returns the node selection policy configured in backend_http.node_policy,
+    either a builtin policy name or the import path of a NodePolicy class.
+    """
+    name = cfg.get("node_policy", "resources")
+    policy = POLICIES.get(name)
+    if not policy and "." in name:
+        module_name, class_name = name.rsplit(".", 1)
+        try:
+            policy = getattr(importlib.import_module(module_name), class_name)
+        except Exception as exc:
+            logger.exception(exc)
+    if not policy:
+        logger.error("backend: unknown node policy '%s', using 'resources'", name)
+        policy = ResourcePolicy
+    return policy(cfg)
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+
+
+class NodeRegistry:
+    """
+    The connected build nodes, indexed by node id, pool arch and state.
+
+    Nodes with free build slots are idle, nodes running builds are busy,
+    a node with several slots can be both. Idle nodes are kept in the
+    order they became idle, so the node policy can prefer the longest idle.
+    """
+
+    def __init__(self):
+        self.nodes = {}   # websocket client: pool arch
+        self.by_id = {}   # node id: websocket client
+        self.idle = {}    # arch: OrderedDict of idle nodes, the most recently used last
+        self.busy = {}    # arch: OrderedDict of nodes running builds
+        self.builds = {}  # build id: websocket client
+
+    def __contains__(self, arch):
+        return arch in self.idle
+
+    def add_pool(self, arch):
+        self.idle.setdefault(arch, OrderedDict())
+        self.busy.setdefault(arch, OrderedDict())
+
+    def get_pools(self):
+        return list(self.idle.keys())
+
+    def has_nodes(self, arch):
+        return bool(self.idle.get(arch)) or bool(self.busy.get(arch))
+
+    def add(self, node, arch):
+        """
+        Adds a connected node as idle.
+        """
+        self.add_pool(arch)
+        self.nodes[node] = arch
+        self.set_idle(node)
+
+    def remove(self, node):
+        """
+        Removes a disconnected node.
+
+        Returns:
+            tuple: Whether the node was connected, whether it was idle,
+                   and the ids of the builds it was running.
+        """
+        arch = self.nodes.pop(node, None)
+        if arch is None:
+            return False, False, []
+        idle = self.idle[arch].pop(node, None) is not None
+        self.busy[arch].pop(node, None)
+        node_id = getattr(node, "molior_nodeid", None)
+        if node_id and self.by_id.get(node_id) is node:
+            del self.by_id[node_id]
+        build_ids = list(node.molior_builds.keys())
+        for build_id in build_ids:
+            if self.builds.get(build_id) is node:
+                del self.builds[build_id]
+        return True, idle, build_ids
+
+    def is_connected(self, node):
+        return node in self.nodes
+
+    def is_idle(self, node):
+        arch = self.nodes.get(node)
+        return arch is not None and node in self.idle[arch]
+
+    def set_idle(self, node):
+        """
+        Marks a node with free slots as the most recently used idle node.
+        """
+        idle = self.idle[self.nodes[node]]
+        idle[node] = True
+        idle.move_to_end(node)
+
+    def set_node_id(self, node, node_id):
+        old_id = getattr(node, "molior_nodeid", None)
+        if old_id and self.by_id.get(old_id) is node:
+            del self.by_id[old_id]
+        node.molior_nodeid = node_id
+        if node_id and node in self.nodes:
+            self.by_id[node_id] = node
+
+    def get(self, node_id):
+        return self.by_id.get(node_id)
+
+    def get_idle(self, arch):
+        """
+        Returns the idle nodes of an arch, the longest idle last.
+        """
+        return list(reversed(self.idle.get(arch, {})))
+
+    def get_busy(self, arch):
+        return list(self.busy.get(arch, {}))
+
+    def get_nodes(self):
+        """
+        Returns (arch, node) of all connected nodes.
+        """
+        return [(arch, node) for node, arch in self.nodes.items()]
+
+    def find_build(self, build_id):
+        """
+        Returns the node running a build, or None.
+        """
+        return self.builds.get(build_id)
+
+    def start_build(self, node, build_id, source):
+        """
+        Takes a build slot of a node, the node stays
+        idle while it has free slots.
+        """
+        arch = self.nodes[node]
+        node.molior_builds[build_id] = source
+        self.builds[build_id] = node
+        self.busy[arch][node] = True
+        if len(node.molior_builds) < node.molior_slots:
+            self.set_idle(node)
+        else:
+            self.idle[arch].pop(node, None)
+
+    def finish_build(self, node, build_id):
+        """
+        Frees the build slot of a node.
+
+        Returns:
+            bool: Whether the node became idle.
+        """
+        arch = self.nodes.get(node)
+        node.molior_builds.pop(build_id, None)
+        if self.builds.get(build_id) is node:
+            del self.builds[build_id]
+        if arch is None:
+            return False
+        if not node.molior_builds:
+            self.busy[arch].pop(node, None)
+        if node in self.idle[arch]:
+            return False
+        self.set_idle(node)
+        return True
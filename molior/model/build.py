@@ -6,9 +6,10 @@ from ..app import logger
 from ..tools import get_local_tz, db2array
 # from .tools import check_user_role
 from ..molior.notifier import Subject, Event, notify, run_hooks
-from ..molior.queues import buildlog, buildlogtitle, buildlogdone
+from ..molior.buildindex import build_index
+from ..molior.queues import buildlog, buildlogtitle, buildlogdone, buildlog_writer
 
-from .database import Base
+from .database import Base, wakeup_after_commit
 from .sourcerepository import SourceRepository
 from .buildtask import BuildTask
 from .debianpackage import Debianpackage
@@ -29,6 +30,16 @@ BUILD_STATES = [
     "nothing_done",
 ]
 
+# states after which a build does not change anymore, unless rebuilt
+FINISHED_STATES = [
+    "build_failed",
+    "publish_failed",
+    "successful",
+    "already_exists",
+    "already_failed",
+    "nothing_done",
+]
+
 BUILD_TYPES = ["build", "source", "deb", "chroot", "mirror"]
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
@@ -64,6 +75,7 @@ class Build(Base):
     debianpackages = relationship(Debianpackage, secondary=BuildDebianpackage)
     is_deleted = Column(Boolean, default=False)
     snapshotbuild_id = Column(Integer)
+    priority = Column(String)  # priority class requested for building, see BUILD_PRIORITIES
 
     async def log(self, msg):
         await buildlog(self.id, msg)
@@ -261,6 +273,21 @@ class Build(Base):
 
         return data
 
+    def topics(self):
+        """
+        Returns the websocket topics of the build: the build tree
+        it belongs to, the project and the projectversion.
+        """
+        topics = ["build:%d" % self.id]
+        if self.parent_id:
+            topics.append("build:%d" % self.parent_id)
+            if self.parent and self.parent.parent_id:
+                topics.append("build:%d" % self.parent.parent_id)
+        if self.projectversion:
+            topics.append("project:%s" % self.projectversion.project.name)
+            topics.append("projectversion:%s/%s" % (self.projectversion.project.name, self.projectversion.name))
+        return topics
+
     async def build_added(self):
         """
         Sends a `build_added` notification to the web clients
@@ -268,8 +295,9 @@ class Build(Base):
         Args:
             build (molior.model.build.Build): The build model.
         """
+        build_index.update(self)
         data = self.data()
-        await notify(Subject.build.value, Event.added.value, data)
+        await notify(Subject.build.value, Event.added.value, data, self.topics())
 
     async def build_changed(self):
         """
@@ -278,8 +306,13 @@ class Build(Base):
         Args:
             build (molior.model.build.Build): The build model.
         """
+        build_index.update(self)
+        buildlog_writer.set_finished(self.id, self.buildstate in FINISHED_STATES)
         data = self.data()
-        await notify(Subject.build.value, Event.changed.value, data)
+        await notify(Subject.build.value, Event.changed.value, data, self.topics())
+
+        # let tasks waiting for this build retry
+        wakeup_after_commit(self, "build_%d" % self.id)
 
         # running hooks if needed
         if self.buildtype != "deb":  # only run hooks for deb builds
@@ -1,7 +1,7 @@
 import os
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, object_session, Session as OrmSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.pool import QueuePool
 
@@ -10,6 +10,42 @@ from ..molior.configuration import Configuration
 Base = declarative_base()
 database = None
 
+# called with the resources changed by a committed session, see taskqueue.wakeup_committed()
+commit_hooks = []
+
+
+def wakeup_after_commit(obj, resource):
+    """
+    Wakes up the tasks waiting for a resource once the
+    change of the model object is committed.
+
+    Args:
+        obj: The changed model object.
+        resource (str): The resource key, e.g. "repo_42".
+    """
+    session = object_session(obj)
+    if session is None:
+        run_commit_hooks(set([resource]))
+        return
+    session.info.setdefault("wakeup", set()).add(resource)
+
+
+def run_commit_hooks(resources):
+    for hook in commit_hooks:
+        hook(resources)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def on_commit(session):
+    resources = session.info.pop("wakeup", None)
+    if resources:
+        run_commit_hooks(resources)
+
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def on_rollback(session, previous_transaction):
+    session.info.pop("wakeup", None)
+
 
 class Session:
     def __enter__(self):
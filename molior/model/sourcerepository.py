@@ -4,7 +4,7 @@ from sqlalchemy.orm import relationship
 
 from ..app import logger
 from ..molior.configuration import Configuration
-from .database import Base
+from .database import Base, wakeup_after_commit
 
 REPO_STATES = ["new", "cloning", "error", "ready", "busy"]
 DEFAULT_CWD = "/var/lib/molior"
@@ -60,10 +60,12 @@ class SourceRepository(Base):
     def set_error(self):
         self.log_state("git error")
         self.state = "error"
+        wakeup_after_commit(self, "repo_%d" % self.id)
 
     def set_ready(self):
         self.log_state("ready")
         self.state = "ready"
+        wakeup_after_commit(self, "repo_%d" % self.id)
 
     def set_busy(self):
         self.log_state("busy")
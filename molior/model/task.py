@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, DateTime
+
+from .database import Base
+
+
+class Task(Base):
+    __tablename__ = "task"
+
+    id = Column(Integer, primary_key=True)
+    queue = Column(String, index=True, nullable=False)
+    payload = Column(String)
+    resource = Column(String, index=True)
+    not_before = Column(DateTime(timezone=True), nullable=True)
+    priority = Column(Integer, nullable=False, default=0)
+    tag = Column(String)
+    createdstamp = Column(DateTime(timezone=True), nullable=True, default="now()")
@@ -0,0 +1,159 @@
+ACTIVE_STATES = ["new", "needs_build", "scheduled", "building", "needs_publish", "publishing"]
+
+
+def state_class(state):
+    if state in ACTIVE_STATES:
+        return "active"
+    if state == "successful":
+        return "successful"
+    return None
+
+
+class BuildIndex:
+    """
+    In-memory index of the deb builds used by the scheduler.
+
+    It is loaded once from the database and then kept up
+    to date by the build state changes. A state change only
+    marks the waiting builds depending on the changed source
+    repository as dirty, so the scheduler re-evaluates just
+    the builds affected by the change.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.reset()
+
+    def reset(self):
+        self.debs = {}            # build_id: (buildstate, repo_id, projectversion_id)
+        self.active = {}          # (repo_id, projectversion_id): set of build ids
+        self.successful = {}      # (repo_id, projectversion_id): set of build ids
+        self.waiting = {}         # build_id: (projectversion closure, repo_deps) of builds needing a build
+        self.dependents = {}      # repo_id: set of waiting build ids depending on it
+        self.chroot_waiting = set()
+        self.dirty = set()
+
+    def load(self, builds):
+        """
+        Initializes the index.
+
+        Args:
+            builds (list): Tuples of (build_id, buildstate, repo_id, projectversion_id)
+                           of all deb builds.
+        """
+        self.reset()
+        self.loaded = True
+        for build_id, state, repo_id, projectversion_id in builds:
+            self.set_state(build_id, state, repo_id, projectversion_id)
+
+    def update(self, build):
+        """
+        Applies the state change of a build model.
+        """
+        if not self.loaded:
+            return
+        if build.buildtype == "chroot":
+            # chroot readiness changed, check the builds waiting for one
+            self.dirty |= self.chroot_waiting
+            self.chroot_waiting = set()
+            return
+        if build.buildtype != "deb" or build.id is None:
+            return
+        self.set_state(build.id, build.buildstate, build.sourcerepository_id, build.projectversion_id)
+
+    def remove(self, build_id):
+        if self.loaded:
+            self.set_state(build_id, None, None, None)
+
+    def set_state(self, build_id, state, repo_id, projectversion_id):
+        old = self.debs.pop(build_id, None)
+        new = (state, repo_id, projectversion_id)
+        if old == new:
+            self.debs[build_id] = old
+            return
+
+        changed = []
+        if old:
+            old_state, old_repo_id, old_projectversion_id = old
+            key = (old_repo_id, old_projectversion_id)
+            for builds in [self.active.get(key), self.successful.get(key)]:
+                if builds:
+                    builds.discard(build_id)
+            if state_class(old_state) != state_class(state) or old[1:] != new[1:]:
+                changed.append(key)
+
+        if state is not None:
+            self.debs[build_id] = new
+            key = (repo_id, projectversion_id)
+            cls = state_class(state)
+            if cls == "active":
+                self.active.setdefault(key, set()).add(build_id)
+            elif cls == "successful":
+                self.successful.setdefault(key, set()).add(build_id)
+            if not old or state_class(old[0]) != cls or old[1:] != new[1:]:
+                changed.append(key)
+
+        if state == "needs_build":
+            self.dirty.add(build_id)
+        else:
+            self.forget(build_id)
+
+        # builds waiting for the changed repo have to be checked again
+        for changed_repo_id, changed_projectversion_id in changed:
+            self.dirty |= self.dependents.get(changed_repo_id, set())
+            for waiting_id, (closure, repo_deps) in self.waiting.items():
+                if repo_deps is None and changed_projectversion_id in closure:
+                    self.dirty.add(waiting_id)
+
+    def forget(self, build_id):
+        entry = self.waiting.pop(build_id, None)
+        if entry and entry[1]:
+            for repo_id in entry[1]:
+                dependents = self.dependents.get(repo_id)
+                if dependents:
+                    dependents.discard(build_id)
+                    if not dependents:
+                        del self.dependents[repo_id]
+        self.chroot_waiting.discard(build_id)
+        self.dirty.discard(build_id)
+
+    def resolve(self, build_id, closure, repo_deps):
+        """
+        Stores the resolved build order dependencies of a waiting build.
+
+        Args:
+            closure (list): The projectversion and its non-mirror dependencies.
+            repo_deps (list): The source repository ids the build depends on,
+                              or None if a dependency could not be found.
+        """
+        self.forget(build_id)
+        self.waiting[build_id] = (closure, repo_deps)
+        for repo_id in repo_deps or []:
+            self.dependents.setdefault(repo_id, set()).add(build_id)
+
+    def wait_chroot(self, build_id):
+        self.chroot_waiting.add(build_id)
+
+    def is_needs_build(self, build_id):
+        entry = self.debs.get(build_id)
+        return entry is not None and entry[0] == "needs_build"
+
+    def take_dirty(self):
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+    def running_builds(self, repo_id, closure):
+        builds = set()
+        for projectversion_id in closure:
+            builds |= self.active.get((repo_id, projectversion_id), set())
+        return sorted(builds)
+
+    def has_successful(self, repo_id, closure):
+        for projectversion_id in closure:
+            if self.successful.get((repo_id, projectversion_id)):
+                return True
+        return False
+
+
+build_index = BuildIndex()
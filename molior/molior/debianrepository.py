@@ -1,5 +1,6 @@
 import asyncio
 
+from os.path import basename
 from datetime import datetime, timedelta
 
 from ..app import logger
@@ -7,6 +8,48 @@ from ..aptly import get_aptly_connection, get_snapshot_name
 from .configuration import Configuration
 
 
+PACKAGE_SUFFIXES = (".deb", ".udeb", ".dsc")
+
+
+def get_dsc_files(dsc_file):
+    """
+    Returns the names of the files listed in a .dsc file.
+    """
+    files = []
+    try:
+        with open(dsc_file, "r") as f:
+            file_tag = False
+            for line in f:
+                line = line.rstrip()
+                if not file_tag:
+                    if line == "Files:":
+                        file_tag = True
+                elif not line.startswith(" "):
+                    break
+                else:
+                    files.append(line.split()[-1])
+    except Exception as exc:
+        logger.exception(exc)
+    return files
+
+
+def get_package_files(files):
+    """
+    Returns the names of the files aptly imports into a repo,
+    other files like .buildinfo are left in the upload dir.
+
+    Args:
+        files (list): List of filepaths to be uploaded.
+    """
+    names = set()
+    for filename in files:
+        if filename.endswith(PACKAGE_SUFFIXES):
+            names.add(basename(filename))
+        if filename.endswith(".dsc"):
+            names.update(get_dsc_files(filename))
+    return names
+
+
 class DebianRepository:
     """
     Represents a remote debian repository.
@@ -59,20 +102,16 @@ class DebianRepository:
         if they don't already exist.
         """
         logger.debug("init repository called for '%s'", self.name)
-        snapshots = await self.aptly.snapshot_get()
-        repos = await self.aptly.repo_get()
 
         for dist in self.DISTS:
             repo_name = self.name + "-%s" % dist
-            for repo in repos:
-                if repo.get("Name") == repo_name:
-                    logger.error("aptly repo '%s' already exists", repo_name)
-                    return False
+            if await self.aptly.catalog.has_repo(repo_name):
+                logger.error("aptly repo '%s' already exists", repo_name)
+                return False
             snapshot_name = get_snapshot_name(self.publish_name, dist)
-            for snapshot in snapshots:
-                if snapshot.get("Name") == snapshot_name:
-                    logger.error("publish point for '%s' already exists", snapshot_name)
-                    return False
+            if await self.aptly.catalog.has_snapshot(snapshot_name):
+                logger.error("publish point for '%s' already exists", snapshot_name)
+                return False
 
         for dist in self.DISTS:
             repo_name = self.name + "-%s" % dist
@@ -226,12 +265,24 @@ class DebianRepository:
         logger.debug("repo add returned aptly task id '%s' and upload dir '%s'", task_id, upload_dir)
         logger.debug("waiting for repo add task with id '%s' to finish", task_id)
 
-        await self.aptly.wait_task(task_id)
+        ret = await self.aptly.wait_task(task_id)
 
         logger.debug("repo add task with id '%s' has finished", task_id)
-        logger.debug("deleting temporary upload dir: '%s'", upload_dir)
 
+        # aptly removes the files it added from the upload dir
+        package_files = get_package_files(files)
+        failed_files = [f for f in await self.aptly.get_directory_files(upload_dir) if f in package_files]
+
+        logger.debug("deleting temporary upload dir: '%s'", upload_dir)
         await self.aptly.delete_directory(upload_dir)
+
+        if not ret:
+            logger.error("add_packages: adding files to %s failed", repo_name)
+            return False
+        if failed_files:
+            logger.error("add_packages: files not added to %s: %s", repo_name, ", ".join(failed_files))
+            return False
+
         if not await self.aptly.republish(dist, repo_name, self.publish_name):
             return False
         return True
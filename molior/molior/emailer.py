@@ -20,7 +20,8 @@ def send_mail(receiver, subject, text, files):
         receiver (str): The receiver email address.
         subject (str): The email's subject.
         text (str): The email's content.
-        files (list): List of files/attachements.
+        files (list): List of files/attachements, file names
+                      or tuples of (name, content).
     """
     email_cfg = Configuration().email_notifications
     if not email_cfg or not email_cfg.get("sender") or not email_cfg.get("server"):
@@ -40,12 +41,17 @@ def send_mail(receiver, subject, text, files):
 
     if files:
         for attachement in files:
+            if isinstance(attachement, tuple):
+                name, content = attachement
+            else:
+                name = attachement
+                content = open(attachement, "rb").read()
             part = MIMEBase("text", "plain")
-            part.set_payload(open(attachement, "rb").read())
+            part.set_payload(content)
             encode_base64(part)
             part.add_header(
                 "Content-Disposition",
-                'attachment; filename="%s"' % os.path.basename(attachement),
+                'attachment; filename="%s"' % os.path.basename(name),
             )
             msg.attach(part)
 
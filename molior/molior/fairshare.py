@@ -0,0 +1,154 @@
+import json
+import math
+
+from ..app import logger
+from ..model.database import Session
+from .configuration import Configuration
+from .taskqueue import PersistentQueue
+
+PENDING_QUERY = """
+SELECT tag, min(priority - EXTRACT(EPOCH FROM now() - createdstamp) / :aging), count(*) FROM task
+WHERE queue = :queue AND (not_before IS NULL OR not_before <= now()) GROUP BY tag
+"""
+
+CLAIM_TAG_QUERY = """
+DELETE FROM task WHERE id = (
+    SELECT id FROM task WHERE queue = :queue AND tag IS NOT DISTINCT FROM :tag
+    AND (not_before IS NULL OR not_before <= now())
+    ORDER BY priority - EXTRACT(EPOCH FROM now() - createdstamp) / :aging, id FOR UPDATE SKIP LOCKED LIMIT 1
+) RETURNING payload
+"""
+
+BACKLOG_QUERY = "SELECT tag, count(*) FROM task WHERE queue = :queue GROUP BY tag"
+
+
+def get_share_group(project_name, project_version):
+    """
+    Returns the fair share group of a build, the project
+    or the projectversion depending on the configuration.
+    """
+    if Configuration().fair_share.get("group") == "projectversion":
+        return "{}/{}".format(project_name, project_version)
+    return project_name
+
+
+class FairShare:
+    """
+    Weighted fair sharing of the build nodes between projects.
+
+    Uses start-time fair queuing: every dispatched build advances the
+    virtual time of its group by 1/weight, and the pending group with
+    the lowest virtual time is served next. Groups becoming busy again
+    start at the current virtual time, so idle time is not saved up.
+    """
+
+    def __init__(self):
+        self.virtual = {}
+        self.clock = 0
+        self.running = {}  # build_id: (queue name, group)
+
+    def get_weight(self, group):
+        weights = Configuration().fair_share.get("weights")
+        weight = None
+        if weights and type(weights) is dict:
+            weight = weights.get(group)
+        if type(weight) not in [int, float] or weight <= 0:
+            weight = 1
+        return weight
+
+    def start_time(self, group):
+        return max(self.virtual.get(group, 0), self.clock)
+
+    def select(self, groups):
+        """
+        Returns the group to serve next.
+
+        Args:
+            groups (list): The groups with pending builds.
+        """
+        return min(groups, key=lambda group: (self.start_time(group), group or ""))
+
+    def dispatched(self, queue, group, build_id):
+        start = self.start_time(group)
+        self.clock = start
+        self.virtual[group] = start + 1.0 / self.get_weight(group)
+        if build_id:
+            self.running[build_id] = (queue, group)
+
+    def finished(self, build_id):
+        self.running.pop(build_id, None)
+
+    def status(self, queues):
+        """
+        Returns the current shares and backlog per group.
+
+        Args:
+            queues (dict): The build task queues per arch.
+        """
+        result = {}
+        for arch, queue in queues.items():
+            groups = {}
+
+            def get_group(group):
+                if group not in groups:
+                    groups[group] = {"group": group or "", "weight": self.get_weight(group),
+                                     "running": 0, "backlog": 0}
+                return groups[group]
+
+            with Session() as session:
+                rows = session.execute(BACKLOG_QUERY, {"queue": queue.name}).fetchall()
+            for group, count in rows:
+                get_group(group)["backlog"] = count
+
+            for queue_name, group in self.running.values():
+                if queue_name == queue.name:
+                    get_group(group)["running"] += 1
+
+            total_running = sum([g["running"] for g in groups.values()])
+            total_weight = sum([g["weight"] for g in groups.values()])
+            for g in groups.values():
+                g["share"] = g["running"] / total_running if total_running else 0
+                g["target_share"] = g["weight"] / total_weight if total_weight else 0
+
+            result[arch] = sorted(groups.values(), key=lambda g: g["group"])
+        return result
+
+
+fair_share = FairShare()
+
+
+class FairShareQueue(PersistentQueue):
+    """
+    Prioritized build task queue sharing the build
+    nodes between the tagged groups by weight.
+
+    The best priority class (including aging) wins first,
+    groups within the same class are served fairly.
+    """
+
+    def __init__(self, name, aging):
+        super().__init__(name, aging=aging)
+
+    def claim(self):
+        with Session() as session:
+            rows = session.execute(PENDING_QUERY, {"queue": self.name, "aging": self.aging}).fetchall()
+        pending = {}
+        for group, priority, _ in rows:
+            pending[group] = math.floor(priority)
+
+        while pending:
+            best = min(pending.values())
+            group = fair_share.select([g for g in pending if pending[g] == best])
+            with Session() as session:
+                row = session.execute(CLAIM_TAG_QUERY, {"queue": self.name, "tag": group, "aging": self.aging}).first()
+                session.commit()
+            if not row:
+                # claimed by someone else meanwhile
+                del pending[group]
+                continue
+
+            task = json.loads(row[0])
+            logger.debug("fairshare: %s: serving %s", self.name, group)
+            fair_share.dispatched(self.name, group, task.get("build_id"))
+            return task
+        return None
@@ -0,0 +1,51 @@
+import asyncio
+
+from contextlib import asynccontextmanager
+
+
+class ResourceLocks:
+    """
+    Named asyncio locks, created on demand and
+    dropped again when nobody holds or waits for them.
+    """
+
+    def __init__(self):
+        self.locks = {}
+        self.users = {}
+
+    def locked(self, name):
+        lock = self.locks.get(name)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def hold(self, *names):
+        """
+        Acquires the locks for all given names.
+
+        The locks are acquired in sorted order, so tasks
+        holding several locks cannot deadlock each other.
+
+        Args:
+            names: The names of the resources, e.g. "repo_42".
+        """
+        names = sorted(set([name for name in names if name is not None]))
+        for name in names:
+            if name not in self.locks:
+                self.locks[name] = asyncio.Lock()
+                self.users[name] = 0
+            self.users[name] += 1
+
+        acquired = []
+        try:
+            for name in names:
+                await self.locks[name].acquire()
+                acquired.append(name)
+            yield
+        finally:
+            for name in reversed(acquired):
+                self.locks[name].release()
+            for name in names:
+                self.users[name] -= 1
+                if self.users[name] == 0:
+                    del self.users[name]
+                    del self.locks[name]
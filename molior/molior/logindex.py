@@ -0,0 +1,143 @@
+import re
+import json
+
+from pathlib import Path
+
+# entry types
+ERROR = "error"
+WARNING = "warning"
+SECTION = "section"   # molior log titles
+PHASE = "phase"       # sbuild phase headers
+ENTRY_TYPES = [ERROR, WARNING, SECTION, PHASE]
+
+# lines longer than this are indexed by their start
+MAX_LINE = 1024
+MAX_TEXT = 200
+# errors and warnings indexed per build, sections and phases are always indexed
+MAX_INDEX_ENTRIES = 10000
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+BORDER = re.compile(r"^\+[-=+]{20,}\+$")
+MOLIOR_TITLE = re.compile(r"^molior: (.*?)\s+\w{3}, \d{1,2} \w{3} \d{4} \d{2}:\d{2}:\d{2} [+-]\d{4}$")
+LINE_PATTERNS = [
+    (ERROR, re.compile(r"^(E|Error): ")),
+    (ERROR, re.compile(r"^dpkg(-[a-z]+)?: error")),
+    (ERROR, re.compile(r"^Status: (failed|attempted|given-back)")),
+    (ERROR, re.compile(r"^Lintian: (error|fail)")),
+    (WARNING, re.compile(r"^W: ")),
+    (WARNING, re.compile(r"^dpkg(-[a-z]+)?: warning")),
+]
+
+
+def get_index_file_path(log_path):
+    return str(log_path) + ".index"
+
+
+class LogIndex:
+    """
+    Indexes the notable lines of a build log while it is written.
+
+    Entries are dicts with the byte offset of the line in the log,
+    the entry type and the line text without terminal colors.
+    """
+
+    def __init__(self, offset=0):
+        self.offset = offset       # offset of the next byte of the log
+        self.line_start = offset   # offset of the current line
+        self.partial = b""         # start of the current line
+        self.previous = ""         # text of the previous line
+        self.count = 0             # indexed errors and warnings
+
+    def scan(self, data):
+        """
+        Returns the entries of the complete lines in a written chunk.
+
+        Args:
+            data (bytes): The chunk appended to the log.
+        """
+        entries = []
+        pieces = data.split(b"\n")
+        for piece in pieces[:-1]:
+            self.add(entries, self.partial + piece[:MAX_LINE])
+            self.offset += len(piece) + 1
+            self.line_start = self.offset
+            self.partial = b""
+        self.partial = (self.partial + pieces[-1][:MAX_LINE])[:MAX_LINE]
+        self.offset += len(pieces[-1])
+        return entries
+
+    def finish(self):
+        """
+        Returns the entries of an unterminated last line.
+        """
+        entries = []
+        if self.partial:
+            self.add(entries, self.partial)
+            self.partial = b""
+            self.line_start = self.offset
+        return entries
+
+    def add(self, entries, line):
+        text = ANSI_ESCAPE.sub("", line[:MAX_LINE].decode("utf-8", errors="ignore"))
+        text = text.split("\r")[-1].strip()
+        previous = self.previous
+        self.previous = text
+
+        if text.startswith("|") and text.endswith("|") and len(text) > 1 and BORDER.match(previous):
+            title = text[1:-1].strip()
+            match = MOLIOR_TITLE.match(title)
+            if match:
+                entries.append(self.entry(SECTION, match.group(1)))
+            elif title.startswith("molior: "):
+                entries.append(self.entry(SECTION, title[len("molior: "):]))
+            elif title:
+                entries.append(self.entry(PHASE, title))
+            return
+
+        if self.count >= MAX_INDEX_ENTRIES:
+            return
+        for entry_type, pattern in LINE_PATTERNS:
+            if pattern.match(text):
+                self.count += 1
+                entries.append(self.entry(entry_type, text))
+                return
+
+    def entry(self, entry_type, text):
+        return {"offset": self.line_start, "type": entry_type, "text": text[:MAX_TEXT]}
+
+
+def append_log_index(log_path, entries):
+    """
+    Appends entries to the index file of a build log.
+    """
+    with open(get_index_file_path(log_path), "a") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+def remove_log_index(log_path):
+    Path(get_index_file_path(log_path)).unlink(missing_ok=True)
+
+
+def read_log_index(log_path, entry_types=None):
+    """
+    Returns the entries of the index of a build log.
+
+    Args:
+        log_path (str): The uncompressed log file.
+        entry_types (list): The entry types to return, all if None.
+    """
+    entries = []
+    try:
+        f = open(get_index_file_path(log_path), "r")
+    except FileNotFoundError:
+        return entries
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # line being written
+            if entry_types is None or entry.get("type") in entry_types:
+                entries.append(entry)
+    return entries
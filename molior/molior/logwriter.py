@@ -0,0 +1,624 @@
+import asyncio
+import gzip
+import shutil
+
+from collections import OrderedDict, deque
+from pathlib import Path
+from aiofile import AIOFile, Reader, Writer
+
+from ..app import logger
+from .configuration import Configuration
+from .logindex import LogIndex, append_log_index, remove_log_index
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# suffixes of the compressed build logs, by content encoding
+COMPRESSED_SUFFIXES = OrderedDict([("gzip", ".gz"), ("zstd", ".zst")])
+
+
+def get_log_file_path(build_id):
+    buildout_path = Path(Configuration().working_dir) / "buildout"
+    dir_path = buildout_path / str(build_id)
+    if not dir_path.is_dir():
+        try:
+            dir_path.mkdir(parents=True)
+        except Exception:
+            return None
+    full_path = dir_path / "build.log"
+    return str(full_path)
+
+
+def get_buildlog_compression():
+    """
+    Returns the encoding for compressing completed build logs
+    configured in buildlog.compress, or None to keep them uncompressed.
+    """
+    encoding = Configuration().buildlog.get("compress", "gzip")
+    if not encoding or encoding == "none":
+        return None
+    if encoding not in COMPRESSED_SUFFIXES:
+        logger.error("buildlog: unknown compression '%s', using gzip", encoding)
+        return "gzip"
+    if encoding == "zstd" and not zstandard:
+        logger.warning("buildlog: zstandard module not available, using gzip")
+        return "gzip"
+    return encoding
+
+
+def find_log_file(path):
+    """
+    Returns the file of a build log and its content encoding,
+    None for uncompressed logs, or (None, None) if there is no log.
+
+    Args:
+        path (str): The uncompressed log file.
+    """
+    path = Path(path)
+    # prefer the uncompressed log, it is removed after compressing
+    if path.is_file():
+        return path, None
+    for encoding, suffix in COMPRESSED_SUFFIXES.items():
+        filename = path.with_name(path.name + suffix)
+        if filename.is_file():
+            return filename, encoding
+    return None, None
+
+
+def open_log_file(filename, encoding):
+    """
+    Opens a build log for reading the uncompressed bytes.
+    """
+    if encoding == "gzip":
+        return gzip.open(str(filename), "rb")
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(open(str(filename), "rb"), closefd=True)
+    return open(str(filename), "rb")
+
+
+def get_size_file_path(log_path):
+    return str(log_path) + ".size"
+
+
+def read_log_size(log_path):
+    """
+    Returns the uncompressed size of a build log stored
+    when compressing it, or None if it was not stored.
+
+    Args:
+        log_path (str): The uncompressed log file.
+    """
+    try:
+        with open(get_size_file_path(log_path), "r") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def get_log_size(filename, encoding):
+    """
+    Returns the uncompressed size of a build log.
+    """
+    if encoding is None:
+        return Path(filename).stat().st_size
+    filename = Path(filename)
+    size = read_log_size(filename.with_name(filename.name[:-len(COMPRESSED_SUFFIXES[encoding])]))
+    if size is not None:
+        return size
+    size = 0
+    with open_log_file(filename, encoding) as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                return size
+            size += len(data)
+
+
+def compress_log(path, encoding):
+    """
+    Replaces a build log by its compressed file, the
+    uncompressed size is stored next to it.
+
+    Args:
+        path (str): The uncompressed log file.
+        encoding (str): gzip or zstd.
+
+    Returns:
+        Path: The compressed file, or None if there is no uncompressed log.
+    """
+    path = Path(path)
+    if not path.is_file():
+        return None
+    filename = path.with_name(path.name + COMPRESSED_SUFFIXES[encoding])
+    tmp = filename.with_name(filename.name + ".tmp")
+    with open(str(path), "rb") as src:
+        if encoding == "zstd":
+            dst = zstandard.ZstdCompressor().stream_writer(open(str(tmp), "wb"), size=path.stat().st_size)
+        else:
+            dst = gzip.open(str(tmp), "wb")
+        with dst:
+            shutil.copyfileobj(src, dst)
+        size = src.tell()
+    with open(get_size_file_path(path), "w") as f:
+        f.write(str(size))
+    tmp.replace(filename)
+    path.unlink()
+    return filename
+
+
+def decompress_log(path):
+    """
+    Replaces a compressed build log by the uncompressed file,
+    so it can be appended to.
+
+    Args:
+        path (str): The uncompressed log file.
+    """
+    path = Path(path)
+    filename, encoding = find_log_file(path)
+    if not encoding:
+        return
+    tmp = path.with_name(path.name + ".tmp")
+    with open_log_file(filename, encoding) as src, open(str(tmp), "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    tmp.replace(path)
+    filename.unlink()
+    Path(get_size_file_path(path)).unlink(missing_ok=True)
+
+
+async def read_log(path, offset=0, chunk_size=65536):
+    """
+    Yields the uncompressed chunks of a build log from a byte offset.
+
+    Args:
+        path (str): The uncompressed log file.
+        offset (int): The byte offset.
+
+    Raises:
+        FileNotFoundError: If there is no log.
+    """
+    filename, encoding = find_log_file(path)
+    if not filename:
+        raise FileNotFoundError(str(path))
+
+    if encoding is None:
+        async with AIOFile(str(filename), "rb") as afp:
+            async for data in Reader(afp, offset=offset, chunk_size=chunk_size):
+                yield data
+        return
+
+    loop = asyncio.get_event_loop()
+    f = await loop.run_in_executor(None, open_log_file, filename, encoding)
+    try:
+        if offset:
+            await loop.run_in_executor(None, f.seek, offset)
+        while True:
+            data = await loop.run_in_executor(None, f.read, chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        f.close()
+
+
+def find_line_offset(f, lines):
+    # offsets of the lines following the last newlines
+    offsets = deque(maxlen=lines + 1)
+    position = 0
+    last = b""
+    while True:
+        data = f.read(1024 * 1024)
+        if not data:
+            break
+        index = data.find(b"\n")
+        while index >= 0:
+            offsets.append(position + index + 1)
+            index = data.find(b"\n", index + 1)
+        position += len(data)
+        last = data[-1:]
+    if last == b"\n":
+        offsets.pop()  # the final newline does not start a line
+    if len(offsets) < lines:
+        return 0
+    return offsets[-lines]
+
+
+async def find_tail_offset(path, lines, block_size=65536):
+    """
+    Returns the byte offset of the last lines of a log file.
+
+    Args:
+        path (str): The uncompressed log file.
+        lines (int): The number of lines.
+    """
+    filename, encoding = find_log_file(path)
+    if not filename:
+        raise FileNotFoundError(str(path))
+    loop = asyncio.get_event_loop()
+    if lines <= 0:
+        return await loop.run_in_executor(None, get_log_size, filename, encoding)
+    if encoding:
+        def find():
+            with open_log_file(filename, encoding) as f:
+                return find_line_offset(f, lines)
+        return await loop.run_in_executor(None, find)
+
+    path = str(filename)
+    async with AIOFile(path, "rb") as afp:
+        end = Path(path).stat().st_size
+        position = end
+        newlines = 0
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            data = await afp.read(size, position)
+            if position + size == end and data.endswith(b"\n"):
+                data = data[:-1]  # the final newline does not start a line
+            index = len(data)
+            while True:
+                index = data.rfind(b"\n", 0, index)
+                if index < 0:
+                    break
+                newlines += 1
+                if newlines == lines:
+                    return position + index + 1
+    return 0
+
+
+def get_buildlog_setting(name, default):
+    value = Configuration().buildlog.get(name)
+    if type(value) not in [int, float] or value < 0:
+        value = default
+    return value
+
+
+def is_buildlog_end(msg):
+    # None signals the end of the node logs, False the end of the build log
+    return msg is None or msg is False
+
+
+class LogSubscription:
+    """
+    Receives the chunks written to a build log.
+
+    get() returns tuples of (offset, data) with the byte offset
+    of the data in the log file, or None when the log is done.
+    """
+
+    def __init__(self, writer, build_id):
+        self.writer = writer
+        self.build_id = build_id
+        self.queue = asyncio.Queue()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.writer.unsubscribe(self)
+        self.queue.put_nowait(None)
+
+
+class BuildLogBuffer:
+    """
+    Messages of a build log waiting to be written.
+    """
+
+    def __init__(self):
+        self.msgs = []
+        self.size = 0
+        self.space = asyncio.Event()
+        self.space.set()
+
+
+class BuildLogFile:
+    """
+    An open build log file.
+    """
+
+    def __init__(self, afp, path):
+        self.afp = afp
+        self.path = path
+        self.writer = Writer(afp)
+        self.synced = True
+        self.last_sync = asyncio.get_event_loop().time()
+
+    async def sync(self):
+        if not self.synced:
+            await self.afp.fsync()
+            self.synced = True
+        self.last_sync = asyncio.get_event_loop().time()
+
+
+class LogWriter:
+    """
+    Writes the build logs of all builds in a single task.
+
+    Messages are buffered per build up to buildlog.max_buffer KiB,
+    further messages wait until the buffer was written. The buffered
+    messages of a build are written together, and the builds with
+    pending messages take turns.
+
+    At most buildlog.max_open_files log files are kept open, the least
+    recently written one is closed first. Files are synced at most every
+    buildlog.flush_interval milliseconds, and always at the end of the
+    node logs and of the build log.
+
+    Written chunks are published to the subscribers of the build log,
+    followed by None once the log of a finished build is done.
+
+    Notable lines are indexed while written, see LogIndex. Done logs
+    are compressed as configured in buildlog.compress, and decompressed
+    again when a rebuild appends to them.
+    """
+
+    def __init__(self, logging_done):
+        """
+        Args:
+            logging_done (coroutine function): Called with the build id
+                after the node logs were written.
+        """
+        self.logging_done = logging_done
+        self.buffers = {}             # build_id: BuildLogBuffer
+        self.pending = OrderedDict()  # build ids with buffered messages, oldest first
+        self.files = OrderedDict()    # build_id: BuildLogFile, least recently used first
+        self.offsets = {}             # build_id: size of the open log file
+        self.subscribers = {}         # build_id: list of LogSubscription
+        self.finished = set()         # finished builds still writing their log
+        self.compressing = {}         # build_id: future compressing the log
+        self.indexes = {}             # build_id: LogIndex of the log being written
+        self.event = None
+        self.task = None
+        self.max_buffer = 1024 * 1024
+        self.max_open_files = 256
+        self.flush_interval = 1.0
+        self.compression = None
+
+    def start(self):
+        if self.task and not self.task.done():
+            return
+        self.max_buffer = get_buildlog_setting("max_buffer", 1024) * 1024
+        self.max_open_files = max(1, get_buildlog_setting("max_open_files", 256))
+        self.flush_interval = get_buildlog_setting("flush_interval", 1000) / 1000.0
+        self.compression = get_buildlog_compression()
+        self.event = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def put(self, build_id, msg):
+        """
+        Adds a message to a build log, waiting while the buffer of the build is full.
+
+        Args:
+            build_id (int): The build id.
+            msg (str): The message, None for the end of the
+                       node logs, False for the end of the log.
+        """
+        self.start()
+        while True:
+            if build_id not in self.buffers:
+                self.buffers[build_id] = BuildLogBuffer()
+            buf = self.buffers[build_id]
+            if is_buildlog_end(msg) or buf.size < self.max_buffer:
+                break
+            buf.space.clear()
+            await buf.space.wait()
+
+        buf.msgs.append(msg)
+        if not is_buildlog_end(msg):
+            buf.size += len(msg)
+        self.pending[build_id] = True
+        self.event.set()
+
+    def subscribe(self, build_id):
+        subscription = LogSubscription(self, build_id)
+        self.subscribers.setdefault(build_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscribers.get(subscription.build_id, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self.subscribers[subscription.build_id]
+
+    def publish(self, build_id, item):
+        for subscription in self.subscribers.get(build_id, []):
+            subscription.queue.put_nowait(item)
+        if item is None:
+            # the log is done
+            self.subscribers.pop(build_id, None)
+
+    def is_active(self, build_id):
+        return build_id in self.buffers or build_id in self.files
+
+    def set_finished(self, build_id, finished):
+        """
+        Marks a build as finished, the subscribers of the log
+        are done once the end of the log was written.
+        """
+        if not finished:
+            self.finished.discard(build_id)
+        elif self.is_active(build_id):
+            self.finished.add(build_id)
+        else:
+            self.indexes.pop(build_id, None)
+            self.publish(build_id, None)
+
+    async def run(self):
+        while True:
+            self.event.clear()
+            if not self.pending:
+                try:
+                    await asyncio.wait_for(self.event.wait(), self.next_sync())
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                build_id, _ = self.pending.popitem(last=False)
+                try:
+                    await self.write(build_id)
+                except Exception as exc:
+                    logger.exception(exc)
+            await self.sync_due()
+
+    async def write(self, build_id):
+        buf = self.buffers.get(build_id)
+        if not buf:
+            return
+        msgs = buf.msgs
+        buf.msgs = []
+        buf.size = 0
+        buf.space.set()
+
+        chunk = []
+        for msg in msgs:
+            if not is_buildlog_end(msg):
+                chunk.append(msg)
+                continue
+            if chunk:
+                await self.write_file(build_id, "".join(chunk))
+                chunk = []
+            if msg is None:
+                logfile = self.files.get(build_id)
+                if logfile:
+                    await logfile.sync()
+                await self.logging_done(build_id)
+            else:
+                await self.close(build_id, done=True)
+        if chunk:
+            await self.write_file(build_id, "".join(chunk))
+
+        if not buf.msgs and self.buffers.get(build_id) is buf:
+            del self.buffers[build_id]
+
+    async def write_file(self, build_id, data):
+        try:
+            logfile = await self.open(build_id)
+            if not logfile:
+                return
+            await logfile.writer(data)
+            logfile.synced = False
+            data = data.encode("utf-8")
+            self.publish(build_id, (self.offsets[build_id], data))
+            self.offsets[build_id] += len(data)
+            entries = self.indexes[build_id].scan(data)
+            if entries:
+                await self.write_index(logfile.path, entries)
+        except Exception as exc:
+            logger.error("buildlog: error writing log of build %s", str(build_id))
+            logger.exception(exc)
+            await self.close(build_id)
+
+    async def open(self, build_id):
+        logfile = self.files.get(build_id)
+        if logfile:
+            self.files.move_to_end(build_id)
+            return logfile
+
+        filename = get_log_file_path(build_id)
+        if not filename:
+            logger.error("buildlog: cannot get path for build %s", str(build_id))
+            return None
+        while len(self.files) >= self.max_open_files:
+            await self.close(next(iter(self.files)))
+        loop = asyncio.get_event_loop()
+        compressing = self.compressing.get(build_id)
+        if compressing:
+            await asyncio.wait([compressing])
+        await loop.run_in_executor(None, decompress_log, filename)
+        afp = AIOFile(filename, "a")
+        await afp.open()
+        logfile = BuildLogFile(afp, filename)
+        self.files[build_id] = logfile
+        try:
+            self.offsets[build_id] = Path(filename).stat().st_size
+        except OSError:
+            self.offsets[build_id] = 0
+        index = self.indexes.get(build_id)
+        if not index or index.offset != self.offsets[build_id]:
+            if self.offsets[build_id] == 0:
+                await loop.run_in_executor(None, remove_log_index, filename)
+            self.indexes[build_id] = LogIndex(self.offsets[build_id])
+        return logfile
+
+    async def close(self, build_id, done=False):
+        """
+        Closes a log file, done logs are compressed.
+        """
+        logfile = self.files.pop(build_id, None)
+        if not logfile and not done:
+            return
+        if logfile:
+            self.offsets.pop(build_id, None)
+            try:
+                await logfile.sync()
+                await logfile.afp.close()
+            except Exception as exc:
+                logger.exception(exc)
+        if done:
+            await self.done(build_id, logfile.path if logfile else get_log_file_path(build_id))
+
+    async def done(self, build_id, path):
+        index = self.indexes.pop(build_id, None)
+        if index and path:
+            entries = index.finish()
+            if entries:
+                await self.write_index(path, entries)
+        if self.compression and path:
+            self.compress(build_id, path, self.compression)
+        if build_id in self.finished:
+            self.finished.discard(build_id)
+            self.publish(build_id, None)
+
+    async def write_index(self, path, entries):
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, append_log_index, path, entries)
+        except Exception as exc:
+            logger.error("buildlog: error writing index of %s", path)
+            logger.exception(exc)
+
+    def compress(self, build_id, path, encoding):
+        def compressed(future):
+            if self.compressing.get(build_id) is future:
+                del self.compressing[build_id]
+            if not future.cancelled() and future.exception():
+                logger.error("buildlog: error compressing log of build %s", str(build_id))
+                logger.exception(future.exception())
+
+        future = asyncio.get_event_loop().run_in_executor(None, compress_log, path, encoding)
+        self.compressing[build_id] = future
+        future.add_done_callback(compressed)
+
+    def next_sync(self):
+        """
+        Returns the seconds until the next file has to
+        be synced, or None if all files are synced.
+        """
+        now = asyncio.get_event_loop().time()
+        deadlines = [f.last_sync + self.flush_interval - now for f in self.files.values() if not f.synced]
+        if not deadlines:
+            return None
+        return max(min(deadlines), 0)
+
+    async def sync_due(self):
+        now = asyncio.get_event_loop().time()
+        for logfile in list(self.files.values()):
+            if not logfile.synced and now - logfile.last_sync >= self.flush_interval:
+                try:
+                    await logfile.sync()
+                except Exception as exc:
+                    logger.exception(exc)
+
+    def status(self):
+        """
+        Returns the open files and the buffered bytes per build.
+        """
+        builds = [{"build_id": build_id, "buffered_bytes": buf.size, "messages": len(buf.msgs)}
+                  for build_id, buf in self.buffers.items() if buf.msgs]
+        builds.sort(key=lambda b: b["buffered_bytes"], reverse=True)
+        return {"open_files": len(self.files),
+                "max_open_files": self.max_open_files,
+                "buffered_bytes": sum([b["buffered_bytes"] for b in builds]),
+                "max_buffer_bytes": self.max_buffer,
+                "compressing": len(self.compressing),
+                "builds": builds}
@@ -8,6 +8,7 @@ from enum import Enum
 from ..app import logger
 from .emailer import send_mail
 from .configuration import Configuration
+from .logwriter import find_log_file, open_log_file
 from .queues import enqueue_notification
 
 
@@ -97,7 +98,8 @@ def send_mail_notification(build):
 
     buildout_path = Path(cfg.working_dir) / "buildout"
     log_file = buildout_path / str(build.id) / "build.log"
-    if not log_file.exists():
+    log_filename, log_encoding = find_log_file(log_file)
+    if not log_filename:
         logger.warning(
             "not sending notification: buildlog file '%s' does not exist!",
             str(log_file),
@@ -139,11 +141,20 @@ def send_mail_notification(build):
         arch=arch,
         build_log_link=link,
     )
-    send_mail(receiver, subject, content, [str(log_file)])
+    with open_log_file(log_filename, log_encoding) as f:
+        log = f.read()
+    send_mail(receiver, subject, content, [(log_file.name, log)])
 
 
-async def notify(subject, event, data):
-    await enqueue_notification({"notify": {"subject": subject, "event": event, "data": data}})
+async def notify(subject, event, data, topics=None, opt_in=False):
+    """
+    Notifies the websocket clients subscribed to the subject,
+    the entity (data["id"]) or to one of the given topics.
+    Opt-in notifications are sent only to clients subscribed
+    to one of the given topics.
+    """
+    await enqueue_notification({"notify": {"subject": subject, "event": event, "data": data},
+                                "topics": topics, "opt_in": opt_in})
 
 
 async def run_hooks(build_id):
@@ -1,25 +1,36 @@
 import asyncio
+import json
 
 from datetime import datetime
-from aiofile import AIOFile, Writer
-from pathlib import Path
 from concurrent.futures._base import CancelledError
 
-from ..app import logger
 from ..tools import get_local_tz
+from ..model.database import Session
+from ..model.task import Task
 from ..molior.configuration import Configuration
+from .taskqueue import PersistentQueue, wakeup_tasks  # noqa: F401
+from .fairshare import FairShareQueue
+from .logwriter import LogWriter
 
 # worker queues
-task_queue = asyncio.Queue()
-aptly_queue = asyncio.Queue()
+task_queue = PersistentQueue("task")
+aptly_queue = PersistentQueue("aptly")
 notification_queue = asyncio.Queue()
-backend_queue = asyncio.Queue()
+backend_queue = PersistentQueue("backend")
 
-# build log queues
-buildlogs = {}
+# build priority classes, lower values are built first
+BUILD_PRIORITIES = {"release": 0, "rebuild": 1, "ci": 2}
 
-# buildtask queues
-buildtasks = {"amd64": asyncio.Queue(), "arm64": asyncio.Queue()}
+
+def get_build_priority_aging():
+    aging = Configuration().build_priorities.get("aging")
+    if type(aging) is not int or aging < 1:
+        aging = 600
+    return aging
+
+
+# buildtask queues per node pool arch, see get_buildtask_queue()
+buildtasks = {}
 
 
 async def enqueue(queue, item):
@@ -36,6 +47,25 @@ async def dequeue(queue):
     return ret
 
 
+async def park(queue, task, resource):
+    """
+    Requeues a task which has to wait for a resource.
+
+    The task is dequeued again when wakeup_tasks() is called
+    for the resource, or at the latest after the retry timeout.
+
+    Args:
+        queue (PersistentQueue): The queue of the task.
+        task (dict): The task.
+        resource (str): The resource key, e.g. "repo_42".
+    """
+    cfg = Configuration()
+    timeout = cfg.task_retry_timeout
+    if not timeout:
+        timeout = 60
+    await queue.put(task, resource=resource, delay=timeout)
+
+
 async def enqueue_task(task):
     await task_queue.put(task)
 
@@ -44,6 +74,10 @@ async def dequeue_task():
     return await dequeue(task_queue)
 
 
+async def park_task(task, resource):
+    await park(task_queue, task, resource)
+
+
 async def enqueue_aptly(task):
     await aptly_queue.put(task)
 
@@ -52,6 +86,10 @@ async def dequeue_aptly():
     return await dequeue(aptly_queue)
 
 
+async def park_aptly(task, resource):
+    await park(aptly_queue, task, resource)
+
+
 async def enqueue_notification(msg):
     await notification_queue.put(msg)
 
@@ -68,47 +106,27 @@ async def dequeue_backend():
     return await dequeue(backend_queue)
 
 
-def get_log_file_path(build_id):
-    buildout_path = Path(Configuration().working_dir) / "buildout"
-    dir_path = buildout_path / str(build_id)
-    if not dir_path.is_dir():
-        try:
-            dir_path.mkdir(parents=True)
-        except Exception:
-            return None
-    full_path = dir_path / "build.log"
-    return str(full_path)
-
-
-async def buildlog_writer(build_id):
-    filename = get_log_file_path(build_id)
-    if not filename:
-        logger.error("buildlog_writer: cannot get path for build %s", str(build_id))
-        del buildlogs[build_id]
-        return
-    try:
-        async with AIOFile(filename, 'a') as afp:
-            writer = Writer(afp)
-            while True:
-                msg = await dequeue(buildlogs[build_id])
-                if msg is None:
-                    await enqueue_backend({"logging_done": build_id})
-                    continue
-                elif msg is False:
-                    break
-                await writer(msg)
-                await afp.fsync()
-    except Exception as exc:
-        logger.exception(exc)
-
-    del buildlogs[build_id]
+def discard_backend_events():
+    """
+    Removes the node and build events left in the backend queue by
+    a previous run, only build scheduling survives a restart.
+
+    Returns:
+        int: The number of removed events.
+    """
+    return backend_queue.discard(lambda task: "schedule" not in task)
+
+
+async def logging_done(build_id):
+    await enqueue_backend({"logging_done": build_id})
+
+
+# writer for the build logs of all builds
+buildlog_writer = LogWriter(logging_done)
 
 
 async def enqueue_buildlog(build_id, msg):
-    if build_id not in buildlogs:
-        buildlogs[build_id] = asyncio.Queue()
-        asyncio.ensure_future(buildlog_writer(build_id))
-    await buildlogs[build_id].put(msg)
+    await buildlog_writer.put(build_id, msg)
 
 
 async def buildlogdone(build_id):
@@ -144,11 +162,67 @@ async def buildlogtitle(build_id, title, no_footer_newline=False, no_header_newl
     await buildlog(build_id, msg)
 
 
-async def enqueue_buildtask(arch, task):
+def get_buildtask_queue(arch):
+    """
+    Returns the build task queue of a node pool, created on demand.
+
+    Args:
+        arch (str): The node pool arch, e.g. "amd64".
+    """
     if arch not in buildtasks:
-        return
-    await enqueue(buildtasks[arch], task)
+        buildtasks[arch] = FairShareQueue("buildtask_%s" % arch, aging=get_build_priority_aging())
+    return buildtasks[arch]
+
+
+async def enqueue_buildtask(arch, task, priority="release", group=None):
+    await get_buildtask_queue(arch).put(task, priority=BUILD_PRIORITIES.get(priority, 0), tag=group)
 
 
 async def dequeue_buildtask(arch):
-    return await dequeue(buildtasks[arch])
+    return await dequeue(get_buildtask_queue(arch))
+
+
+def move_buildtasks(arch, pool):
+    """
+    Moves the pending build tasks of a node pool to another pool.
+
+    Returns:
+        int: The number of moved tasks.
+    """
+    return get_buildtask_queue(arch).move_to(get_buildtask_queue(pool))
+
+
+def get_buildtask_archs():
+    """
+    Returns the node pool archs with pending build tasks,
+    including pools which were not created yet since the start.
+    """
+    with Session() as session:
+        rows = session.query(Task.queue).filter(Task.queue.like("buildtask_%")).distinct().all()
+    return [row[0][len("buildtask_"):] for row in rows]
+
+
+def get_queued_publishes():
+    """
+    Returns the ids of deb builds with a publish
+    task in the persistent aptly queue.
+    """
+    return [task["publish"][0] for task in aptly_queue.items() if task.get("publish")]
+
+
+def get_queued_builds():
+    """
+    Returns the ids of builds waiting in the
+    persistent backend or build task queues.
+    """
+    build_ids = []
+    for task in backend_queue.items():
+        job = task.get("schedule")
+        if job:
+            build_ids.append(job[0])
+    # include pools which were not created yet since the start
+    with Session() as session:
+        rows = session.query(Task.payload).filter(Task.queue.like("buildtask_%")).all()
+    for row in rows:
+        build_ids.append(json.loads(row[0]).get("build_id"))
+    return build_ids
@@ -20,6 +20,8 @@ from .worker_backend import BackendWorker
 from .worker_notification import NotificationWorker
 from .backend import Backend
 from .queues import enqueue_aptly
+from .taskqueue import listener
+from ..aptly import aptly_connections
 
 # import api handlers
 import molior.api.build              # noqa: F401
@@ -121,10 +123,14 @@ class MoliorServer:
         await self.task_aptly_worker
         self.task_notification_worker.cancel()
         await self.task_notification_worker
+        listener.stop()
 
         logger.info("terminating backend")
         await self.backend.stop()
 
+        logger.info("terminating aptly connections")
+        await aptly_connections.close()
+
         logger.info("terminating launchy")
         await Launchy.stop()
         logger.info("terminating app")
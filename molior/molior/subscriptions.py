@@ -0,0 +1,270 @@
+import json
+import asyncio
+
+from collections import OrderedDict, deque
+
+from ..app import logger
+from .configuration import Configuration
+from .notifier import Subject, Event
+
+# topics a client can subscribe to at most
+MAX_TOPICS = 100
+
+# what to do when the send queue of a client is full
+OVERFLOW_POLICIES = ["drop_oldest", "disconnect"]
+# close code telling a client to reconnect and reload its state
+RESYNC_CLOSE_CODE = 4000
+
+
+def get_topics(subject, data):
+    """
+    Returns the default topics of a notification: the subject
+    name for all events of a subject, and the entity.
+
+    Args:
+        subject (int): The Subject value.
+        data: The notification data.
+    """
+    name = Subject(subject).name
+    topics = [name]
+    if isinstance(data, dict) and data.get("id") is not None:
+        topics.append("{}:{}".format(name, data["id"]))
+    return topics
+
+
+def get_event_key(subject, data):
+    """
+    Returns the key of the entity a notification is about,
+    or None if notifications cannot be merged.
+    """
+    if isinstance(data, dict):
+        if data.get("id") is None:
+            return None
+        return (subject, data["id"])
+    if isinstance(data, list):
+        # lists like the node list are sent completely
+        return (subject, None)
+    return None
+
+
+def get_coalesce_window():
+    window = Configuration().websocket.get("coalesce_window")
+    if type(window) not in [int, float] or window < 0:
+        window = 500
+    return window / 1000.0
+
+
+def get_websocket_setting(name, default):
+    value = Configuration().websocket.get(name)
+    if type(value) not in [int, float] or value < 0:
+        value = default
+    return value
+
+
+def get_overflow_policy():
+    policy = Configuration().websocket.get("overflow", "drop_oldest")
+    if policy not in OVERFLOW_POLICIES:
+        logger.error("websocket: unknown overflow policy '%s', using drop_oldest", policy)
+        policy = "drop_oldest"
+    return policy
+
+
+def get_username(ws):
+    try:
+        return ws.cirrina.web_session.get("username")
+    except AttributeError:
+        return None
+
+
+class WebsocketClient:
+    """
+    A websocket client with its topics and its send queue.
+
+    Messages are sent by a task per client, so a slow client only
+    delays its own messages. When the queue is full, the oldest
+    message is dropped, or the client is disconnected with
+    RESYNC_CLOSE_CODE, depending on websocket.overflow.
+    """
+
+    def __init__(self, ws, max_queue, overflow):
+        self.ws = ws
+        self.topics = None   # set of topics, None for all
+        self.queue = deque()
+        self.max_queue = max(1, max_queue)
+        self.overflow = overflow
+        self.dropped = 0
+        self.disconnected = False
+        self.ready = asyncio.Event()
+        self.task = None
+
+    def put(self, text):
+        if self.disconnected:
+            return
+        if len(self.queue) >= self.max_queue:
+            if self.overflow == "disconnect":
+                self.disconnect()
+                return
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(text)
+        self.ready.set()
+        if not self.task:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            if not self.queue:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            text = self.queue.popleft()
+            try:
+                await self.ws.send_str(text)
+            except Exception as exc:
+                logger.warning("websocket: error sending notification: %s", str(exc))
+
+    def disconnect(self):
+        logger.warning("websocket: send queue full, disconnecting client")
+        self.disconnected = True
+        self.queue.clear()
+        self.stop()
+        asyncio.ensure_future(self.ws.close(code=RESYNC_CLOSE_CODE, message=b"resync"))
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def status(self):
+        return {"queued": len(self.queue),
+                "dropped": self.dropped,
+                "topics": len(self.topics) if self.topics is not None else None,
+                "username": get_username(self.ws)}
+
+
+class EventDispatcher:
+    """
+    Sends notifications to the websocket clients subscribed to their topics.
+
+    Clients receive all notifications until they subscribe to topics,
+    e.g. "build", "build:42", "project:myproject", "projectversion:myproject/1.0",
+    "mirror:3" or "node". Opt-in notifications are sent only to clients
+    subscribed to one of their topics, e.g. the node changes sent as
+    single added, changed and removed nodes with "node:delta".
+
+    Notifications about the same entity within websocket.coalesce_window
+    milliseconds are merged, so only the latest state is sent. Every
+    notification is serialized once for all clients, and queued for
+    each client up to websocket.max_queue messages, see WebsocketClient.
+    """
+
+    def __init__(self):
+        self.clients = {}             # websocket: WebsocketClient
+        self.pending = OrderedDict()  # event key: [message, topics, opt_in]
+        self.task = None
+        self.serial = 0
+
+    def add_client(self, ws):
+        self.clients[ws] = WebsocketClient(ws, get_websocket_setting("max_queue", 1000), get_overflow_policy())
+
+    def remove_client(self, ws):
+        client = self.clients.pop(ws, None)
+        if client:
+            client.stop()
+
+    def subscribe(self, ws, topics):
+        """
+        Subscribes a client to topics, the client then receives
+        only notifications of its topics.
+        """
+        client = self.clients.get(ws)
+        if not client:
+            return False
+        subscribed = set(client.topics or [])
+        subscribed.update([str(topic) for topic in topics])
+        if len(subscribed) > MAX_TOPICS:
+            logger.error("websocket: client subscribed to more than %d topics", MAX_TOPICS)
+            return False
+        client.topics = subscribed
+        return True
+
+    def unsubscribe(self, ws, topics):
+        client = self.clients.get(ws)
+        if client and client.topics:
+            client.topics.difference_update([str(topic) for topic in topics])
+
+    def dispatch(self, subject, event, data, topics=None, opt_in=False):
+        """
+        Queues a notification, merging it with a queued
+        notification about the same entity.
+
+        Args:
+            subject (int): The Subject value.
+            event (int): The Event value.
+            data: The notification data.
+            topics (list): The topics, by default the subject and entity.
+            opt_in (bool): Send only to clients subscribed to the given topics.
+        """
+        if opt_in:
+            topics = set(topics or [])
+        else:
+            topics = set(topics or []) | set(get_topics(subject, data))
+        key = get_event_key(subject, data)
+        if key is None:
+            self.serial += 1
+            key = self.serial
+        elif opt_in:
+            # not merged with the notifications for all clients
+            key += ("opt_in",)
+
+        pending = self.pending.get(key)
+        if not pending:
+            self.pending[key] = [{"subject": subject, "event": event, "data": data}, topics, opt_in]
+        else:
+            message = pending[0]
+            if event == Event.removed.value or message["event"] == Event.removed.value:
+                message["event"] = event
+                message["data"] = data
+            elif isinstance(data, dict) and isinstance(message["data"], dict):
+                # changes of an added entity are still sent as added
+                message["data"] = dict(message["data"], **data)
+            else:
+                message["data"] = data
+            pending[1] |= topics
+
+        if not self.task or self.task.done():
+            self.task = asyncio.ensure_future(self.send_later())
+
+    async def send_later(self):
+        while self.pending:
+            await asyncio.sleep(get_coalesce_window())
+            pending = self.pending
+            self.pending = OrderedDict()
+            for message, topics, opt_in in pending.values():
+                self.send(message, topics, opt_in)
+
+    def send(self, message, topics, opt_in=False):
+        text = None
+        for client in list(self.clients.values()):
+            if client.topics is None:
+                if opt_in:
+                    continue
+            elif not client.topics & topics:
+                continue
+            if text is None:
+                text = json.dumps(message)
+            client.put(text)
+
+    def status(self):
+        """
+        Returns the send queue of each client.
+        """
+        clients = [client.status() for client in self.clients.values()]
+        clients.sort(key=lambda c: c["queued"], reverse=True)
+        return {"clients": len(clients),
+                "queued": sum([c["queued"] for c in clients]),
+                "dropped": sum([c["dropped"] for c in clients]),
+                "pending": len(self.pending),
+                "results": clients}
+
+
+event_dispatcher = EventDispatcher()
@@ -0,0 +1,296 @@
+import asyncio
+import json
+
+from datetime import datetime, timedelta, timezone
+
+from ..app import logger
+from ..model.database import Session, database, commit_hooks
+from ..model.task import Task
+
+NOTIFY_CHANNEL = "molior_task"
+
+CLAIM_QUERY = """
+DELETE FROM task WHERE id = (
+    SELECT id FROM task WHERE queue = :queue AND (not_before IS NULL OR not_before <= now())
+    ORDER BY id FOR UPDATE SKIP LOCKED LIMIT 1
+) RETURNING payload
+"""
+
+# lower priority values first, waiting tasks move up one priority every <aging> seconds
+CLAIM_PRIORITY_QUERY = """
+DELETE FROM task WHERE id = (
+    SELECT id FROM task WHERE queue = :queue AND (not_before IS NULL OR not_before <= now())
+    ORDER BY priority - EXTRACT(EPOCH FROM now() - createdstamp) / :aging, id FOR UPDATE SKIP LOCKED LIMIT 1
+) RETURNING payload
+"""
+
+DEADLINE_QUERY = """
+SELECT EXTRACT(EPOCH FROM min(not_before) - now()) FROM task WHERE queue = :queue AND not_before > now()
+"""
+
+RELEASE_QUERY = """
+UPDATE task SET not_before = NULL, resource = NULL WHERE resource = :resource RETURNING queue
+"""
+
+
+class TaskListener:
+    """
+    Dispatches postgres NOTIFY messages on the task
+    channel to the waiting persistent queues.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.connection = None
+        self.dbapi = None
+
+    def register(self, queue):
+        self.queues[queue.name] = queue
+
+    def start(self):
+        if self.connection:
+            return
+        try:
+            self.connection = database.engine.raw_connection()
+            self.dbapi = self.connection.connection
+            self.dbapi.autocommit = True
+            cursor = self.dbapi.cursor()
+            cursor.execute("LISTEN {}".format(NOTIFY_CHANNEL))
+            cursor.close()
+            asyncio.get_event_loop().add_reader(self.dbapi.fileno(), self.on_notify)
+        except Exception as exc:
+            logger.error("taskqueue: error listening for task notifications")
+            logger.exception(exc)
+            self.stop()
+
+    def stop(self):
+        if not self.connection:
+            return
+        try:
+            asyncio.get_event_loop().remove_reader(self.dbapi.fileno())
+            self.connection.close()
+        except Exception as exc:
+            logger.exception(exc)
+        self.connection = None
+        self.dbapi = None
+
+    def on_notify(self):
+        try:
+            self.dbapi.poll()
+        except Exception as exc:
+            logger.error("taskqueue: lost connection for task notifications")
+            logger.exception(exc)
+            self.stop()
+            return
+        while self.dbapi.notifies:
+            notify = self.dbapi.notifies.pop(0)
+            queue = self.queues.get(notify.payload)
+            if queue:
+                queue.wakeup()
+
+
+listener = TaskListener()
+
+# resources with parked tasks, None until loaded from the database
+parked_resources = None
+
+
+def get_parked_resources():
+    global parked_resources
+    if parked_resources is None:
+        with Session() as session:
+            rows = session.query(Task.resource).filter(Task.resource.isnot(None)).distinct().all()
+        parked_resources = set([row[0] for row in rows])
+    return parked_resources
+
+
+def release_tasks(resource):
+    """
+    Makes the tasks parked on the given resource
+    available to their queues immediately.
+    """
+    get_parked_resources().discard(resource)
+    with Session() as session:
+        rows = session.execute(RELEASE_QUERY, {"resource": resource}).fetchall()
+        for queue in set([row[0] for row in rows]):
+            session.execute("SELECT pg_notify(:channel, :queue)", {"channel": NOTIFY_CHANNEL, "queue": queue})
+        session.commit()
+    if rows:
+        logger.info("taskqueue: released %d task(s) waiting for %s", len(rows), resource)
+    for row in rows:
+        queue = listener.queues.get(row[0])
+        if queue:
+            queue.wakeup()
+
+
+def wakeup_tasks(resource):
+    """
+    Wakes up tasks parked on a resource after the
+    current transaction had a chance to be committed.
+
+    Args:
+        resource (str): The resource key, e.g. "repo_42".
+    """
+    if resource not in get_parked_resources():
+        return
+    asyncio.get_event_loop().call_soon(release_tasks, resource)
+
+
+def wakeup_committed(resources):
+    """
+    Wakes up tasks parked on resources changed by a
+    committed session, see database.wakeup_after_commit().
+    """
+    for resource in resources:
+        wakeup_tasks(resource)
+
+
+commit_hooks.append(wakeup_committed)
+
+
+class PersistentQueue:
+    """
+    Task queue stored in the database.
+
+    Tasks stay in the task table until they are dequeued,
+    so pending work survives a restart of the server.
+    Consumers are woken up by LISTEN/NOTIFY instead of polling.
+    """
+
+    def __init__(self, name, aging=None):
+        """
+        Args:
+            name (str): The queue name.
+            aging (int): Dequeue by priority, raising the priority of waiting
+                         tasks by one every <aging> seconds. FIFO if None.
+        """
+        self.name = name
+        self.aging = aging
+        self.event = None
+        listener.register(self)
+
+    def wakeup(self):
+        if self.event:
+            self.event.set()
+
+    def claim(self):
+        """
+        Removes the oldest, or for prioritized queues the most
+        important task from the queue, skipping rows locked by
+        concurrent consumers.
+
+        Returns:
+            The task or None if the queue is empty.
+        """
+        with Session() as session:
+            if self.aging:
+                row = session.execute(CLAIM_PRIORITY_QUERY, {"queue": self.name, "aging": self.aging}).first()
+            else:
+                row = session.execute(CLAIM_QUERY, {"queue": self.name}).first()
+            session.commit()
+        if not row:
+            return None
+        return json.loads(row[0])
+
+    def next_deadline(self):
+        """
+        Returns the seconds until the next parked task
+        becomes due, or None if no task is parked.
+        """
+        with Session() as session:
+            row = session.execute(DEADLINE_QUERY, {"queue": self.name}).first()
+        if not row or row[0] is None:
+            return None
+        return max(float(row[0]), 0)
+
+    async def put(self, item, resource=None, delay=None, priority=0, tag=None):
+        """
+        Adds a task to the queue.
+
+        Args:
+            item (dict): The task.
+            resource (str): Park the task until this resource is woken up.
+            delay (int): Seconds to wait at most before the task is due.
+            priority (int): The priority for prioritized queues, 0 is the highest.
+            tag (str): Groups tasks, e.g. by project for fair sharing.
+        """
+        task = Task(queue=self.name, payload=json.dumps(item), priority=priority, tag=tag)
+        if resource:
+            task.resource = resource
+            get_parked_resources().add(resource)
+        if delay:
+            task.not_before = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        with Session() as session:
+            session.add(task)
+            session.execute("SELECT pg_notify(:channel, :queue)", {"channel": NOTIFY_CHANNEL, "queue": self.name})
+            session.commit()
+        self.wakeup()
+
+    async def get(self):
+        if not self.event:
+            self.event = asyncio.Event()
+        listener.start()
+        while True:
+            self.event.clear()
+            item = self.claim()
+            if item is not None:
+                return item
+            try:
+                await asyncio.wait_for(self.event.wait(), self.next_deadline())
+            except asyncio.TimeoutError:
+                pass
+
+    def task_done(self):
+        pass
+
+    def discard(self, predicate):
+        """
+        Removes the pending tasks matching a predicate.
+
+        Args:
+            predicate (function): Called with each task, True to remove it.
+
+        Returns:
+            int: The number of removed tasks.
+        """
+        count = 0
+        with Session() as session:
+            for task in session.query(Task).filter(Task.queue == self.name).all():
+                if predicate(json.loads(task.payload)):
+                    session.delete(task)
+                    count += 1
+            session.commit()
+        return count
+
+    def move_to(self, queue):
+        """
+        Moves the pending tasks to another queue,
+        keeping their order, priority and tag.
+
+        Args:
+            queue (PersistentQueue): The target queue.
+
+        Returns:
+            int: The number of moved tasks.
+        """
+        with Session() as session:
+            count = session.query(Task).filter(Task.queue == self.name).update({Task.queue: queue.name},
+                                                                               synchronize_session=False)
+            if count:
+                session.execute("SELECT pg_notify(:channel, :queue)", {"channel": NOTIFY_CHANNEL, "queue": queue.name})
+            session.commit()
+        if count:
+            queue.wakeup()
+        return count
+
+    def items(self):
+        """
+        Returns the pending tasks without removing them.
+        """
+        with Session() as session:
+            rows = session.query(Task.payload).filter(Task.queue == self.name).order_by(Task.id).all()
+        return [json.loads(row[0]) for row in rows]
+
+    def qsize(self):
+        with Session() as session:
+            return session.query(Task).filter(Task.queue == self.name).count()
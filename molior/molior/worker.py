@@ -8,7 +8,9 @@ from ..app import logger
 from ..ops import GitClone, GitChangeUrl, get_latest_tag
 from ..ops import PrepareBuilds, BuildPreparationState, CreateBuilds, BuildSourcePackage, ScheduleBuilds, CreateBuildEnv
 from ..molior.configuration import Configuration
-from ..molior.queues import enqueue_task, dequeue_task, enqueue_aptly
+from ..molior.locks import ResourceLocks
+from ..molior.queues import enqueue_task, dequeue_task, enqueue_aptly, get_queued_builds, get_queued_publishes
+from ..molior.queues import park_task, wakeup_tasks
 
 from ..model.database import Session
 from ..model.build import Build
@@ -24,6 +26,7 @@ async def cleanup_builds():
     """
 
     cleaned_up = False
+    republish = []
     with Session() as session:
         # FIXME: set schedules to needs build and delete buildtask
         builds = session.query(Build).filter(Build.buildstate == "building").all()
@@ -33,19 +36,33 @@ async def cleanup_builds():
                 session.delete(build.buildtask)
             cleaned_up = True
 
+        # deb builds are published in batches after they were
+        # dequeued, publish the ones interrupted by a restart again
+        queued_publishes = get_queued_publishes()
         builds = session.query(Build).filter(Build.buildstate == "publishing").all()
         for build in builds:
+            if build.buildtype == "deb":
+                if build.id not in queued_publishes:
+                    republish.append(build.id)
+                continue
             await build.set_publish_failed()
             if build.buildtask:
                 session.delete(build.buildtask)
             cleaned_up = True
 
-        builds = session.query(Build).filter(Build.buildstate == "scheduled" and Build.buildtype == "deb").all()
+        # scheduled builds are kept in the persistent queues,
+        # only reschedule the ones which got lost
+        queued_builds = get_queued_builds()
+        builds = session.query(Build).filter(Build.buildstate == "scheduled", Build.buildtype == "deb").all()
         for build in builds:
+            if build.id in queued_builds:
+                continue
+            if build.buildtask:
+                session.delete(build.buildtask)
             await build.set_needs_build()
             cleaned_up = True
 
-        builds = session.query(Build).filter(Build.buildstate == "needs_build" and Build.buildtype == "chroot").all()
+        builds = session.query(Build).filter(Build.buildstate == "needs_build", Build.buildtype == "chroot").all()
         for build in builds:
             await build.set_failed()
             cleaned_up = True
@@ -53,6 +70,10 @@ async def cleanup_builds():
         if cleaned_up:
             session.commit()
 
+    for build_id in republish:
+        logger.info("worker: publishing build %d again", build_id)
+        await enqueue_aptly({"publish": [build_id]})
+
 
 def cleanup_repos():
     """
@@ -78,6 +99,11 @@ def cleanup_repos():
             session.commit()
 
 
+# repo states before the first clone finished, tasks on the
+# same repo are serialized by Worker.repo_locks
+REPO_NOT_CLONED = ["new", "cloning"]
+
+
 class Worker:
     """
     Main worker task
@@ -86,6 +112,8 @@ class Worker:
 
     def __init__(self):
         self.chroot_build_count = 0
+        self.repo_locks = ResourceLocks()
+        self.running = set()  # futures of the running tasks
 
     async def _clone(self, args, session):
         logger.debug("worker: got clone task")
@@ -109,7 +137,7 @@ class Worker:
         repo.set_cloning()
         session.commit()
 
-        asyncio.ensure_future(GitClone(build.id, repo.id, session))
+        await GitClone(build.id, repo.id, session)
 
     async def _build(self, args, session):
         logger.debug("worker: got build task")
@@ -137,10 +165,9 @@ class Worker:
             await build.logdone()
             return
 
-        if repo.state != "ready":
-            logger.info("worker: repo %d not ready, requeueing", repo_id)
-            await enqueue_task({"build": args})
-            await asyncio.sleep(2)
+        if repo.state in REPO_NOT_CLONED:
+            logger.info("worker: repo %d not cloned yet, waiting", repo_id)
+            await park_task({"build": args}, "repo_%d" % repo_id)
             return
 
         if build.buildstate != "building":
@@ -148,9 +175,8 @@ class Worker:
 
         ret, info = await PrepareBuilds(session, build, repo, git_ref, ci_branch, targets, force_ci)
         if ret == BuildPreparationState.RETRY:
-            logger.info("worker: build %d is depending on existing build, requeueing", build.id)
-            await enqueue_task({"build": args})
-            await asyncio.sleep(2)
+            logger.info("worker: build %d is depending on build %d, waiting", build.id, info)
+            await park_task({"build": args}, "build_%d" % info)
             return
         if ret == BuildPreparationState.ERROR:
             await build.log("E: error preparing build\n")
@@ -162,8 +188,10 @@ class Worker:
             await build.logdone()
             return
 
-        # FIXME: this was run as a future in bkg before
-        await CreateBuilds(session, build, repo, info, git_ref, ci_branch, targets, force_ci)
+        src_build_id = await CreateBuilds(session, build, repo, info, git_ref, ci_branch, targets, force_ci)
+        if src_build_id:
+            # build the source package while still holding the repo lock
+            await BuildSourcePackage(src_build_id)
 
     async def _srcbuild(self, args, session):
         build_id = args[0]
@@ -175,7 +203,7 @@ class Worker:
         if build.buildstate != "new" and build.buildstate != "build_failed":
             return
 
-        asyncio.ensure_future(BuildSourcePackage(build_id))
+        await BuildSourcePackage(build_id)
 
     async def _buildlatest(self, args, session):
         logger.debug("worker: got buildlatest task")
@@ -198,10 +226,9 @@ class Worker:
             await build.logdone()
             return
 
-        if repo.state != "ready":
-            await enqueue_task({"buildlatest": args})
-            logger.info("worker: repo %d not ready, requeueing", repo_id)
-            await asyncio.sleep(2)
+        if repo.state in REPO_NOT_CLONED:
+            logger.info("worker: repo %d not cloned yet, waiting", repo_id)
+            await park_task({"buildlatest": args}, "repo_%d" % repo_id)
             return
 
         if build.buildstate != "building":
@@ -265,6 +292,7 @@ class Worker:
                     except Exception as exc:
                         logger.exception(exc)
 
+                build.priority = "rebuild"
                 await build.set_needs_build()
                 session.commit()
 
@@ -285,11 +313,6 @@ class Worker:
                     await build.logdone()
                     return
 
-                if build.sourcerepository.state != "ready":
-                    await enqueue_task({"rebuild": args})
-                    logger.info("worker: repo %d not ready, requeueing", build.sourcerepository.id)
-                    await asyncio.sleep(2)
-                    return
                 await enqueue_task({"src_build": [build.id]})
                 ok = True
 
@@ -323,9 +346,8 @@ class Worker:
         max_parallel_chroots = cfg.max_parallel_chroots
         if max_parallel_chroots and type(max_parallel_chroots) is int and max_parallel_chroots > 0:
             if self.chroot_build_count >= max_parallel_chroots:
-                await enqueue_task({"buildenv": args})
-                logger.info("worker: building %d chroots already, requeueing...", self.chroot_build_count)
-                await asyncio.sleep(2)
+                logger.info("worker: building %d chroots already, waiting", self.chroot_build_count)
+                await park_task({"buildenv": args}, "chroot")
                 return
 
         self.chroot_build_count += 1
@@ -346,6 +368,7 @@ class Worker:
         await CreateBuildEnv(chroot_id, build_id, dist,
                              name, version, arch, components, repo_url, mirror_keys)
         self.chroot_build_count -= 1
+        wakeup_tasks("chroot")
 
     async def _merge_duplicate_repo(self, args, session):
         repository_id = args[0]
@@ -365,16 +388,14 @@ class Worker:
             logger.warning("worker: cannot merge with repo %d in error state", repository_id)
             return
 
-        if original.state != "ready":
-            logger.info("worker: repo %d not ready, requeueing", repository_id)
-            await enqueue_task({"merge_duplicate_repo": args})
-            await asyncio.sleep(2)
+        if original.state in REPO_NOT_CLONED:
+            logger.info("worker: repo %d not cloned yet, waiting", repository_id)
+            await park_task({"merge_duplicate_repo": args}, "repo_%d" % repository_id)
             return
 
-        if duplicate.state != "ready" and duplicate.state != "error":  # merge duplicates in error state
-            logger.info("worker: repo %d not ready, requeueing", duplicate_id)
-            await enqueue_task({"merge_duplicate_repo": args})
-            await asyncio.sleep(2)
+        if duplicate.state in REPO_NOT_CLONED:
+            logger.info("worker: repo %d not cloned yet, waiting", duplicate_id)
+            await park_task({"merge_duplicate_repo": args}, "repo_%d" % duplicate_id)
             return
 
         original.set_busy()
@@ -423,12 +444,6 @@ class Worker:
             logger.error("merge: repo %d not found", repository_id)
             return
 
-        if repo.state != "ready" and repo.state != "error":
-            logger.info("worker: repo %d not ready, requeueing", repository_id)
-            await enqueue_task({"delete_repo": args})
-            await asyncio.sleep(2)
-            return
-
         logger.info("worker: deleting repo %d", repository_id)
         session.delete(repo)
         session.commit()
@@ -447,12 +462,6 @@ class Worker:
             logger.error("repo_change_url: repo %d not found", repository_id)
             return
 
-        if repo.state != "ready" and repo.state != "error":
-            logger.info("worker: repo %d not ready, requeueing", repository_id)
-            await enqueue_task({"repo_change_url": args})
-            await asyncio.sleep(2)
-            return
-
         try:
             repoinfo = giturlparse.parse(url)
         except giturlparse.parser.ParserError:
@@ -465,6 +474,119 @@ class Worker:
         session.commit()
         await GitChangeUrl(old_path, repo.name, repo.url)
 
+    def get_task_repos(self, task, session):
+        """
+        Returns the lock names of the source repositories a task works on.
+        """
+        repo_ids = []
+        for key, pos in [("clone", 1), ("build", 1), ("buildlatest", 0), ("delete_repo", 0), ("repo_change_url", 0)]:
+            args = task.get(key)
+            if args:
+                repo_ids.append(args[pos])
+
+        args = task.get("merge_duplicate_repo")
+        if args:
+            repo_ids.extend(args[:2])
+
+        args = task.get("src_build")
+        if args:
+            build = session.query(Build).filter(Build.id == args[0]).first()
+            if build:
+                repo_ids.append(build.sourcerepository_id)
+
+        return ["repo_%d" % repo_id for repo_id in repo_ids if repo_id]
+
+    async def run_task(self, task, slots):
+        """
+        Runs a task while holding the locks of the source
+        repositories it works on, so tasks on the same
+        repository run one after the other.
+        """
+        try:
+            logger.debug("worker: got task {}".format(task))
+            with Session() as session:
+                repos = self.get_task_repos(task, session)
+                for repo in repos:
+                    # do not block a worker slot while waiting for the repo
+                    if self.repo_locks.locked(repo):
+                        logger.info("worker: %s is locked, waiting", repo)
+                        await park_task(task, repo)
+                        return
+                async with self.repo_locks.hold(*repos):
+                    try:
+                        await self.dispatch(task, session)
+                    finally:
+                        for repo in repos:
+                            wakeup_tasks(repo)
+        except Exception as exc:
+            logger.exception(exc)
+        finally:
+            slots.release()
+
+    async def dispatch(self, task, session):
+        handled = False
+        args = task.get("clone")
+        if args:
+            handled = True
+            await self._clone(args, session)
+
+        if not handled:
+            args = task.get("build")
+            if args:
+                handled = True
+                await self._build(args, session)
+
+        if not handled:
+            args = task.get("buildlatest")
+            if args:
+                handled = True
+                await self._buildlatest(args, session)
+
+        if not handled:
+            args = task.get("src_build")
+            if args:
+                handled = True
+                await self._srcbuild(args, session)
+
+        if not handled:
+            args = task.get("rebuild")
+            if args:
+                handled = True
+                await self._rebuild(args, session)
+
+        if not handled:
+            args = task.get("schedule")
+            if args == []:
+                handled = True
+                await self._schedule(session)
+
+        if not handled:
+            args = task.get("buildenv")
+            if args:
+                handled = True
+                await self._buildenv(args)
+
+        if not handled:
+            args = task.get("merge_duplicate_repo")
+            if args:
+                handled = True
+                await self._merge_duplicate_repo(args, session)
+
+        if not handled:
+            args = task.get("delete_repo")
+            if args:
+                handled = True
+                await self._delete_repo(args, session)
+
+        if not handled:
+            args = task.get("repo_change_url")
+            if args:
+                handled = True
+                await self._repo_change_url(args, session)
+
+        if not handled:
+            logger.error("worker got unknown task %s", str(task))
+
     async def run(self):
         """
         Run the worker task.
@@ -481,80 +603,34 @@ class Worker:
         except Exception as exc:
             logger.exception(exc)
 
+        cfg = Configuration()
+        max_parallel_tasks = cfg.max_parallel_tasks
+        if not max_parallel_tasks or type(max_parallel_tasks) is not int or max_parallel_tasks < 1:
+            max_parallel_tasks = 4
+        slots = asyncio.Semaphore(max_parallel_tasks)
+
         while True:
-            session = None
+            try:
+                await slots.acquire()
+            except asyncio.CancelledError:
+                break
             try:
                 task = await dequeue_task()
                 if task is None:
                     break
-
-                logger.debug("worker: got task {}".format(task))
-                with Session() as session:
-
-                    handled = False
-                    args = task.get("clone")
-                    if args:
-                        handled = True
-                        await self._clone(args, session)
-
-                    if not handled:
-                        args = task.get("build")
-                        if args:
-                            handled = True
-                            await self._build(args, session)
-
-                    if not handled:
-                        args = task.get("buildlatest")
-                        if args:
-                            handled = True
-                            await self._buildlatest(args, session)
-
-                    if not handled:
-                        args = task.get("src_build")
-                        if args:
-                            handled = True
-                            await self._srcbuild(args, session)
-
-                    if not handled:
-                        args = task.get("rebuild")
-                        if args:
-                            handled = True
-                            await self._rebuild(args, session)
-
-                    if not handled:
-                        args = task.get("schedule")
-                        if args == []:
-                            handled = True
-                            await self._schedule(session)
-
-                    if not handled:
-                        args = task.get("buildenv")
-                        if args:
-                            handled = True
-                            await self._buildenv(args)
-
-                    if not handled:
-                        args = task.get("merge_duplicate_repo")
-                        if args:
-                            handled = True
-                            await self._merge_duplicate_repo(args, session)
-
-                    if not handled:
-                        args = task.get("delete_repo")
-                        if args:
-                            handled = True
-                            await self._delete_repo(args, session)
-
-                    if not handled:
-                        args = task.get("repo_change_url")
-                        if args:
-                            handled = True
-                            await self._repo_change_url(args, session)
-
-                    if not handled:
-                        logger.error("worker got unknown task %s", str(task))
-
+                future = asyncio.ensure_future(self.run_task(task, slots))
+                self.running.add(future)
+                future.add_done_callback(self.running.discard)
+            except asyncio.CancelledError:
+                slots.release()
+                break
             except Exception as exc:
+                slots.release()
                 logger.exception(exc)
 
+        for future in list(self.running):
+            future.cancel()
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
         logger.info("worker terminated")
@@ -2,19 +2,25 @@ import asyncio
 import operator
 
 from os import mkdir
+from pathlib import Path
 from shutil import rmtree
 from sqlalchemy import func, or_
 from shutil import copy2
 
 from ..app import logger
 from ..tools import db2array, array2db
-from ..ops import DebSrcPublish, DebPublish, DeleteBuildEnv
-from ..aptly import get_aptly_connection
+from ..ops import DebSrcPublish, DebPublishBatch, DeleteBuildEnv
+from ..aptly import AptlyApi, get_aptly_connection
 from ..aptly.errors import AptlyError, NotFoundError
 from .debianrepository import DebianRepository
 from .notifier import Subject, Event, notify, send_mail_notification
 from ..molior.queues import enqueue_task, enqueue_aptly, dequeue_aptly, buildlog, buildlogtitle, buildlogdone, enqueue_backend
+from ..molior.queues import park_aptly, wakeup_tasks, buildlog_writer
 from ..molior.configuration import Configuration
+from ..molior.locks import ResourceLocks
+from ..molior.logwriter import find_log_file
+from ..molior.logindex import get_index_file_path
+from ..molior.buildindex import build_index
 
 from ..model.database import Session
 from ..model.build import Build
@@ -24,6 +30,20 @@ from ..model.chroot import Chroot
 from ..model.mirrorkey import MirrorKey
 
 
+def get_publish_name(projectversion):
+    """
+    Returns the aptly publish name of a projectversion.
+    """
+    basemirror_name = ""
+    basemirror_version = ""
+    if projectversion.basemirror:
+        basemirror_name = projectversion.basemirror.project.name
+        basemirror_version = projectversion.basemirror.name
+    _, publish_name = AptlyApi.get_aptly_names(basemirror_name, basemirror_version, projectversion.project.name,
+                                               projectversion.name, is_mirror=projectversion.project.is_mirror)
+    return publish_name
+
+
 def mirror_architectures(mirror):
     '''Return the mirror architectures to use on aptly for a given mirror.
     Add "source" as architecture when updating mirror on aptly to trigger source downloading/snapshotting/publishing.
@@ -253,7 +273,7 @@ async def finalize_mirror(build_id, base_mirror, base_mirror_version,
                                     )
 
                         await notify(Subject.build.value, Event.changed.value,
-                                     {"id": build.id, "progress": total_progress["PercentSize"]})
+                                     {"id": build.id, "progress": total_progress["PercentSize"]}, build.topics())
                         await notify(Subject.mirror.value, Event.changed.value,
                                      {"id": mirror.id, "progress": total_progress["PercentSize"]})
                     await asyncio.sleep(5)
@@ -370,7 +390,7 @@ async def finalize_mirror(build_id, base_mirror, base_mirror_version,
                                 upd_progress["TotalNumberOfPackages"], upd_progress["PercentPackages"])
 
                     await notify(Subject.build.value, Event.changed.value,
-                                 {"id": build.id, "progress": upd_progress["PercentPackages"]})
+                                 {"id": build.id, "progress": upd_progress["PercentPackages"]}, build.topics())
                     await notify(Subject.mirror.value, Event.changed.value,
                                  {"id": mirror.id, "progress": upd_progress["PercentPackages"]})
                     await asyncio.sleep(5)
@@ -449,6 +469,17 @@ class AptlyWorker:
 
     """
 
+    def __init__(self):
+        self.publish_locks = ResourceLocks()
+        self.publish_batches = {}
+        self.slots = None
+        self.running = set()
+
+    def run_future(self, coro):
+        future = asyncio.ensure_future(coro)
+        self.running.add(future)
+        future.add_done_callback(self.running.discard)
+
     async def _create_mirror(self, args):
         (
             mirror_name,
@@ -794,48 +825,100 @@ class AptlyWorker:
 
             await build.set_publishing()
             session.commit()
+            key = (build.projectversion_id, build.is_ci)
 
-            basemirror_name = build.projectversion.basemirror.project.name
-            basemirror_version = build.projectversion.basemirror.name
-            project_name = build.projectversion.project.name
-            project_version = build.projectversion.name
-            archs = db2array(build.projectversion.mirror_architectures)
-            parent_parent_id = build.parent.parent.id
-            buildtype = build.buildtype
-            sourcename = build.sourcename
-            version = build.version
-            architecture = build.architecture
-            is_ci = build.is_ci
+        # collect the builds finishing for the same publish point
+        batch = self.publish_batches.get(key)
+        if batch is not None:
+            batch.append(build_id)
+            return
+        self.publish_batches[key] = [build_id]
+        self.run_future(self._publish_batch(key))
 
-        await buildlog(parent_parent_id, "I: publishing debian packages for %s\n" % architecture)
+    async def _publish_batch(self, key):
+        cfg = Configuration()
+        publish_window = cfg.aptly.get("publish_window")
+        if type(publish_window) not in [int, float] or publish_window < 0:
+            publish_window = 5
+        await asyncio.sleep(publish_window)
+
+        lock = None
+        with Session() as session:
+            projectversion = get_projectversion_byid(key[0], session)
+            if projectversion:
+                lock = get_publish_name(projectversion)
 
-        ret = False
         try:
-            ret = await DebPublish(build_id, buildtype, sourcename, version, architecture, is_ci,
-                                   basemirror_name, basemirror_version, project_name, project_version, archs)
+            async with self.publish_locks.hold(lock):
+                async with self.slots:
+                    build_ids = self.publish_batches.pop(key)
+                    try:
+                        await self.publish_builds(build_ids)
+                    finally:
+                        if lock:
+                            wakeup_tasks(lock)
         except Exception as exc:
             logger.exception(exc)
 
-        if not ret:
-            await buildlog(parent_parent_id, "E: publishing build %d failed\n" % build.id)
-            await buildlog(build_id, "E: publishing build failed\n")
+    async def publish_builds(self, build_ids):
+        """
+        Publishes deb builds of the same projectversion and dist
+        with a single upload and republish.
+        """
+        builds = []
+        with Session() as session:
+            for build_id in build_ids:
+                build = session.query(Build).filter(Build.id == build_id).first()
+                if not build:
+                    logger.error("aptly worker: build with id %d not found", build_id)
+                    continue
 
-        await buildlogtitle(build_id, "Done", no_footer_newline=True, no_header_newline=False)
-        await buildlogdone(build_id)
+                basemirror_name = build.projectversion.basemirror.project.name
+                basemirror_version = build.projectversion.basemirror.name
+                project_name = build.projectversion.project.name
+                project_version = build.projectversion.name
+                archs = db2array(build.projectversion.mirror_architectures)
+                is_ci = build.is_ci
+                parent_parent_id = build.parent.parent.id
+                builds.append((build.id, build.buildtype, build.sourcename, build.version, build.architecture))
+                await buildlog(parent_parent_id, "I: publishing debian packages for %s\n" % build.architecture)
+
+        if not builds:
+            return
 
-        with Session() as session:
-            build = session.query(Build).filter(Build.id == build_id).first()
-            if not build:
-                logger.error("aptly worker: build with id %d not found", build_id)
-                return
-            if ret:
-                await build.set_successful()
-            else:
-                await build.set_publish_failed()
-            session.commit()
+        if len(builds) > 1:
+            logger.info("aptly worker: publishing %d builds for %s/%s", len(builds), project_name, project_version)
 
-            if not build.is_ci:
-                send_mail_notification(build)
+        results = {}
+        try:
+            results = await DebPublishBatch(builds, is_ci, basemirror_name, basemirror_version,
+                                            project_name, project_version, archs)
+        except Exception as exc:
+            logger.exception(exc)
+
+        for build_id, _, _, _, _ in builds:
+            ret = results.get(build_id, False)
+            if not ret:
+                await buildlog(build_id, "E: publishing build failed\n")
+
+            await buildlogtitle(build_id, "Done", no_footer_newline=True, no_header_newline=False)
+            await buildlogdone(build_id)
+
+            with Session() as session:
+                build = session.query(Build).filter(Build.id == build_id).first()
+                if not build:
+                    logger.error("aptly worker: build with id %d not found", build_id)
+                    continue
+                if not ret:
+                    await buildlog(build.parent.parent.id, "E: publishing build %d failed\n" % build.id)
+                if ret:
+                    await build.set_successful()
+                else:
+                    await build.set_publish_failed()
+                session.commit()
+
+                if not build.is_ci:
+                    send_mail_notification(build)
 
         # Schedule builds
         args = {"schedule": []}
@@ -952,7 +1035,15 @@ class AptlyWorker:
         for old, new in buildlogs:
             try:
                 mkdir(buildout_path + "/%d" % new)
-                copy2(buildout_path + "/%d/build.log" % old, buildout_path + "/%d/build.log" % new)
+                # completed logs are copied compressed
+                log_file, _ = find_log_file(buildout_path + "/%d/build.log" % old)
+                if not log_file:
+                    logger.warning("snapshot: build log of build %d not found", old)
+                    continue
+                copy2(str(log_file), buildout_path + "/%d/%s" % (new, log_file.name))
+                index_file = Path(get_index_file_path(buildout_path + "/%d/build.log" % old))
+                if index_file.is_file():
+                    copy2(str(index_file), buildout_path + "/%d/%s" % (new, index_file.name))
             except Exception as exc:
                 logger.exception(exc)
 
@@ -1157,6 +1248,7 @@ class AptlyWorker:
                 to_delete.append(src)
             to_delete.append(top)
 
+            deleted_ids = [build.id for build in to_delete]
             for build in to_delete:
                 build.debianpackages = []
                 if build.buildtask:
@@ -1164,6 +1256,10 @@ class AptlyWorker:
                 session.delete(build)
             session.commit()
 
+            for deleted_id in deleted_ids:
+                build_index.remove(deleted_id)
+                buildlog_writer.set_finished(deleted_id, True)
+
         logger.info("aptly worker: build %d deleted" % build_id)
 
     async def _abort(self, args):
@@ -1196,6 +1292,176 @@ class AptlyWorker:
             await topbuild.set_failed()
             session.commit()
 
+    def get_task_locks(self, task, session):
+        """
+        Returns the aptly publish names a task works on.
+        """
+        names = []
+        projectversion_ids = []
+
+        args = task.get("src_publish")
+        if args:
+            build = session.query(Build).filter(Build.id == args[0]).first()
+            if build and build.projectversions:
+                projectversion_ids.extend(build.projectversions)
+
+        for key in ["init_mirror", "update_mirror", "delete_mirror"]:
+            args = task.get(key)
+            if args:
+                projectversion_ids.append(args[0])
+
+        args = task.get("create_mirror")
+        if args:
+            basemirror_name = ""
+            basemirror_version = ""
+            if args[10]:
+                basemirror = get_projectversion_byid(args[10], session)
+                if basemirror:
+                    basemirror_name = basemirror.project.name
+                    basemirror_version = basemirror.name
+            _, publish_name = AptlyApi.get_aptly_names(basemirror_name, basemirror_version, args[0], args[8], is_mirror=True)
+            names.append(publish_name)
+
+        for key in ["drop_publish", "init_repository", "delete_repository"]:
+            args = task.get(key)
+            if args:
+                _, publish_name = AptlyApi.get_aptly_names(args[0], args[1], args[2], args[3])
+                names.append(publish_name)
+
+        args = task.get("snapshot_repository")
+        if args:
+            for version in [args[3], args[5]]:
+                _, publish_name = AptlyApi.get_aptly_names(args[0], args[1], args[2], version)
+                names.append(publish_name)
+
+        args = task.get("delete_build")
+        if args:
+            topbuild = session.query(Build).filter(Build.id == args[0]).first()
+            if topbuild:
+                for src in topbuild.children:
+                    if src.projectversions:
+                        projectversion_ids.extend(src.projectversions)
+                    for deb in src.children:
+                        if deb.projectversion_id:
+                            projectversion_ids.append(deb.projectversion_id)
+
+        for projectversion_id in set([int(i) for i in projectversion_ids]):
+            projectversion = get_projectversion_byid(projectversion_id, session)
+            if projectversion:
+                names.append(get_publish_name(projectversion))
+
+        return names
+
+    async def run_task(self, task, slots):
+        """
+        Runs a task while holding the locks of the aptly
+        publish points it works on, so tasks on different
+        projectversions run in parallel.
+        """
+        try:
+            with Session() as session:
+                names = self.get_task_locks(task, session)
+            for name in names:
+                # do not block a worker slot while waiting for the publish point
+                if self.publish_locks.locked(name):
+                    logger.info("aptly worker: %s is locked, waiting", name)
+                    await park_aptly(task, name)
+                    return
+            async with self.publish_locks.hold(*names):
+                try:
+                    await self.dispatch(task)
+                finally:
+                    for name in names:
+                        wakeup_tasks(name)
+        except Exception as exc:
+            logger.exception(exc)
+        finally:
+            slots.release()
+
+    async def dispatch(self, task):
+        handled = False
+        if not handled:
+            args = task.get("src_publish")
+            if args:
+                handled = True
+                await self._src_publish(args)
+
+        if not handled:
+            args = task.get("publish")
+            if args:
+                handled = True
+                await self._publish(args)
+
+        if not handled:
+            args = task.get("create_mirror")
+            if args:
+                handled = True
+                await self._create_mirror(args)
+
+        if not handled:
+            args = task.get("init_mirror")
+            if args:
+                handled = True
+                await self._init_mirror(args)
+
+        if not handled:
+            args = task.get("update_mirror")
+            if args:
+                handled = True
+                await self._update_mirror(args)
+
+        if not handled:
+            args = task.get("drop_publish")
+            if args:
+                handled = True
+                await self._drop_publish(args)
+
+        if not handled:
+            args = task.get("init_repository")
+            if args:
+                handled = True
+                await self._init_repository(args)
+
+        if not handled:
+            args = task.get("snapshot_repository")
+            if args:
+                handled = True
+                await self._snapshot_repository(args)
+
+        if not handled:
+            args = task.get("delete_repository")
+            if args:
+                handled = True
+                await self._delete_repository(args)
+
+        if not handled:
+            args = task.get("delete_mirror")
+            if args:
+                handled = True
+                await self._delete_mirror(args)
+
+        if not handled:
+            args = task.get("delete_build")
+            if args:
+                handled = True
+                await self._delete_build(args)
+
+        if not handled:
+            args = task.get("abort")
+            if args:
+                handled = True
+                await self._abort(args)
+
+        # must be last
+        if not handled:
+            args = task.get("cleanup")
+            # FIXME: check args is []
+            handled = True
+            await self._cleanup(args)
+
+        if not handled:
+            logger.error("aptly worker got unknown task %s", str(task))
+
     async def run(self):
         """
         Run the worker task.
@@ -1206,96 +1472,43 @@ class AptlyWorker:
         except Exception:
             pass
 
+        cfg = Configuration()
+        max_parallel_tasks = cfg.aptly.get("max_parallel_tasks")
+        if not max_parallel_tasks or type(max_parallel_tasks) is not int or max_parallel_tasks < 1:
+            max_parallel_tasks = 2
+        slots = asyncio.Semaphore(max_parallel_tasks)
+        self.slots = slots
+
         while True:
+            try:
+                await slots.acquire()
+            except asyncio.CancelledError:
+                break
             try:
                 task = await dequeue_aptly()
                 if task is None:
                     break
 
-                handled = False
-                if not handled:
-                    args = task.get("src_publish")
-                    if args:
-                        handled = True
-                        await self._src_publish(args)
-
-                if not handled:
-                    args = task.get("publish")
-                    if args:
-                        handled = True
-                        await self._publish(args)
-
-                if not handled:
-                    args = task.get("create_mirror")
-                    if args:
-                        handled = True
-                        await self._create_mirror(args)
-
-                if not handled:
-                    args = task.get("init_mirror")
-                    if args:
-                        handled = True
-                        await self._init_mirror(args)
-
-                if not handled:
-                    args = task.get("update_mirror")
-                    if args:
-                        handled = True
-                        await self._update_mirror(args)
-
-                if not handled:
-                    args = task.get("drop_publish")
-                    if args:
-                        handled = True
-                        await self._drop_publish(args)
-
-                if not handled:
-                    args = task.get("init_repository")
-                    if args:
-                        handled = True
-                        await self._init_repository(args)
-
-                if not handled:
-                    args = task.get("snapshot_repository")
-                    if args:
-                        handled = True
-                        await self._snapshot_repository(args)
-
-                if not handled:
-                    args = task.get("delete_repository")
-                    if args:
-                        handled = True
-                        await self._delete_repository(args)
-
-                if not handled:
-                    args = task.get("delete_mirror")
-                    if args:
-                        handled = True
-                        await self._delete_mirror(args)
-
-                if not handled:
-                    args = task.get("delete_build")
-                    if args:
-                        handled = True
-                        await self._delete_build(args)
-
-                if not handled:
-                    args = task.get("abort")
-                    if args:
-                        handled = True
-                        await self._abort(args)
-
-                # must be last
-                if not handled:
-                    args = task.get("cleanup")
-                    # FIXME: check args is []
-                    handled = True
-                    await self._cleanup(args)
-
-                if not handled:
-                    logger.error("aptly worker got unknown task %s", str(task))
+                if "cleanup" in task:
+                    # cleanup must not run alongside other aptly tasks
+                    if self.running:
+                        slots.release()
+                        await asyncio.wait(self.running)
+                        await slots.acquire()
+                    await self.run_task(task, slots)
+                    continue
 
+                self.run_future(self.run_task(task, slots))
+            except asyncio.CancelledError:
+                slots.release()
+                break
             except Exception as exc:
+                slots.release()
                 logger.exception(exc)
 
+        for future in list(self.running):
+            future.cancel()
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
         logger.info("aptly task terminated")
@@ -2,6 +2,8 @@ from ..app import logger
 from .backend import Backend
 from .notifier import send_mail_notification
 from ..molior.queues import enqueue_task, enqueue_aptly, dequeue_backend, enqueue_backend, buildlogdone
+from ..molior.queues import discard_backend_events
+from ..molior.fairshare import fair_share
 
 from ..model.database import Session
 from ..model.build import Build
@@ -49,6 +51,7 @@ class BackendWorker:
             await enqueue_backend({"terminate": build_id})
 
     async def _terminate(self, build_id):
+        fair_share.finished(build_id)
         outcome = self.build_outcome[build_id]
         del self.build_outcome[build_id]
         self.logging_done.remove(build_id)
@@ -86,6 +89,11 @@ class BackendWorker:
         Run the worker task.
         """
 
+        # events of the previous run refer to node connections and build outcomes lost with it
+        discarded = discard_backend_events()
+        if discarded:
+            logger.info("backend: discarded %d stale backend event(s)", discarded)
+
         while True:
             task = await dequeue_backend()
             if task is None:
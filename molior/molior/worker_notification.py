@@ -2,7 +2,7 @@ import socket
 
 from jinja2 import Template
 
-from ..app import app, logger
+from ..app import logger
 from ..model.database import Session
 from ..model.build import Build
 from ..model.sourepprover import SouRepProVer
@@ -12,6 +12,7 @@ from ..model.hook import Hook
 from .notifier import trigger_hook
 from .configuration import Configuration
 from .queues import dequeue_notification
+from .subscriptions import event_dispatcher
 
 
 class NotificationWorker:
@@ -34,7 +35,8 @@ class NotificationWorker:
 
                 notification = task.get("notify")
                 if notification:
-                    await app.websocket_broadcast(notification)
+                    event_dispatcher.dispatch(notification["subject"], notification["event"],
+                                              notification["data"], task.get("topics"), task.get("opt_in", False))
                     handled = True
 
                 notification = task.get("hooks")
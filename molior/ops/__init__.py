@@ -1,4 +1,4 @@
 from .git import GitClone, GitCheckout, GitChangeUrl, get_latest_tag  # noqa: F401
 from .deb_build import PrepareBuilds, BuildPreparationState, CreateBuilds, BuildSourcePackage, ScheduleBuilds  # noqa: F401
-from .aptly import DebSrcPublish, DebPublish  # noqa: F401
+from .aptly import DebSrcPublish, DebPublish, DebPublishBatch  # noqa: F401
 from .buildenv import CreateBuildEnv, DeleteBuildEnv  # noqa: F401
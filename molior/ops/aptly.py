@@ -133,18 +133,16 @@ async def DebSrcPublish(build_id, repo_id, sourcename, version, projectversions,
     return ret
 
 
-async def publish_packages(build_id, buildtype, sourcename, version, architecture, is_ci,
-                           basemirror_name, basemirror_version, project_name, project_version, archs, out_path):
+async def sign_packages(build_id, buildtype, sourcename, version, architecture, out_path):
     """
-    Publishes given packages to given
-    publish point.
+    Collects and signs the packages of a build.
 
     Args:
-        build (Build): The build model.
+        build_id (int): The build's id.
         out_path (Path): The build output path.
 
     Returns:
-        bool: True if successful, otherwise False.
+        list: The file paths to upload, or None on error.
     """
 
     outfiles = await debchanges_get_files(out_path, sourcename, version, architecture)
@@ -156,18 +154,17 @@ async def publish_packages(build_id, buildtype, sourcename, version, architectur
         logger.debug("publisher: adding %s", f)
         files2upload.append("{}/{}".format(out_path, f))
 
-    count_files = len(files2upload)
-    if count_files == 0:
+    if not files2upload:
         logger.error("publisher: build %d: no files to upload", build_id)
         await buildlog(build_id, "E: no debian packages found to upload\n")
-        return False
+        return None
 
     # FIXME: check on startup
     key = Configuration().debsign_gpg_email
     if not key:
         logger.error("Signing key not defined in configuration")
         await buildlog(build_id, "E: no signinig key defined in configuration\n")
-        return False
+        return None
 
     await buildlog(build_id, "Signing packages:\n")
 
@@ -184,63 +181,106 @@ async def publish_packages(build_id, buildtype, sourcename, version, architectur
     ret = await process.wait()
     if ret != 0:
         logger.error("debsign failed")
-        return False
+        return None
 
-    logger.debug("publisher: uploading %d file%s", count_files, "" if count_files == 1 else "s")
+    return files2upload
 
-    debian_repo = DebianRepository(basemirror_name, basemirror_version, project_name, project_version, archs)
-    ret = False
-    try:
-        ret = await debian_repo.add_packages(files2upload, ci_build=is_ci)
-    except Exception as exc:
-        await buildlog(build_id, "E: error uploading files to repository\n")
-        logger.exception(exc)
 
-    files2delete = files2upload
-    files2delete.append("{}/{}".format(out_path, changes_file))
-    for f in files2delete:
+def remove_files(files):
+    for f in files:
         logger.info("publisher: removing %s", f)
         try:
             os.remove(f)
         except Exception as exc:
             logger.exception(exc)
 
-    return ret
-
 
 async def DebPublish(build_id, buildtype, sourcename, version, architecture, is_ci,
                      basemirror_name, basemirror_version, project_name, project_version, archs):
     """
-    Publishes given src_files/src package to given
-    projectversion debian repo.
+    Publishes the packages of a deb build to
+    the given projectversion debian repo.
+
+    Returns:
+        bool: True if successful, otherwise False.
+    """
+    results = await DebPublishBatch([(build_id, buildtype, sourcename, version, architecture)], is_ci,
+                                    basemirror_name, basemirror_version, project_name, project_version, archs)
+    return results[build_id]
+
+
+async def DebPublishBatch(builds, is_ci, basemirror_name, basemirror_version, project_name, project_version, archs):
+    """
+    Publishes the packages of several deb builds to the same
+    projectversion debian repo with one upload and one republish.
+
+    If the combined publish fails, the builds are published one
+    by one, so each build gets its own result.
 
     Args:
-        projectversion_id (int): The projectversion's id.
-        src_files (list): List of file paths to the src files.
+        builds (list): Tuples of (build_id, buildtype, sourcename, version, architecture).
+        is_ci (bool): Publish to the unstable dist if True.
 
     Returns:
-        bool: True if successful, otherwise False.
+        dict: True or False per build id.
     """
 
-    out_path = Path(Configuration().working_dir) / "buildout" / str(build_id)
-    await buildlogtitle(build_id, "Publishing", no_header_newline=False)
+    results = {}
+    uploads = {}
+    for build_id, buildtype, sourcename, version, architecture in builds:
+        results[build_id] = False
+        out_path = Path(Configuration().working_dir) / "buildout" / str(build_id)
+        await buildlogtitle(build_id, "Publishing", no_header_newline=False)
 
-    try:
-        if not await publish_packages(build_id, buildtype, sourcename, version, architecture, is_ci,
-                                      basemirror_name, basemirror_version, project_name, project_version, archs, out_path):
+        files = None
+        try:
+            files = await sign_packages(build_id, buildtype, sourcename, version, architecture, out_path)
+        except Exception as exc:
+            logger.exception(exc)
+        if not files:
             logger.error("publisher: error publishing build %d" % build_id)
-            return False
-    except Exception as exc:
-        logger.error("publisher: error publishing build %d" % build_id)
-        logger.exception(exc)
+            continue
+        uploads[build_id] = (files, get_debchanges_filename(out_path, sourcename, version, architecture))
+
+    debian_repo = DebianRepository(basemirror_name, basemirror_version, project_name, project_version, archs)
+
+    async def upload(files):
+        count_files = len(files)
+        logger.debug("publisher: uploading %d file%s", count_files, "" if count_files == 1 else "s")
+        try:
+            return await debian_repo.add_packages(files, ci_build=is_ci)
+        except Exception as exc:
+            logger.exception(exc)
         return False
-    finally:
-        with Session() as session:
-            buildtask = session.query(BuildTask).filter(BuildTask.build_id == build_id).first()
-            if buildtask:
-                session.delete(buildtask)
-                session.commit()
-    return True
+
+    if uploads:
+        files2upload = []
+        for files, _ in uploads.values():
+            files2upload.extend(files)
+
+        ret = await upload(files2upload)
+        for build_id in uploads:
+            if ret:
+                results[build_id] = True
+            elif len(uploads) > 1:
+                logger.warning("publisher: combined publish failed, publishing build %d alone", build_id)
+                results[build_id] = await upload(uploads[build_id][0])
+
+            if not results[build_id]:
+                await buildlog(build_id, "E: error uploading files to repository\n")
+                logger.error("publisher: error publishing build %d" % build_id)
+
+    for build_id in uploads:
+        files, changes_file = uploads[build_id]
+        remove_files(files + [changes_file])
+
+    with Session() as session:
+        buildtasks = session.query(BuildTask).filter(BuildTask.build_id.in_(list(results.keys()))).all()
+        for buildtask in buildtasks:
+            session.delete(buildtask)
+        session.commit()
+
+    return results
 
 
 def add_files(build_id, buildtype, version, files):
@@ -26,7 +26,8 @@ from ..model.chroot import Chroot
 from ..model.projectversion import ProjectVersion
 from ..molior.core import get_target_arch, get_targets, get_buildorder, get_apt_repos, get_apt_keys
 from ..molior.configuration import Configuration
-from ..molior.queues import enqueue_task, enqueue_aptly, enqueue_backend, buildlog, buildlogtitle, buildlogdone
+from ..molior.buildindex import build_index
+from ..molior.queues import enqueue_aptly, enqueue_backend, buildlog, buildlogtitle, buildlogdone, BUILD_PRIORITIES
 
 
 async def BuildDebSrc(repo_id, repo_path, build_id, ci_version, is_ci, author, email):
@@ -276,7 +277,7 @@ async def PrepareBuilds(session, parent, repo, git_ref, ci_branch, custom_target
             elif existing_src_build.buildstate == "new" or existing_src_build.buildstate == "building" or \
                     existing_src_build.buildstate == "needs_publish" or existing_src_build.buildstate == "publishing":
                 logger.info(f"retry because of src build ({existing_src_build.id}) in new, building, needs_publish or publishing")
-                return BuildPreparationState.RETRY, info
+                return BuildPreparationState.RETRY, existing_src_build.id
             elif existing_src_build.buildstate == "build_failed" or existing_src_build.buildstate == "publish_failed":
                 logger.info(f"abort because of src build ({existing_src_build.id}) in state build_failed or publish_failed")
                 return BuildPreparationState.ERROR, info
@@ -398,7 +399,7 @@ async def PrepareBuilds(session, parent, repo, git_ref, ci_branch, custom_target
             elif existing_src_build.buildstate == "new" or existing_src_build.buildstate == "building" or \
                     existing_src_build.buildstate == "needs_publish" or existing_src_build.buildstate == "publishing":
                 logger.info(f"retry because of src build ({existing_src_build.id}) in new, building, needs_publish or publishing")
-                return BuildPreparationState.RETRY, info
+                return BuildPreparationState.RETRY, existing_src_build.id
             elif existing_src_build.buildstate == "build_failed" or existing_src_build.buildstate == "publish_failed":
                 logger.info(f"abort because of src build ({existing_src_build.id}) in state build_failed or publish_failed")
                 return BuildPreparationState.ERROR, info
@@ -483,7 +484,7 @@ async def PrepareBuilds(session, parent, repo, git_ref, ci_branch, custom_target
                 elif other_build.buildstate == "new" or other_build.buildstate == "building" or \
                         other_build.buildstate == "needs_publish" or other_build.buildstate == "publishing":
                     logger.info(f"retry because of src build ({other_build.id}) in new, building, needs_publish or publishing")
-                    return BuildPreparationState.RETRY, info
+                    return BuildPreparationState.RETRY, other_build.id
                 elif other_build.buildstate == "build_failed" or other_build.buildstate == "publish_failed":
                     await parent.set_already_failed()
                     session.commit()
@@ -498,6 +499,12 @@ async def PrepareBuilds(session, parent, repo, git_ref, ci_branch, custom_target
 
 
 async def CreateBuilds(session, parent, repo, info, git_ref, ci_branch, custom_targets, force_ci=False):
+    """
+    Creates the source and deb builds for a prepared build.
+
+    Returns:
+        int: The id of the source build to run, or None.
+    """
 
     # Use commiter name as maintainer for CI builds
     if parent.is_ci:
@@ -591,6 +598,7 @@ async def CreateBuilds(session, parent, repo, info, git_ref, ci_branch, custom_t
                 if deb_build.buildstate != "successful":
                     deb_build.buildstate = "needs_build"
                     session.commit()
+                    build_index.update(deb_build)
                     found = True  # FIXME: should this be here ?
                     continue
                 await parent.log("W: packages already built for {} {}\n".format(projectversion.fullname, architecture))
@@ -640,9 +648,7 @@ async def CreateBuilds(session, parent, repo, info, git_ref, ci_branch, custom_t
     build.projectversions = array2db([str(p) for p in projectversion_ids])
     session.commit()
 
-    build_id = build.id
-
-    await enqueue_task({"src_build": [build_id]})
+    return build.id
 
 
 async def BuildSourcePackage(build_id):
@@ -831,13 +837,42 @@ async def schedule_build(build, session):
                 project_version.name,
                 apt_urls,
                 apt_keys,
-                run_lintian
+                run_lintian,
+                get_build_priority(build)
             ]
         }
     )
     return True
 
 
+def get_build_priority(build):
+    """
+    Returns the priority class of a deb build.
+
+    The class stored with the build is used, e.g. for manual
+    rebuilds, otherwise the class configured for the projectversion,
+    or the one derived from the trigger (release tag or CI push).
+
+    Args:
+        build (molior.model.build.Build): The build.
+
+    Returns:
+        str: The priority class, see BUILD_PRIORITIES.
+    """
+    if build.priority in BUILD_PRIORITIES:
+        return build.priority
+
+    projectversions = Configuration().build_priorities.get("projectversions")
+    if projectversions and type(projectversions) is dict:
+        priority = projectversions.get(build.projectversion.fullname)
+        if priority in BUILD_PRIORITIES:
+            return priority
+
+    if build.is_ci:
+        return "ci"
+    return "release"
+
+
 def get_dependencies_recursive(dependencies, array):
     for dep in dependencies:
         if dep.project.is_mirror:
@@ -847,53 +882,88 @@ def get_dependencies_recursive(dependencies, array):
         get_dependencies_recursive(dep.dependencies, array)
 
 
+def load_build_index(session):
+    builds = session.query(Build.id, Build.buildstate, Build.sourcerepository_id, Build.projectversion_id).filter(
+                    Build.buildtype == "deb").all()
+    build_index.load(builds)
+
+
+async def resolve_build_dependencies(build, session):
+    """
+    Resolves the build order dependencies of a build to
+    source repository ids and stores them in the build index.
+
+    Returns:
+        bool: True if all dependencies were found, otherwise False.
+    """
+    projectversion = session.query(ProjectVersion).filter(
+            ProjectVersion.id == build.projectversion_id).first()
+    if not projectversion:
+        logger.warning("scheduler: projectversion %d not found", build.projectversion_id)
+        return False
+
+    pvname = projectversion.fullname
+    buildorder_projectversions = [build.projectversion_id]
+    get_dependencies_recursive(projectversion.dependencies, buildorder_projectversions)
+
+    repo_deps = []
+    if build.parent.builddeps:
+        builddeps = build.parent.builddeps
+        for builddep in builddeps:
+            repo_dep = None
+            for buildorder_projectversion in buildorder_projectversions:
+                repo_dep = session.query(SourceRepository).filter(SourceRepository.projectversions.any(
+                                         id=buildorder_projectversion)).filter(or_(
+                                            SourceRepository.url == builddep,
+                                            SourceRepository.url.like("%/{}".format(builddep)),
+                                            SourceRepository.url.like("%/{}.git".format(builddep)))).first()
+                if repo_dep:
+                    break
+
+            if not repo_dep:
+                logger.error("build-{}: dependency {} not found in projectversion {}".format(build.id,
+                             builddep, build.projectversion_id))
+                await build.log("E: dependency {} not found in projectversion {} nor dependencies\n".format(
+                                     builddep, pvname))
+                build_index.resolve(build.id, buildorder_projectversions, None)
+                return False
+            repo_deps.append(repo_dep.id)
+
+    build_index.resolve(build.id, buildorder_projectversions, repo_deps)
+    return True
+
+
 async def ScheduleBuilds():
+    """
+    Schedules the deb builds which need a build and got
+    affected by build state changes since the last run.
+    """
     with Session() as session:
+        if not build_index.loaded:
+            load_build_index(session)
+
+        build_ids = build_index.take_dirty()
+        if not build_ids:
+            return
 
-        needed_builds = session.query(Build).filter(Build.buildstate == "needs_build", Build.buildtype == "deb").all()
+        needed_builds = session.query(Build).filter(Build.id.in_(build_ids)).all()
         for build in needed_builds:
-            if not await chroot_ready(build, session):
+            if build.buildstate != "needs_build":
+                if build_index.is_needs_build(build.id):
+                    # state change not committed yet, check again on next run
+                    build_index.dirty.add(build.id)
                 continue
 
-            projectversion = session.query(ProjectVersion).filter(
-                    ProjectVersion.id == build.projectversion_id).first()
-            if not projectversion:
-                logger.warning("scheduler: projectversion %d not found", build.projectversion_id)
+            if not await chroot_ready(build, session):
+                build_index.wait_chroot(build.id)
                 continue
 
-            pvname = projectversion.fullname
-            buildorder_projectversions = [build.projectversion_id]
-            get_dependencies_recursive(projectversion.dependencies, buildorder_projectversions)
-#            for dep in projectversion.dependencies:
-#                if dep.project.is_mirror:
-#                    continue
-#                buildorder_projectversions.append(dep.id)
+            if build.id not in build_index.waiting:
+                if not await resolve_build_dependencies(build, session):
+                    continue
 
-            ready = True
-            repo_deps = []
-            if build.parent.builddeps:
-                builddeps = build.parent.builddeps
-                for builddep in builddeps:
-                    repo_dep = None
-                    for buildorder_projectversion in buildorder_projectversions:
-                        repo_dep = session.query(SourceRepository).filter(SourceRepository.projectversions.any(
-                                                 id=buildorder_projectversion)).filter(or_(
-                                                    SourceRepository.url == builddep,
-                                                    SourceRepository.url.like("%/{}".format(builddep)),
-                                                    SourceRepository.url.like("%/{}.git".format(builddep)))).first()
-                        if repo_dep:
-                            break
-
-                    if not repo_dep:
-                        logger.error("build-{}: dependency {} not found in projectversion {}".format(build.id,
-                                     builddep, build.projectversion_id))
-                        await build.log("E: dependency {} not found in projectversion {} nor dependencies\n".format(
-                                             builddep, pvname))
-                        ready = False
-                        break
-                    repo_deps.append(repo_dep.id)
-
-            if not ready:
+            buildorder_projectversions, repo_deps = build_index.waiting[build.id]
+            if repo_deps is None:
                 continue
 
             if not repo_deps:
@@ -901,62 +971,33 @@ async def ScheduleBuilds():
                 await schedule_build(build, session)
                 continue
 
+            pvname = None
+            ready = True
             for dep_repo_id in repo_deps:
-                dep_repo = session.query(SourceRepository).filter(SourceRepository.id == dep_repo_id).first()
-                if not dep_repo:
-                    logger.warning("scheduler: repo %d not found", dep_repo_id)
-                    continue
-
                 # FIXME: buildconfig arch dependent!
 
-                # find running builds in the same projectversion
-                # FIXME: check also dependencies which are not mirrors
-
                 # check no build order dep is needs_build, building, publishing, ...
                 # FIXME: this needs maybe checking of source packages as well?
-                running_builds = session.query(Build).filter(or_(
-                            Build.buildstate == "new",
-                            Build.buildstate == "needs_build",
-                            Build.buildstate == "scheduled",
-                            Build.buildstate == "building",
-                            Build.buildstate == "needs_publish",
-                            Build.buildstate == "publishing",
-                        ), Build.buildtype == "deb",
-                        Build.sourcerepository_id == dep_repo_id,
-                        Build.projectversion_id.in_(buildorder_projectversions)).all()
-
+                running_builds = build_index.running_builds(dep_repo_id, buildorder_projectversions)
                 if running_builds:
                     ready = False
-                    builds = [str(b.id) for b in running_builds]
+                    dep_repo = session.query(SourceRepository).filter(SourceRepository.id == dep_repo_id).first()
+                    if not pvname:
+                        pvname = build.projectversion.fullname
+                    builds = [str(b) for b in running_builds]
                     await build.log("W: waiting for repo {} to finish building ({}) in projectversion {} or dependencies\n".
-                                    format(dep_repo.name, ", ".join(builds), pvname))
+                                    format(dep_repo.name if dep_repo else dep_repo_id, ", ".join(builds), pvname))
                     continue
 
                 # find successful builds in the same and dependent projectversions
                 # FIXME: search same architecture as well
-                found = False
-                successful_builds = session.query(Build).filter(
-                        Build.buildstate == "successful",
-                        Build.buildtype == "deb",
-                        Build.sourcerepository_id == dep_repo_id,
-                        Build.projectversion_id.in_(buildorder_projectversions))
-                successful_builds = successful_builds.all()
-
-                if successful_builds:
-                    found = True
-
-                if not found:
+                if not build_index.has_successful(dep_repo_id, buildorder_projectversions):
                     ready = False
-                    projectversion = session.query(ProjectVersion).filter(
-                            ProjectVersion.id == build.projectversion_id).first()
-                    if not projectversion:
-                        pvname = "unknown"
-                        logger.warning("scheduler: projectversion %d not found", build.projectversion_id)
-                    else:
-                        pvname = projectversion.fullname
-
+                    dep_repo = session.query(SourceRepository).filter(SourceRepository.id == dep_repo_id).first()
+                    if not pvname:
+                        pvname = build.projectversion.fullname
                     await build.log("W: waiting for repo {} to be built in projectversion {} or dependencies\n".format(
-                                         dep_repo.name, pvname))
+                                         dep_repo.name if dep_repo else dep_repo_id, pvname))
                     continue
 
             if ready:
@@ -0,0 +1,78 @@
+"""
+Provides test molior aptly catalog cache.
+"""
+import asyncio
+
+from mock import patch
+
+from molior.aptly.catalog import AptlyCatalog, SNAPSHOT, REPO
+from molior.aptly.errors import AptlyError
+
+
+class FakeAptly:
+    def __init__(self):
+        self.snapshots = [{"Name": "snap-stable"}]
+        self.repos = [{"Name": "repo-stable"}]
+        self.listings = 0
+        self.catalog = None
+
+    async def snapshot_get(self):
+        self.listings += 1
+        # created while listing
+        self.catalog.added(SNAPSHOT, "snap-new")
+        return list(self.snapshots)
+
+    async def repo_get(self):
+        return list(self.repos)
+
+
+def test_catalog_lists_once():
+    """
+    Test names are listed once and kept up to date
+    """
+    aptly = FakeAptly()
+    catalog = AptlyCatalog(aptly)
+    aptly.catalog = catalog
+
+    async def run():
+        assert await catalog.has_snapshot("snap-stable")
+        assert await catalog.has_snapshot("snap-new")
+        assert await catalog.has_repo("repo-stable")
+        assert not await catalog.has_repo("repo-unstable")
+
+        catalog.renamed(SNAPSHOT, "snap-stable", "snap-old")
+        catalog.removed(REPO, "repo-stable")
+        assert not await catalog.has_snapshot("snap-stable")
+        assert await catalog.has_snapshot("snap-old")
+        assert not await catalog.has_repo("repo-stable")
+        assert aptly.listings == 1
+
+        catalog.invalidate()
+        assert await catalog.has_snapshot("snap-stable")
+        assert aptly.listings == 2
+
+    with patch("molior.aptly.catalog.get_aptly_setting", return_value=600):
+        asyncio.new_event_loop().run_until_complete(run())
+
+
+def test_catalog_invalidated_on_rejected_request():
+    """
+    Test the catalog is reloaded after aptly rejected a request
+    """
+    aptly = FakeAptly()
+    catalog = AptlyCatalog(aptly)
+    aptly.catalog = catalog
+
+    async def run():
+        assert await catalog.has_snapshot("snap-stable")
+        try:
+            with catalog.checked():
+                raise AptlyError("snapshot not found", "")
+        except AptlyError:
+            pass
+        assert catalog.loaded is None
+        assert await catalog.has_snapshot("snap-stable")
+        assert aptly.listings == 2
+
+    with patch("molior.aptly.catalog.get_aptly_setting", return_value=600):
+        asyncio.new_event_loop().run_until_complete(run())
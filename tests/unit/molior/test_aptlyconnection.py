@@ -0,0 +1,47 @@
+"""
+Provides test molior aptly connection sharing.
+"""
+import asyncio
+
+from aiohttp import web
+from mock import patch
+
+from molior.aptly import AptlyApi
+from molior.aptly.connection import AptlyConnections
+
+
+def test_aptly_requests_reuse_connection():
+    """
+    Test aptly requests share one keep-alive connection
+    """
+    async def version(request):
+        return web.json_response({"Version": "1.4.0"})
+
+    async def run():
+        server = web.Application()
+        server.router.add_get("/api/version", version)
+        runner = web.AppRunner(server)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = "http://127.0.0.1:{}/api".format(port)
+
+        connections = AptlyConnections()
+        with patch("molior.aptly.api.aptly_connections", connections):
+            api = AptlyApi(url, "a@b.c")
+            assert await api.version() == "1.4.0"
+            assert await api.version() == "1.4.0"
+
+        status = connections.status()["results"][0]
+        await connections.close()
+        await runner.cleanup()
+        return status
+
+    with patch("molior.aptly.connection.get_aptly_setting", side_effect=lambda name, default: default):
+        status = asyncio.new_event_loop().run_until_complete(run())
+
+    assert status["requests"] == 2
+    assert status["connections"] == 1
+    assert status["reused"] == 1
+    assert status["open"]
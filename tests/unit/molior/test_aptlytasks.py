@@ -0,0 +1,71 @@
+"""
+Provides test molior aptly task polling.
+"""
+import asyncio
+
+from mock import patch
+
+from molior.aptly.tasks import AptlyTaskPoller
+from molior.aptly.taskstate import TaskState
+
+
+class FakeAptly:
+    def __init__(self):
+        self.states = {}
+        self.requests = 0
+
+    async def get_tasks(self):
+        self.requests += 1
+        return [{"ID": task_id, "State": state} for task_id, state in self.states.items()]
+
+    async def get_task_state(self, task_id):
+        raise Exception("task not found")
+
+
+def test_tasks_polled_together():
+    """
+    Test all waited tasks are resolved by shared polls
+    """
+    aptly = FakeAptly()
+    aptly.states = {1: TaskState.RUNNING.value, 2: TaskState.RUNNING.value}
+    poller = AptlyTaskPoller(aptly)
+
+    async def finish():
+        await asyncio.sleep(0.3)
+        aptly.states[1] = TaskState.SUCCESSFUL.value
+        aptly.states[2] = TaskState.FAILED.value
+
+    async def run():
+        asyncio.ensure_future(finish())
+        return await asyncio.gather(poller.wait(1), poller.wait(2), poller.wait(3))
+
+    results = asyncio.new_event_loop().run_until_complete(run())
+    assert results == [TaskState.SUCCESSFUL.value, TaskState.FAILED.value, None]
+    assert aptly.requests < 6
+    assert not poller.waiting
+
+
+class FlakyAptly(FakeAptly):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    async def get_tasks(self):
+        if self.failures:
+            self.failures -= 1
+            raise Exception("connection reset")
+        return await super().get_tasks()
+
+
+def test_tasks_survive_listing_errors():
+    """
+    Test a failed listing of the tasks is retried
+    """
+    aptly = FlakyAptly(2)
+    aptly.states = {1: TaskState.SUCCESSFUL.value}
+    poller = AptlyTaskPoller(aptly)
+
+    with patch("molior.aptly.tasks.ERROR_POLL_INTERVAL", 0.01):
+        result = asyncio.new_event_loop().run_until_complete(poller.wait(1))
+    assert result == TaskState.SUCCESSFUL.value
+    assert aptly.requests == 1
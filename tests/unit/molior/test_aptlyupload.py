@@ -0,0 +1,123 @@
+"""
+Provides test molior aptly file uploads.
+"""
+import asyncio
+
+from aiohttp import web
+from mock import patch
+
+from molior.aptly import AptlyApi
+from molior.aptly.errors import AptlyError
+from molior.aptly.connection import AptlyConnections
+from molior.aptly.upload import split_uploads
+from molior.molior.debianrepository import get_package_files
+
+
+def test_split_uploads():
+    """
+    Test files are distributed over requests by size
+    """
+    sizes = {"a": 10, "b": 6, "c": 5, "d": 1}
+    batches = split_uploads(list(sizes.keys()), sizes, 2)
+    assert batches == [["a", "d"], ["b", "c"]]
+    assert split_uploads(["a"], sizes, 4) == [["a"]]
+
+
+def upload(tmp_path, files, skip=None):
+    """
+    Adds files to a repo on a fake aptly server
+    """
+    stored = {}
+    deleted = []
+
+    async def post_files(request):
+        names = []
+        reader = await request.multipart()
+        async for part in reader:
+            data = await part.read()
+            if part.filename == skip:
+                continue
+            stored[part.filename] = data
+            names.append("{}/{}".format(request.match_info["dir"], part.filename))
+        return web.json_response(names)
+
+    async def delete_files(request):
+        deleted.append(request.match_info["dir"])
+        return web.json_response({})
+
+    async def add_files(request):
+        return web.json_response({"ID": 1})
+
+    async def run():
+        server = web.Application()
+        server.router.add_post("/api/files/{dir}", post_files)
+        server.router.add_delete("/api/files/{dir}", delete_files)
+        server.router.add_post("/api/repos/{repo}/file/{dir}", add_files)
+        runner = web.AppRunner(server)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        connections = AptlyConnections()
+        try:
+            with patch("molior.aptly.api.aptly_connections", connections):
+                api = AptlyApi("http://127.0.0.1:{}/api".format(port), "a@b.c")
+                return await api.repo_add("repo", files)
+        finally:
+            await connections.close()
+            await runner.cleanup()
+
+    with patch("molior.aptly.connection.get_aptly_setting", side_effect=lambda name, default: default), \
+            patch("molior.aptly.api.get_upload_parallel", return_value=2):
+        try:
+            result = asyncio.new_event_loop().run_until_complete(run())
+        except AptlyError as exc:
+            result = exc
+    return result, stored, deleted
+
+
+def make_files(tmp_path):
+    files = []
+    for i in range(3):
+        path = tmp_path / "pkg{}.deb".format(i)
+        path.write_bytes(bytes([i]) * (300000 * (i + 1)))
+        files.append(str(path))
+    return files
+
+
+def test_repo_add_uploads_all_files(tmp_path):
+    """
+    Test files are uploaded completely before adding them
+    """
+    files = make_files(tmp_path)
+    result, stored, deleted = upload(tmp_path, files)
+    task_id, upload_dir = result
+    assert task_id == 1
+    assert sorted(stored.keys()) == ["pkg0.deb", "pkg1.deb", "pkg2.deb"]
+    assert stored["pkg2.deb"] == bytes([2]) * 900000
+    assert not deleted
+
+
+def test_repo_add_fails_on_missing_file(tmp_path):
+    """
+    Test nothing is added when a file was not stored
+    """
+    files = make_files(tmp_path)
+    result, stored, deleted = upload(tmp_path, files, skip="pkg1.deb")
+    assert isinstance(result, AptlyError)
+    assert "pkg1.deb" in str(result)
+    assert len(deleted) == 1
+
+
+def test_package_files(tmp_path):
+    """
+    Test only packages and their source files count as not added
+    """
+    dsc = tmp_path / "hello_1.0-1.dsc"
+    dsc.write_text("Source: hello\nFiles:\n abc 10 hello_1.0.orig.tar.gz\n def 5 hello_1.0-1.debian.tar.xz\n"
+                   "Checksums-Sha256:\n 123 10 hello_1.0.orig.tar.gz\n")
+    files = [str(dsc), str(tmp_path / "hello_1.0.orig.tar.gz"), str(tmp_path / "hello_1.0-1.debian.tar.xz"),
+             str(tmp_path / "hello_1.0-1_source.buildinfo"), str(tmp_path / "hello_1.0-1_amd64.deb")]
+    assert get_package_files(files) == {"hello_1.0-1.dsc", "hello_1.0.orig.tar.gz",
+                                        "hello_1.0-1.debian.tar.xz", "hello_1.0-1_amd64.deb"}
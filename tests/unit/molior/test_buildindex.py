@@ -0,0 +1,79 @@
+"""
+Provides test molior build index.
+"""
+from mock import MagicMock
+
+from molior.molior.buildindex import BuildIndex
+
+
+def deb_build(build_id, state, repo_id, projectversion_id):
+    build = MagicMock()
+    build.id = build_id
+    build.buildtype = "deb"
+    build.buildstate = state
+    build.sourcerepository_id = repo_id
+    build.projectversion_id = projectversion_id
+    return build
+
+
+def test_index_load():
+    """
+    Test waiting builds are dirty after loading
+    """
+    index = BuildIndex()
+    index.load([(1, "needs_build", 10, 100), (2, "successful", 11, 100), (3, "building", 12, 100)])
+
+    assert index.take_dirty() == {1}
+    assert index.take_dirty() == set()
+    assert index.has_successful(11, [100])
+    assert not index.has_successful(12, [100])
+    assert index.running_builds(12, [100, 101]) == [3]
+
+
+def test_index_dependency_change():
+    """
+    Test only builds depending on a changed repo get dirty
+    """
+    index = BuildIndex()
+    index.load([(1, "needs_build", 10, 100), (2, "needs_build", 20, 100), (3, "building", 12, 100)])
+    index.take_dirty()
+    index.resolve(1, [100], [12])
+    index.resolve(2, [100], [])
+
+    # no change in the active/successful class
+    index.update(deb_build(3, "publishing", 12, 100))
+    assert index.take_dirty() == set()
+
+    index.update(deb_build(3, "successful", 12, 100))
+    assert index.take_dirty() == {1}
+    assert index.running_builds(12, [100]) == []
+    assert index.has_successful(12, [100])
+
+
+def test_index_chroot_ready():
+    """
+    Test builds waiting for a chroot get dirty on chroot changes
+    """
+    index = BuildIndex()
+    index.load([(1, "needs_build", 10, 100)])
+    index.take_dirty()
+    index.wait_chroot(1)
+
+    chroot = MagicMock()
+    chroot.buildtype = "chroot"
+    index.update(chroot)
+    assert index.take_dirty() == {1}
+
+
+def test_index_scheduled_build_forgotten():
+    """
+    Test builds leaving needs_build are removed from the waiting builds
+    """
+    index = BuildIndex()
+    index.load([(1, "needs_build", 10, 100)])
+    index.resolve(1, [100], [12])
+    index.update(deb_build(1, "scheduled", 10, 100))
+
+    assert 1 not in index.waiting
+    assert index.dependents == {}
+    assert index.take_dirty() == set()
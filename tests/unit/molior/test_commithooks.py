@@ -0,0 +1,44 @@
+"""
+Provides test molior wakeups after database commits.
+"""
+from mock import patch
+from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+
+from molior.model.database import wakeup_after_commit
+
+Base = declarative_base()
+
+
+class Thing(Base):
+    __tablename__ = "thing"
+    id = Column(Integer, primary_key=True)
+    state = Column(String)
+
+
+def test_wakeup_after_commit():
+    """
+    Test waiting tasks are woken up only after a commit
+    """
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    thing = Thing()
+    session.add(thing)
+    session.commit()
+
+    woken = []
+    with patch("molior.model.database.commit_hooks", [woken.append]):
+        wakeup_after_commit(thing, "thing_1")
+        assert woken == []
+        session.commit()
+        assert woken == [{"thing_1"}]
+
+        thing.state = "busy"
+        session.flush()
+        wakeup_after_commit(thing, "thing_2")
+        session.rollback()
+        session.commit()
+        assert woken == [{"thing_1"}]
+    session.close()
@@ -8,6 +8,7 @@ from mock import patch, Mock, MagicMock, PropertyMock
 
 from molior.molior.debianrepository import DebianRepository
 from molior.aptly.api import get_snapshot_name
+from molior.aptly.catalog import AptlyCatalog
 
 
 def test_publish_name():
@@ -272,7 +273,8 @@ def test_init():
             "molior.aptly.api.get_snapshot_name") as get_snapshot_name, patch.object(
             DebianRepository, "publish_name", new_callable=PropertyMock) as publish_name_mock, patch.object(
             DebianRepository, "name", new_callable=PropertyMock) as name_mock, patch(
-            "molior.molior.debianrepository.logger"):
+            "molior.molior.debianrepository.logger"), patch(
+            "molior.aptly.catalog.get_aptly_setting", return_value=600):
 
         get_snapshot_name.return_value = "stretch_9.2_test_2-stable"
         name_mock.return_value = "stretch-9.2-test-2"
@@ -280,6 +282,7 @@ def test_init():
 
         aptly_connection = MagicMock()
         get_aptly_connection.return_value = aptly_connection
+        aptly_connection.catalog = AptlyCatalog(aptly_connection)
         aptly_connection.snapshot_create = Mock(
             side_effect=asyncio.coroutine(lambda a, b: 37)
         )
@@ -332,7 +335,8 @@ def test_init_exists():
             "molior.aptly.api.get_snapshot_name") as get_snapshot_name, patch.object(
             DebianRepository, "publish_name", new_callable=PropertyMock) as publish_name_mock, patch.object(
             DebianRepository, "name", new_callable=PropertyMock) as name_mock, patch(
-            "molior.molior.debianrepository.logger"):
+            "molior.molior.debianrepository.logger"), patch(
+            "molior.aptly.catalog.get_aptly_setting", return_value=600):
 
         name_mock.return_value = "stretch-9.2-test-2"
         publish_name_mock.return_value = "stretch_9.2_repos_test_2"
@@ -341,6 +345,7 @@ def test_init_exists():
 
         aptly_connection = MagicMock()
         get_aptly_connection.return_value = aptly_connection
+        aptly_connection.catalog = AptlyCatalog(aptly_connection)
         aptly_connection.snapshot_get = Mock(
             side_effect=asyncio.coroutine(
                 lambda: [{"Name": "stretch_9.2_test_2-stable"}]
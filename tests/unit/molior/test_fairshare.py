@@ -0,0 +1,57 @@
+"""
+Provides test molior fair share scheduling.
+"""
+from mock import patch
+
+from molior.molior.fairshare import FairShare
+
+
+def test_fairshare_weights():
+    """
+    Test groups are served in proportion to their weights
+    """
+    with patch("molior.molior.fairshare.Configuration") as cfg:
+        cfg.return_value.fair_share = {"weights": {"big": 2}}
+        fair_share = FairShare()
+
+        served = {"big": 0, "small": 0}
+        for build_id in range(30):
+            group = fair_share.select(["big", "small"])
+            fair_share.dispatched("buildtask_amd64", group, build_id)
+            served[group] += 1
+
+    assert served == {"big": 20, "small": 10}
+
+
+def test_fairshare_idle_group_catches_up_fairly():
+    """
+    Test a group returning from idle does not get all nodes
+    """
+    with patch("molior.molior.fairshare.Configuration") as cfg:
+        cfg.return_value.fair_share = {}
+        fair_share = FairShare()
+
+        for build_id in range(100):
+            fair_share.dispatched("buildtask_amd64", "busy", build_id)
+
+        served = {"busy": 0, "new": 0}
+        for build_id in range(100, 110):
+            group = fair_share.select(["busy", "new"])
+            fair_share.dispatched("buildtask_amd64", group, build_id)
+            served[group] += 1
+
+    assert served == {"busy": 5, "new": 5}
+
+
+def test_fairshare_running():
+    """
+    Test finished builds are removed from the running builds
+    """
+    with patch("molior.molior.fairshare.Configuration") as cfg:
+        cfg.return_value.fair_share = {}
+        fair_share = FairShare()
+        fair_share.dispatched("buildtask_amd64", "a", 1)
+        fair_share.dispatched("buildtask_amd64", "a", 2)
+        fair_share.finished(1)
+
+    assert fair_share.running == {2: ("buildtask_amd64", "a")}
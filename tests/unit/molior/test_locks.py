@@ -0,0 +1,48 @@
+"""
+Provides test molior resource locks.
+"""
+import asyncio
+
+from molior.molior.locks import ResourceLocks
+
+
+def test_locks_serialize_same_resource():
+    """
+    Test tasks on the same resource run one after the other
+    """
+    locks = ResourceLocks()
+    events = []
+
+    async def task(name, resource):
+        async with locks.hold(resource):
+            events.append("start " + name)
+            await asyncio.sleep(0)
+            events.append("end " + name)
+
+    async def run():
+        await asyncio.gather(task("a", "repo_1"), task("b", "repo_1"))
+
+    asyncio.new_event_loop().run_until_complete(run())
+    assert events == ["start a", "end a", "start b", "end b"]
+    assert locks.locks == {}
+
+
+def test_locks_independent_resources():
+    """
+    Test tasks on different resources run in parallel
+    """
+    locks = ResourceLocks()
+    events = []
+
+    async def task(name, resource):
+        async with locks.hold(resource):
+            events.append("start " + name)
+            await asyncio.sleep(0)
+            events.append("end " + name)
+
+    async def run():
+        await asyncio.gather(task("a", "repo_1"), task("b", "repo_2"))
+
+    asyncio.new_event_loop().run_until_complete(run())
+    assert events == ["start a", "start b", "end a", "end b"]
+    assert not locks.locked("repo_1")
@@ -0,0 +1,59 @@
+"""
+Provides test molior build log index.
+"""
+from molior.molior.logindex import LogIndex, append_log_index, read_log_index
+
+
+LOG = (
+    "\x1b[36m\x1b[1m" + 80 * "+" + "\x1b[0m\n"
+    "\x1b[36m\x1b[1m| molior: Source Build                         Tue, 06 Oct 2026 10:00:00 +0200 |\x1b[0m\n"
+    "\x1b[36m\x1b[1m" + 80 * "+" + "\x1b[0m\n"
+    "I: building\n"
+    "+------------------------------------------------------------------------------+\n"
+    "| Fetch source files                                                           |\n"
+    "+------------------------------------------------------------------------------+\n"
+    "W: unused dependency\n"
+    "dpkg-buildpackage: error: debian/rules build subprocess returned exit status 2\n"
+    "| not a phase |\n"
+    "Status: attempted\n"
+    "E: no newline"
+).encode()
+
+
+def test_logindex_chunks():
+    """
+    Test notable lines are indexed with their offsets, independent of the chunks
+    """
+    expected = [
+        {"offset": LOG.index(b"\x1b[36m\x1b[1m| molior"), "type": "section", "text": "Source Build"},
+        {"offset": LOG.index(b"| Fetch"), "type": "phase", "text": "Fetch source files"},
+        {"offset": LOG.index(b"W: "), "type": "warning", "text": "W: unused dependency"},
+        {"offset": LOG.index(b"dpkg-"), "type": "error",
+         "text": "dpkg-buildpackage: error: debian/rules build subprocess returned exit status 2"},
+        {"offset": LOG.index(b"Status"), "type": "error", "text": "Status: attempted"},
+        {"offset": LOG.index(b"E: "), "type": "error", "text": "E: no newline"},
+    ]
+    for chunk_size in [1, 7, 100, len(LOG)]:
+        index = LogIndex()
+        entries = []
+        for i in range(0, len(LOG), chunk_size):
+            entries += index.scan(LOG[i:i + chunk_size])
+        entries += index.finish()
+        assert entries == expected
+        assert index.offset == len(LOG)
+
+
+def test_logindex_resumes_at_offset(tmp_path):
+    """
+    Test an index continued at the end of an existing log and stored next to it
+    """
+    index = LogIndex(offset=1000)
+    entries = index.scan(b"I: rebuild\nE: failed again\n")
+    assert entries == [{"offset": 1011, "type": "error", "text": "E: failed again"}]
+
+    path = str(tmp_path / "build.log")
+    append_log_index(path, entries)
+    append_log_index(path, [{"offset": 1100, "type": "section", "text": "Done"}])
+    assert read_log_index(path, ["error"]) == entries
+    assert len(read_log_index(path)) == 2
+    assert read_log_index(str(tmp_path / "missing.log")) == []
@@ -0,0 +1,199 @@
+"""
+Provides test molior build log writer.
+"""
+import asyncio
+
+from mock import patch
+
+from molior.molior.logwriter import LogWriter, compress_log, decompress_log, find_log_file, find_line_offset, get_log_size
+from molior.molior.logwriter import open_log_file, read_log
+
+
+class FakeFile:
+    contents = {}
+    open_files = 0
+    max_open_files = 0
+
+    def __init__(self, filename, mode):
+        self.filename = filename
+        FakeFile.contents.setdefault(filename, "")
+
+    async def open(self):
+        FakeFile.open_files += 1
+        FakeFile.max_open_files = max(FakeFile.max_open_files, FakeFile.open_files)
+
+    async def close(self):
+        FakeFile.open_files -= 1
+
+    async def fsync(self):
+        pass
+
+
+def fake_writer(afp):
+    async def write(data):
+        FakeFile.contents[afp.filename] += data
+    return write
+
+
+def test_logwriter_multiplexes_builds():
+    """
+    Test the logs of many builds are written completely with few open files
+    """
+    settings = {"max_buffer": 1, "max_open_files": 2, "flush_interval": 0}
+    done = []
+
+    async def logging_done(build_id):
+        done.append(build_id)
+
+    writer = LogWriter(logging_done)
+
+    async def build(build_id):
+        for i in range(100):
+            await writer.put(build_id, "line %d %s\n" % (i, 30 * "x"))
+            # a buffer takes messages until it is full
+            assert writer.buffers[build_id].size < 1024 + 40
+        await writer.put(build_id, None)
+        await writer.put(build_id, False)
+
+    async def run():
+        await asyncio.gather(*[build(build_id) for build_id in range(5)])
+        while writer.buffers:
+            await asyncio.sleep(0.01)
+        writer.task.cancel()
+        try:
+            await writer.task
+        except asyncio.CancelledError:
+            pass
+
+    with patch("molior.molior.logwriter.get_log_file_path", side_effect=lambda build_id: "%d/build.log" % build_id), \
+            patch("molior.molior.logwriter.get_buildlog_setting", side_effect=lambda name, default: settings[name]), \
+            patch("molior.molior.logwriter.get_buildlog_compression", return_value=None), \
+            patch("molior.molior.logwriter.AIOFile", FakeFile), \
+            patch("molior.molior.logwriter.Writer", fake_writer):
+        asyncio.new_event_loop().run_until_complete(run())
+
+    assert sorted(done) == list(range(5))
+    assert FakeFile.open_files == 0
+    assert FakeFile.max_open_files == 2
+    for build_id in range(5):
+        assert FakeFile.contents["%d/build.log" % build_id] == "".join(["line %d %s\n" % (i, 30 * "x") for i in range(100)])
+
+
+def test_logwriter_publishes_to_subscribers():
+    """
+    Test subscribers receive the written chunks and the end of finished builds
+    """
+    settings = {"max_buffer": 1024, "max_open_files": 2, "flush_interval": 0}
+    received = []
+
+    async def logging_done(build_id):
+        pass
+
+    writer = LogWriter(logging_done)
+
+    async def run():
+        subscription = writer.subscribe(7)
+        await writer.put(7, "hello\n")
+        writer.set_finished(7, True)
+        await writer.put(7, "bye\n")
+        await writer.put(7, False)
+        while True:
+            item = await subscription.get()
+            received.append(item)
+            if item is None:
+                break
+        writer.task.cancel()
+        try:
+            await writer.task
+        except asyncio.CancelledError:
+            pass
+
+    FakeFile.contents["7/build.log"] = ""
+    with patch("molior.molior.logwriter.get_log_file_path", side_effect=lambda build_id: "%d/build.log" % build_id), \
+            patch("molior.molior.logwriter.get_buildlog_setting", side_effect=lambda name, default: settings[name]), \
+            patch("molior.molior.logwriter.get_buildlog_compression", return_value=None), \
+            patch("molior.molior.logwriter.AIOFile", FakeFile), \
+            patch("molior.molior.logwriter.Writer", fake_writer):
+        asyncio.new_event_loop().run_until_complete(run())
+
+    assert received == [(0, b"hello\nbye\n"), None]
+    assert writer.subscribers == {}
+
+
+def test_logwriter_evict_keeps_subscribers():
+    """
+    Test closing the file of a finished build does not end its log
+    """
+    settings = {"max_buffer": 1024, "max_open_files": 1, "flush_interval": 0}
+
+    async def logging_done(build_id):
+        pass
+
+    writer = LogWriter(logging_done)
+
+    async def wait_written():
+        while writer.buffers:
+            await asyncio.sleep(0.01)
+
+    async def run():
+        subscription = writer.subscribe(7)
+        await writer.put(7, "hello\n")
+        writer.set_finished(7, True)
+        await wait_written()
+        # the file of build 7 is closed to open the one of build 8
+        await writer.put(8, "other\n")
+        await wait_written()
+        assert 7 not in writer.files
+        assert await subscription.get() == (0, b"hello\n")
+        assert subscription.queue.empty()
+
+        await writer.put(7, False)
+        assert await subscription.get() is None
+        writer.task.cancel()
+        try:
+            await writer.task
+        except asyncio.CancelledError:
+            pass
+
+    FakeFile.contents["7/build.log"] = ""
+    with patch("molior.molior.logwriter.get_log_file_path", side_effect=lambda build_id: "%d/build.log" % build_id), \
+            patch("molior.molior.logwriter.get_buildlog_setting", side_effect=lambda name, default: settings[name]), \
+            patch("molior.molior.logwriter.get_buildlog_compression", return_value=None), \
+            patch("molior.molior.logwriter.AIOFile", FakeFile), \
+            patch("molior.molior.logwriter.Writer", fake_writer):
+        asyncio.new_event_loop().run_until_complete(run())
+
+    assert writer.subscribers == {}
+
+
+def test_compressed_log_is_read_transparently(tmp_path):
+    """
+    Test completed logs are compressed and read, resumed and decompressed transparently
+    """
+    path = tmp_path / "build.log"
+    content = "".join(["line %d\n" % i for i in range(1000)]).encode()
+    path.write_bytes(content)
+
+    filename = compress_log(str(path), "gzip")
+    assert filename == tmp_path / "build.log.gz"
+    assert not path.is_file()
+    assert find_log_file(str(path)) == (filename, "gzip")
+    assert get_log_size(filename, "gzip") == len(content)
+    size_file = tmp_path / "build.log.size"
+    assert size_file.read_text() == str(len(content))
+    size_file.rename(tmp_path / "size")
+    assert get_log_size(filename, "gzip") == len(content)
+    (tmp_path / "size").rename(size_file)
+
+    with open_log_file(filename, "gzip") as f:
+        assert find_line_offset(f, 2) == content.index(b"line 998\n")
+
+    async def read(offset):
+        return b"".join([data async for data in read_log(str(path), offset=offset, chunk_size=100)])
+
+    assert asyncio.new_event_loop().run_until_complete(read(5)) == content[5:]
+
+    decompress_log(str(path))
+    assert path.read_bytes() == content
+    assert find_log_file(str(path)) == (path, None)
+    assert not size_file.is_file()
@@ -0,0 +1,94 @@
+"""
+Provides test molior build node selection policies.
+"""
+from mock import MagicMock
+
+from molior.backends.http.policy import NodePolicy, ResourcePolicy, GB
+
+
+def make_node(name, load=0.0, cores=4, ram_total=16, ram_used=0, disk_total=100, disk_used=0):
+    node = MagicMock()
+    node.molior_node_name = name
+    node.molior_load = [load * cores, 0, 0]
+    node.molior_cpu_cores = cores
+    node.molior_ram_total = ram_total * GB
+    node.molior_ram_used = ram_used * GB
+    node.molior_disk_total = disk_total * GB
+    node.molior_disk_used = disk_used * GB
+    node.molior_slots = 1
+    node.molior_builds = {}
+    return node
+
+
+def test_idle_policy_selects_longest_idle():
+    """
+    Test the idle policy keeps the previous behavior
+    """
+    nodes = [make_node("new"), make_node("old")]
+    node, reason, skipped = NodePolicy({}).select(nodes)
+    assert node.molior_node_name == "old"
+    assert skipped == []
+
+
+def test_resource_policy_prefers_free_node():
+    """
+    Test the least loaded node with most free resources is selected
+    """
+    nodes = [make_node("busy", load=1.0, ram_used=12), make_node("free", load=0.1)]
+    node, reason, skipped = ResourcePolicy({}).select(nodes)
+    assert node.molior_node_name == "free"
+    assert reason.startswith("load 0.10 per core")
+
+
+def test_resource_policy_skips_nodes_below_thresholds():
+    """
+    Test nodes without enough disk or RAM, or with too much load are skipped
+    """
+    nodes = [make_node("disk", disk_used=95),
+             make_node("ram", ram_used=15.5),
+             make_node("load", load=3)]
+    policy = ResourcePolicy({"min_free_disk": 10, "min_free_ram": 1, "max_load": 2})
+    node, reason, skipped = policy.select(nodes)
+    assert node is None
+    assert [(n.molior_node_name, r) for n, r in skipped] == [
+        ("disk", "5.0 GB disk free"),
+        ("ram", "0.5 GB RAM free"),
+        ("load", "load 3.00 per core above 2.00")]
+
+
+def test_resource_policy_without_telemetry():
+    """
+    Test nodes not having reported their resources yet are usable
+    """
+    node = make_node("unknown", ram_total=0, disk_total=0)
+    node.molior_load = 0
+    selected, reason, skipped = ResourcePolicy({}).select([node])
+    assert selected is node
+    assert reason == "load 0.00 per core"
+
+
+def test_resource_policy_prefers_free_slots():
+    """
+    Test builds are spread over the nodes with free build slots
+    """
+    nodes = [make_node("full"), make_node("empty")]
+    for node in nodes:
+        node.molior_slots = 4
+    nodes[0].molior_builds = {1: {}, 2: {}, 3: {}}
+    node, reason, skipped = ResourcePolicy({}).select(nodes)
+    assert node.molior_node_name == "empty"
+    assert reason.endswith("4 of 4 slots free")
+
+
+def test_node_status_changed_thresholds():
+    """
+    Test node status updates are sent for state changes and large telemetry changes only
+    """
+    from molior.backends.http.http import node_status_changed
+
+    status = {"id": "n1", "state": "idle", "uptime_seconds": 100, "load": [0.5, 0.5, 0.5],
+              "ram_used": 2 * GB, "disk_used": 20 * GB, "sourcename": "", "sourceversion": "", "sourcearch": ""}
+    assert not node_status_changed(status, dict(status, uptime_seconds=104, load=[0.6, 0.5, 0.5], ram_used=2.1 * GB))
+    assert node_status_changed(status, dict(status, state="busy"))
+    assert node_status_changed(status, dict(status, load=[1.0, 0.5, 0.5]))
+    assert node_status_changed(status, dict(status, disk_used=22 * GB))
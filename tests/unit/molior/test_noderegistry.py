@@ -0,0 +1,120 @@
+"""
+Provides test molior build node registry and heartbeat.
+"""
+import asyncio
+
+from mock import MagicMock, patch
+
+from molior.backends.http.registry import NodeRegistry
+from molior.backends.http.heartbeat import HeartbeatWheel
+
+
+def make_node(name, slots=1):
+    node = MagicMock()
+    node.molior_node_name = name
+    node.molior_nodeid = None
+    node.molior_slots = slots
+    node.molior_builds = {}
+    return node
+
+
+def test_registry_keeps_idle_order():
+    """
+    Test idle nodes are returned longest idle last, and builds are indexed
+    """
+    registry = NodeRegistry()
+    registry.add_pool("amd64")
+    first = make_node("first")
+    second = make_node("second")
+    registry.add(first, "amd64")
+    registry.add(second, "amd64")
+    assert registry.get_idle("amd64") == [second, first]
+
+    registry.start_build(first, 1, {})
+    assert registry.get_idle("amd64") == [second]
+    assert registry.get_busy("amd64") == [first]
+    assert registry.find_build(1) is first
+    assert registry.has_nodes("amd64")
+
+    assert registry.finish_build(first, 1)
+    assert registry.get_idle("amd64") == [first, second]
+    assert registry.get_busy("amd64") == []
+    assert registry.find_build(1) is None
+
+
+def test_registry_remove_returns_builds():
+    """
+    Test a node with free slots stays idle and its builds are returned on removal
+    """
+    registry = NodeRegistry()
+    node = make_node("node", slots=2)
+    registry.add(node, "arm64")
+    registry.set_node_id(node, "abc")
+    registry.start_build(node, 7, {})
+    assert registry.is_idle(node)
+    assert registry.get("abc") is node
+
+    connected, idle, build_ids = registry.remove(node)
+    assert connected and idle
+    assert build_ids == [7]
+    assert registry.get("abc") is None
+    assert registry.find_build(7) is None
+    assert not registry.has_nodes("arm64")
+    assert registry.remove(node) == (False, False, [])
+
+
+def test_stranded_buildtasks_move_to_compatible_pool():
+    """
+    Test the build tasks of a pool left without nodes go to a compatible pool
+    """
+    from molior.backends.http.http import move_stranded_buildtasks
+
+    registry = NodeRegistry()
+    node = make_node("node")
+    registry.add(node, "i386")
+    pools = {"amd64": ["i386"]}
+
+    with patch("molior.backends.http.http.registry", registry), \
+            patch("molior.backends.http.http.POOLS", pools), \
+            patch("molior.backends.http.http.move_buildtasks", return_value=2) as move_buildtasks:
+        move_stranded_buildtasks("i386")
+        move_buildtasks.assert_not_called()
+
+        registry.remove(node)
+        move_stranded_buildtasks("i386")
+        move_buildtasks.assert_called_once_with("i386", "amd64")
+
+        move_stranded_buildtasks("arm64")
+        move_buildtasks.assert_called_once()
+
+
+def test_heartbeat_expires_silent_nodes():
+    """
+    Test nodes are pinged once per timeout and expire without pong
+    """
+    pinged = []
+    expired = []
+
+    async def ping(nodes):
+        pinged.extend(nodes)
+
+    async def timeout(node):
+        expired.append(node)
+
+    async def run():
+        wheel = HeartbeatWheel(2, ping, timeout)
+        wheel.add("a")
+        wheel.add("b")
+        assert wheel.status()["buckets"] == [1, 1]
+
+        await wheel.check()
+        await wheel.check()
+        assert sorted(pinged) == ["a", "b"]
+
+        wheel.pong("a")
+        await wheel.check()
+        await wheel.check()
+        assert expired == ["b"]
+        assert wheel.status()["nodes"] == 1
+
+    asyncio.new_event_loop().run_until_complete(run())
@@ -1,7 +1,7 @@
 import asyncio
 
 # from urllib.parse import quote_plus
-from mock import patch, MagicMock, Mock, mock_open
+from mock import patch, MagicMock, mock_open
 
 from molior.model.build import Build
 from molior.molior.worker_notification import NotificationWorker
@@ -48,8 +48,9 @@ def test_build_changed_url_encoding():
             # "molior.molior.worker_notification.trigger_hook", side_effect=asyncio.coroutine(
             #     lambda method, url, skip_ssl, body: None)
             # ) as trigger_hook, patch(
-            "molior.molior.worker_notification.app") as app, patch(
+            "molior.molior.worker_notification.event_dispatcher") as event_dispatcher, patch(
             "molior.molior.worker_notification.Session") as Session, patch(
+            "molior.model.build.wakeup_after_commit"), patch(
             "molior.molior.configuration.open", mock_open(read_data="{'hostname': 'testhostname'}")):
         cfg.return_value.hostname = "localhost"
 
@@ -66,13 +67,15 @@ def test_build_changed_url_encoding():
         Session.return_value = enter
         Session().__enter__().query().filter().first().return_value = build
 
-        app.websocket_broadcast = Mock(side_effect=asyncio.coroutine(lambda msg: None))
         loop = asyncio.get_event_loop()
         notification_worker = NotificationWorker()
         asyncio.ensure_future(notification_worker.run())
         loop.run_until_complete(Build.build_changed(build))
+        loop.run_until_complete(asyncio.sleep(0.1))
 
         Session.assert_called()
+        event_dispatcher.dispatch.assert_called()
+        assert event_dispatcher.dispatch.call_args[0][2] == build.data()
 
         # trigger_hook.assert_called_with(
         #     "get",
@@ -0,0 +1,146 @@
+"""
+Provides test molior websocket subscriptions.
+"""
+import json
+import asyncio
+
+from mock import patch
+
+from molior.molior.notifier import Subject, Event
+from molior.molior.subscriptions import EventDispatcher, RESYNC_CLOSE_CODE
+
+
+class FakeWebsocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send_str(self, text):
+        self.messages.append(json.loads(text))
+
+
+def test_subscriptions_filter_and_coalesce():
+    """
+    Test clients receive the merged notifications of their topics only
+    """
+    dispatcher = EventDispatcher()
+    everything = FakeWebsocket()
+    project = FakeWebsocket()
+    nodes = FakeWebsocket()
+
+    async def run():
+        dispatcher.add_client(everything)
+        dispatcher.add_client(project)
+        dispatcher.add_client(nodes)
+        assert dispatcher.subscribe(project, ["project:foo"])
+        assert dispatcher.subscribe(nodes, ["node"])
+        dispatcher.dispatch(Subject.build.value, Event.added.value, {"id": 1, "buildstate": "new"}, ["project:foo"])
+        dispatcher.dispatch(Subject.build.value, Event.changed.value, {"id": 1, "buildstate": "building"}, ["project:foo"])
+        dispatcher.dispatch(Subject.build.value, Event.changed.value, {"id": 2, "buildstate": "building"}, ["project:bar"])
+        dispatcher.dispatch(Subject.build.value, Event.changed.value, {"id": 1, "progress": 50})
+        dispatcher.dispatch(Subject.node.value, Event.changed.value, [{"id": "n1", "state": "idle"}])
+        dispatcher.dispatch(Subject.node.value, Event.changed.value, [{"id": "n1", "state": "busy"}])
+        await dispatcher.task
+        while dispatcher.status()["queued"]:
+            await asyncio.sleep(0)
+        for ws in [everything, project, nodes]:
+            dispatcher.remove_client(ws)
+        await asyncio.sleep(0)
+
+    with patch("molior.molior.subscriptions.get_coalesce_window", return_value=0), \
+            patch("molior.molior.subscriptions.get_websocket_setting", return_value=1000), \
+            patch("molior.molior.subscriptions.get_overflow_policy", return_value="drop_oldest"):
+        asyncio.new_event_loop().run_until_complete(run())
+
+    build1 = {"subject": Subject.build.value, "event": Event.added.value,
+              "data": {"id": 1, "buildstate": "building", "progress": 50}}
+    build2 = {"subject": Subject.build.value, "event": Event.changed.value, "data": {"id": 2, "buildstate": "building"}}
+    node_list = {"subject": Subject.node.value, "event": Event.changed.value, "data": [{"id": "n1", "state": "busy"}]}
+    assert everything.messages == [build1, build2, node_list]
+    assert project.messages == [build1]
+    assert nodes.messages == [node_list]
+
+
+def test_opt_in_notifications():
+    """
+    Test node deltas are sent only to clients subscribed to them
+    """
+    dispatcher = EventDispatcher()
+    everything = FakeWebsocket()
+    deltas = FakeWebsocket()
+
+    async def run():
+        dispatcher.add_client(everything)
+        dispatcher.add_client(deltas)
+        assert dispatcher.subscribe(deltas, ["node:delta"])
+        dispatcher.dispatch(Subject.node.value, Event.changed.value, {"id": "n1", "state": "busy"}, ["node:delta"],
+                            opt_in=True)
+        dispatcher.dispatch(Subject.node.value, Event.changed.value, [{"id": "n1", "state": "busy"}])
+        await dispatcher.task
+        while dispatcher.status()["queued"]:
+            await asyncio.sleep(0)
+        for ws in [everything, deltas]:
+            dispatcher.remove_client(ws)
+        await asyncio.sleep(0)
+
+    with patch("molior.molior.subscriptions.get_coalesce_window", return_value=0), \
+            patch("molior.molior.subscriptions.get_websocket_setting", return_value=1000), \
+            patch("molior.molior.subscriptions.get_overflow_policy", return_value="drop_oldest"):
+        asyncio.new_event_loop().run_until_complete(run())
+
+    delta = {"subject": Subject.node.value, "event": Event.changed.value, "data": {"id": "n1", "state": "busy"}}
+    node_list = {"subject": Subject.node.value, "event": Event.changed.value, "data": [{"id": "n1", "state": "busy"}]}
+    assert everything.messages == [node_list]
+    assert deltas.messages == [delta]
+
+
+class SlowWebsocket(FakeWebsocket):
+    def __init__(self):
+        super().__init__()
+        self.sending = asyncio.Event()
+        self.closed = None
+
+    async def send_str(self, text):
+        await self.sending.wait()
+        await super().send_str(text)
+
+    async def close(self, code, message):
+        self.closed = code
+
+
+def test_slow_client_does_not_block_others():
+    """
+    Test the send queue of a slow client drops the oldest notifications, or disconnects the client
+    """
+    dispatcher = EventDispatcher()
+    fast = FakeWebsocket()
+    slow = SlowWebsocket()
+    stalled = SlowWebsocket()
+    settings = {"max_queue": 100}
+
+    async def run():
+        with patch("molior.molior.subscriptions.get_overflow_policy", return_value="drop_oldest"):
+            dispatcher.add_client(fast)
+            settings["max_queue"] = 3
+            dispatcher.add_client(slow)
+        with patch("molior.molior.subscriptions.get_overflow_policy", return_value="disconnect"):
+            dispatcher.add_client(stalled)
+        for build_id in range(10):
+            dispatcher.dispatch(Subject.build.value, Event.changed.value, {"id": build_id})
+        await dispatcher.task
+        await asyncio.sleep(0)
+        assert len(fast.messages) == 10
+        assert dispatcher.clients[slow].dropped > 0
+        slow.sending.set()
+        while dispatcher.clients[slow].queue:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        for ws in [fast, slow, stalled]:
+            dispatcher.remove_client(ws)
+        await asyncio.sleep(0)
+
+    with patch("molior.molior.subscriptions.get_coalesce_window", return_value=0), \
+            patch("molior.molior.subscriptions.get_websocket_setting", side_effect=lambda name, default: settings[name]):
+        asyncio.new_event_loop().run_until_complete(run())
+
+    assert [m["data"]["id"] for m in slow.messages] == [7, 8, 9]
+    assert stalled.closed == RESYNC_CLOSE_CODE